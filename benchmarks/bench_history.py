@@ -0,0 +1,95 @@
+"""
+Benchmark of the history store.
+
+Appends a few hours of synthetic snapshots (one every 2 seconds) and
+measures the cost of an append, of seeking to a frame and of range
+queries by time, flight id and bounds.
+
+Usage:
+    python benchmarks/bench_history.py
+"""
+from typing import Callable, List
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "final_app"))
+from history import HistoryStore  # noqa: E402
+from snapshot import FlightTable  # noqa: E402
+from synthetic import SyntheticClient  # noqa: E402
+
+
+N_FLIGHTS = 5_000
+HOURS = 2
+INTERVAL = 2.0
+# Distinct snapshots generated, reused cyclically to keep the run short
+N_SNAPSHOTS = 30
+
+
+def timings_ms(function: Callable[[], object], repeat: int = 20) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(1000 * (time.perf_counter() - start))
+    return timings
+
+
+def report(name: str, timings: List[float]) -> None:
+    p50, p99 = np.percentile(timings, [50, 99])
+    print(f"{name:<28} p50 {p50:8.2f} ms   p99 {p99:8.2f} ms")
+
+
+def main() -> None:
+    client = SyntheticClient(N_FLIGHTS, speed=None)
+    client.set_flight_tracker_config(limit=N_FLIGHTS)
+    tables = []
+    for _ in range(N_SNAPSHOTS):
+        tables.append(FlightTable.from_flights(client.get_flights()))
+        client.advance(INTERVAL)
+
+    root = tempfile.mkdtemp(prefix="history-")
+    try:
+        store = HistoryStore(root)
+        start = (time.time() // 3600 - HOURS - 1) * 3600
+        n_frames = int(HOURS * 3600 / INTERVAL)
+        appends = []
+        cpu_start = time.process_time()
+        for frame in range(n_frames):
+            begin = time.perf_counter()
+            store.append(tables[frame % N_SNAPSHOTS], start + frame * INTERVAL)
+            appends.append(1000 * (time.perf_counter() - begin))
+        cpu = time.process_time() - cpu_start
+        store.close()
+        size = sum(
+            os.path.getsize(os.path.join(directory, name))
+            for directory, _, names in os.walk(root) for name in names
+        )
+        print(f"{n_frames} frames of {N_FLIGHTS} flights, {size / 1024 ** 2:.0f} MB on disk")
+        print(f"CPU per append: {1000 * cpu / n_frames:.2f} ms (one every {INTERVAL:.0f} s)")
+        report("append", appends)
+
+        rng = np.random.default_rng(0)
+        end = start + n_frames * INTERVAL
+        report("seek (frame at a time)", timings_ms(
+            lambda: store.frame(rng.uniform(start, end))
+        ))
+        report("query 5 min", timings_ms(
+            lambda: store.query(start=start + 3600, end=start + 3900)
+        ))
+        flight_id = str(tables[0].id[0])
+        report("query flight id (all)", timings_ms(
+            lambda: store.query(flight_id=flight_id), repeat=5
+        ))
+        report("query bounds, 1 hour", timings_ms(
+            lambda: store.query(start=start, end=start + 3600, bounds="50,45,0,5"), repeat=5
+        ))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+"""
+Benchmark harness of the final_app callback pipeline.
+
+Runs every stage of a dashboard tick on offline synthetic traffic at
+several fleet sizes:
+    - fetch_flight_data and fetch_flight_table post-processing of the
+      Flight objects returned by the client;
+    - update_rotation_angles between two consecutive snapshots;
+    - bearing_from_positions and get_closest_round_angle, per flight;
+    - update_graph_live, on the first tick (every marker built), on the
+      next tick (partial update) and zoomed out (clusters).
+
+For each stage it reports latency percentiles, the peak memory allocated
+during a run and, for the callback, the size of the serialized response,
+as is and gzip-compressed as sent to browsers accepting it.
+Results are written as JSON, by default to benchmarks/results/<commit>.json,
+and can be compared with a previous run.
+
+Usage:
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --sizes 100 1000 --compare benchmarks/results/abc1234.json
+"""
+from typing import Any, Callable, Dict, List, Optional, Sequence
+import argparse
+import copy
+import datetime
+import gzip
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "final_app"))
+# Never reach FlightRadar24 when importing the app
+os.environ.setdefault("FLIGHT_CLIENT", "synthetic:100")
+
+import dash  # noqa: E402
+from dash._utils import to_json  # noqa: E402
+import main  # noqa: E402
+from poller import FlightQuery, Snapshot  # noqa: E402
+from snapshot import FlightTable  # noqa: E402
+from synthetic import SyntheticClient  # noqa: E402
+from utils import (  # noqa: E402
+    bearing_from_positions,
+    fetch_flight_data,
+    fetch_flight_table,
+    get_closest_round_angle,
+    update_rotation_angles,
+)
+
+
+SIZES = [100, 1_000, 3_000, 10_000, 50_000]
+# Time between the two snapshots of a tick (in seconds)
+TICK = 10.0
+# Map zoom levels of the callback benchmarks
+DETAILED_ZOOM = 9
+CLUSTERED_ZOOM = 5
+WORLD_BOUNDS = [[-90, -180], [90, 180]]
+PERCENTILES = (50, 90, 99)
+# Compression level of the responses, the one of flask-compress
+GZIP_LEVEL = 6
+
+
+class FrozenClient:
+    """
+    Client always returning the same Flight objects, so that only the
+    post-processing of fetches is measured.
+    """
+
+    def __init__(self, flights: List[Any]):
+        self.flights = flights
+
+    def get_zones(self) -> Dict[str, Dict]:
+        return {"world": {"tl_y": 90, "br_y": -90, "tl_x": -180, "br_x": 180}}
+
+    def get_bounds(self, zone: Dict[str, float]) -> str:
+        return "{},{},{},{}".format(zone["tl_y"], zone["br_y"], zone["tl_x"], zone["br_x"])
+
+    def get_flights(self, **kwargs) -> List[Any]:
+        return self.flights
+
+
+class FrozenPoller:
+    """
+    Poller serving a given snapshot to update_graph_live.
+    """
+
+    def __init__(self, snapshot: Snapshot):
+        self.snapshot = snapshot
+
+    def get(self, **kwargs) -> Snapshot:
+        return self.snapshot
+
+
+def default_repeat(n_flights: int) -> int:
+    """
+    Number of timed runs, fewer for large fleets.
+    """
+    return int(np.clip(200_000 // n_flights, 5, 50))
+
+
+def measure(
+    function: Callable[..., Any],
+    setup: Callable[[], Sequence] = tuple,
+    repeat: int = 10,
+) -> Dict[str, Any]:
+    """
+    Time a function and measure the memory it allocates.
+
+    Args:
+        function (Callable): Function to benchmark.
+        setup (Callable): Function returning the arguments of a run,
+            called outside of the timed section.
+        repeat (int): Number of timed runs, after one warm-up run.
+
+    Returns:
+        Dict: Latency percentiles and mean (in ms), peak memory (in
+            bytes) and the result of the last run under `result`.
+    """
+    result = function(*setup())
+    timings = []
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - start)
+    # Memory is measured on a separate run, tracemalloc slows code down
+    args = setup()
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings_ms = 1000 * np.array(timings)
+    stats: Dict[str, Any] = {
+        f"p{percentile}_ms": float(np.percentile(timings_ms, percentile))
+        for percentile in PERCENTILES
+    }
+    stats.update(
+        mean_ms=float(timings_ms.mean()),
+        min_ms=float(timings_ms.min()),
+        repeat=repeat,
+        peak_memory_bytes=peak,
+        result=result,
+    )
+    return stats
+
+
+def response_sizes(outputs: List[Any]) -> Dict[str, int]:
+    """
+    Size of the JSON response Dash sends for the outputs of
+    update_graph_live, as is and compressed (in bytes).
+    """
+    wire = outputs[0]
+    response = to_json({"multi": True, "response": {"wire": {"data": wire}}}).encode()
+    return {
+        "response_bytes": len(response),
+        "compressed_bytes": len(gzip.compress(response, GZIP_LEVEL)),
+    }
+
+
+def bench_size(n_flights: int, repeat: int) -> List[Dict[str, Any]]:
+    """
+    Run every benchmark on a fleet of `n_flights` aircraft.
+    """
+    client = SyntheticClient(n_flights, speed=None)
+    client.set_flight_tracker_config(limit=n_flights)
+    previous_flights = client.get_flights()
+    previous_time = client.now()
+    client.advance(TICK)
+    flights = client.get_flights()
+    previous_table = FlightTable.from_flights(previous_flights)
+    table = FlightTable.from_flights(flights)
+    previous_data = previous_table.to_records()
+    for flight in previous_data:
+        flight.update(rotation_angle=0)
+    data = table.to_records()
+    update_rotation_angles(data, previous_data)
+
+    frozen_client = FrozenClient(flights)
+    query = FlightQuery(zone_str="world", airline_icao=None, bounds=None)
+    previous_snapshot = Snapshot(query=query, table=previous_table, version=1, timestamp=previous_time)
+    snapshot = Snapshot(query=query, table=table, version=2, timestamp=client.now())
+
+    def tick(zoom: float, memory: Dict, rendered: Dict) -> List[Any]:
+        return main.update_graph_live(0, WORLD_BOUNDS, "live", None, 1, zoom, memory, rendered)
+
+    def first_tick_setup(zoom: float) -> Callable[[], Sequence]:
+        def setup() -> Sequence:
+            main.poller = FrozenPoller(snapshot)
+            return zoom, {"token": main.new_session_token()}, {"version": None}
+        return setup
+
+    def next_tick_setup() -> Sequence:
+        memory = {"token": main.new_session_token()}
+        main.poller = FrozenPoller(previous_snapshot)
+        wire = tick(DETAILED_ZOOM, memory, {"version": None})[0]
+        main.poller = FrozenPoller(snapshot)
+        return DETAILED_ZOOM, memory, {"version": wire["version"]}
+
+    cases = {
+        "fetch_flight_data": (
+            lambda: fetch_flight_data(frozen_client, zone_str="world"),
+            tuple,
+        ),
+        "fetch_flight_table": (
+            lambda: fetch_flight_table(frozen_client, zone_str="world"),
+            tuple,
+        ),
+        "update_rotation_angles": (
+            update_rotation_angles,
+            lambda: (copy.deepcopy(data), previous_data),
+        ),
+        "bearing_from_positions": (
+            lambda: [
+                bearing_from_positions(
+                    current["longitude"], current["latitude"],
+                    previous["longitude"], previous["latitude"],
+                ) for current, previous in zip(data, previous_data)
+            ],
+            tuple,
+        ),
+        "get_closest_round_angle": (
+            lambda: [get_closest_round_angle(flight["rotation_angle"]) for flight in data],
+            tuple,
+        ),
+        "marker_build_first_tick": (tick, first_tick_setup(DETAILED_ZOOM)),
+        "marker_build_next_tick": (tick, next_tick_setup),
+        "marker_build_clustered": (tick, first_tick_setup(CLUSTERED_ZOOM)),
+    }
+    results = []
+    for case, (function, setup) in cases.items():
+        stats = measure(function, setup, repeat)
+        result = stats.pop("result")
+        if case.startswith("marker_build"):
+            stats.update(response_sizes(result))
+        results.append({"case": case, "flights": n_flights, **stats})
+        print(format_result(results[-1]), flush=True)
+    return results
+
+
+def format_result(result: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> str:
+    """
+    One line summary of a result, with the ratio to a baseline.
+    """
+    line = (
+        f"{result['case']:<26} {result['flights']:>7} "
+        f"{result['p50_ms']:>10.2f} {result['p90_ms']:>10.2f} {result['p99_ms']:>10.2f} "
+        f"{result['peak_memory_bytes'] / 1024 ** 2:>9.1f} "
+        f"{result.get('response_bytes', 0) / 1024:>10.1f} "
+        f"{result.get('compressed_bytes', 0) / 1024:>10.1f}"
+    )
+    if baseline is not None:
+        line += f" {result['p50_ms'] / baseline['p50_ms']:>7.2f}x"
+    return line
+
+
+HEADER = (
+    f"{'case':<26} {'flights':>7} {'p50 (ms)':>10} {'p90 (ms)':>10} {'p99 (ms)':>10} "
+    f"{'peak (MB)':>9} {'resp. (KB)':>10} {'gzip (KB)':>10}"
+)
+
+
+def git_commit() -> Dict[str, Any]:
+    """
+    Current commit and whether the working tree has local changes.
+    """
+    def git(*args: str) -> str:
+        return subprocess.run(
+            ["git", *args], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    try:
+        return {"commit": git("rev-parse", "--short", "HEAD"), "dirty": bool(git("status", "--porcelain"))}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": "unknown", "dirty": None}
+
+
+def compare(results: List[Dict[str, Any]], path: str) -> None:
+    """
+    Print the results next to the p50 ratios with a previous run.
+    """
+    with open(path) as f:
+        baseline = json.load(f)
+    previous = {(result["case"], result["flights"]): result for result in baseline["results"]}
+    print(f"\nCompared with {baseline['commit']} (p50 ratio, < 1 is faster):")
+    print(HEADER + f" {'ratio':>8}")
+    for result in results:
+        reference = previous.get((result["case"], result["flights"]))
+        if reference is not None:
+            print(format_result(result, reference))
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the callback pipeline.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="Fleet sizes.")
+    parser.add_argument("--repeat", type=int, default=None, help="Timed runs per case.")
+    parser.add_argument("--output", default=None, help="JSON file of the results.")
+    parser.add_argument("--compare", default=None, help="JSON results of a previous run.")
+    args = parser.parse_args()
+
+    # The background poller of the app is replaced by frozen snapshots
+    main.poller.stop()
+    print(HEADER)
+    results = []
+    for n_flights in args.sizes:
+        results.extend(bench_size(n_flights, args.repeat or default_repeat(n_flights)))
+
+    run = {
+        **git_commit(),
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "dash": dash.__version__,
+        "machine": platform.platform(),
+        "results": results,
+    }
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"{run['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(run, f, indent=2)
+    print(f"\nResults written to {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,143 @@
+"""
+Benchmark of update_rotation_angles.
+
+Compares the historical quadratic implementation with the id-indexed,
+vectorized one on random snapshots, and checks that both give the same
+bearings as the scalar bearing_from_positions.
+
+Usage:
+    python benchmarks/bench_rotation.py
+"""
+from typing import Dict, List
+import copy
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "final_app"))
+from utils import (  # noqa: E402
+    bearing_from_positions,
+    bearings_from_positions,
+    update_rotation_angles,
+)
+
+
+SIZES = [1_000, 5_000, 10_000, 20_000, 50_000]
+# The quadratic version becomes far too slow beyond that
+MAX_LEGACY_SIZE = 5_000
+
+
+def legacy_update_rotation_angles(data: List[Dict], previous_data: List[Dict]) -> None:
+    """
+    Quadratic implementation, kept as a reference.
+    """
+    for flight_data in data:
+        identifier = flight_data["id"]
+        if identifier not in [data["id"] for data in previous_data]:
+            bearing = 0
+        else:
+            previous_flight_data = next(item for item in previous_data if item["id"] == identifier)
+            longitude = flight_data["longitude"]
+            latitude = flight_data["latitude"]
+            previous_longitude = previous_flight_data["longitude"]
+            previous_latitude = previous_flight_data["latitude"]
+            if (longitude == previous_longitude) & (latitude == previous_latitude):
+                bearing = previous_flight_data["rotation_angle"]
+            else:
+                bearing = bearing_from_positions(
+                    longitude, latitude, previous_longitude, previous_latitude
+                )
+        flight_data.update(rotation_angle=bearing)
+
+
+def make_snapshots(n_flights: int, seed: int = 0):
+    """
+    Build two consecutive snapshots: 90% of the flights are kept (5% of
+    them without moving), 10% are replaced, and the order is shuffled.
+    """
+    rng = np.random.default_rng(seed)
+    latitudes = rng.uniform(35, 70, n_flights)
+    longitudes = rng.uniform(-10, 40, n_flights)
+    previous_data = [
+        {
+            "id": f"{idx:08x}",
+            "latitude": float(latitudes[idx]),
+            "longitude": float(longitudes[idx]),
+            "rotation_angle": float(rng.uniform(0, 360)),
+        } for idx in range(n_flights)
+    ]
+    data = []
+    for idx, flight in enumerate(previous_data):
+        draw = rng.uniform()
+        if draw < 0.1:
+            data.append({
+                "id": f"{n_flights + idx:08x}",
+                "latitude": flight["latitude"],
+                "longitude": flight["longitude"],
+            })
+        elif draw < 0.15:
+            data.append({key: flight[key] for key in ("id", "latitude", "longitude")})
+        else:
+            data.append({
+                "id": flight["id"],
+                "latitude": flight["latitude"] + float(rng.normal(0, 0.05)),
+                "longitude": flight["longitude"] + float(rng.normal(0, 0.05)),
+            })
+    rng.shuffle(data)
+    return data, previous_data
+
+
+def best_of(function, data, previous_data, repeat: int = 3) -> float:
+    """
+    Best wall-clock time of `repeat` runs (in seconds).
+    """
+    timings = []
+    for _ in range(repeat):
+        data_copy = copy.deepcopy(data)
+        start = time.perf_counter()
+        function(data_copy, previous_data)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def check_consistency(n_flights: int = 2_000) -> None:
+    """
+    Check that the new implementation matches the legacy one.
+    """
+    data, previous_data = make_snapshots(n_flights, seed=1)
+    expected = copy.deepcopy(data)
+    legacy_update_rotation_angles(expected, previous_data)
+    update_rotation_angles(data, previous_data)
+    np.testing.assert_allclose(
+        [flight["rotation_angle"] for flight in data],
+        [flight["rotation_angle"] for flight in expected],
+        atol=1e-9,
+    )
+    rng = np.random.default_rng(2)
+    coordinates = rng.uniform(-80, 80, (4, n_flights))
+    np.testing.assert_allclose(
+        bearings_from_positions(*coordinates),
+        [bearing_from_positions(*row) for row in coordinates.T],
+        atol=1e-9,
+    )
+
+
+def main() -> None:
+    check_consistency()
+    print(f"{'flights':>8} {'vectorized (ms)':>16} {'us/flight':>10} {'legacy (ms)':>12}")
+    for n_flights in SIZES:
+        data, previous_data = make_snapshots(n_flights)
+        vectorized = best_of(update_rotation_angles, data, previous_data)
+        if n_flights <= MAX_LEGACY_SIZE:
+            legacy = f"{1000 * best_of(legacy_update_rotation_angles, data, previous_data, repeat=1):12.1f}"
+        else:
+            legacy = f"{'-':>12}"
+        print(
+            f"{n_flights:>8} {1000 * vectorized:16.2f} "
+            f"{1e6 * vectorized / n_flights:10.2f} {legacy}"
+        )
+
+
+if __name__ == "__main__":
+    main()
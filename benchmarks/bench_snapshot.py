@@ -0,0 +1,120 @@
+"""
+Benchmark of the columnar FlightTable against lists of dictionaries.
+
+Measures the memory used by a 10k-flight snapshot in both
+representations, and the time of a few typical operations.
+
+Usage:
+    python benchmarks/bench_snapshot.py
+"""
+from typing import Callable, Dict, List
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "final_app"))
+from snapshot import FlightTable  # noqa: E402
+
+
+N_FLIGHTS = 10_000
+AIRPORTS = ["CDG", "ORY", "LHR", "FRA", "AMS", "MAD", "FCO", "JFK", "DXB", "IST"]
+AIRLINES = ["AFR", "KLM", "DLH", "BAW", "IBE", "EZY", "RYR", "THY"]
+
+
+def make_records(n_flights: int, seed: int = 0) -> List[Dict]:
+    """
+    Random flight dictionaries, with the keys of fetch_flight_data.
+    """
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            "id": f"{idx:08x}",
+            "number": f"{rng.choice(AIRLINES)[:2]}{rng.integers(1, 9999)}",
+            "latitude": float(rng.uniform(35, 70)),
+            "longitude": float(rng.uniform(-10, 40)),
+            "ground_speed": int(rng.integers(0, 550)),
+            "altitude": int(rng.integers(0, 41000)),
+            "vertical_speed": int(rng.integers(-2000, 2000)),
+            "heading": int(rng.integers(0, 360)),
+            "on_ground": int(rng.uniform() < 0.1),
+            "origin_airport_iata": str(rng.choice(AIRPORTS)),
+            "destination_airport_iata": str(rng.choice(AIRPORTS)),
+            "airline_icao": str(rng.choice(AIRLINES)),
+            "aircraft_code": "A320",
+        } for idx in range(n_flights)
+    ]
+
+
+def allocated(build: Callable) -> int:
+    """
+    Memory allocated by `build()` and still referenced by its result.
+    """
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def timeit(function: Callable, repeat: int = 20) -> float:
+    """
+    Best time of `repeat` runs (in microseconds).
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return 1e6 * min(timings)
+
+
+def main() -> None:
+    records = make_records(N_FLIGHTS)
+    table = FlightTable.from_records(records)
+
+    records_bytes = allocated(lambda: make_records(N_FLIGHTS))
+    table_bytes = allocated(lambda: FlightTable.from_records(records))
+    print(f"Memory for {N_FLIGHTS} flights")
+    print(f"  list of dicts: {records_bytes / 1024:10.0f} KiB")
+    print(f"  FlightTable:   {table_bytes / 1024:10.0f} KiB (columns: {table.nbytes / 1024:.0f} KiB)")
+
+    ids = [record["id"] for record in records[::10]]
+    operations = {
+        "bbox filter": (
+            lambda: [
+                record for record in records
+                if 45 < record["latitude"] < 55 and 0 < record["longitude"] < 10
+            ],
+            lambda: table.take(
+                (table.latitude > 45) & (table.latitude < 55)
+                & (table.longitude > 0) & (table.longitude < 10)
+            ),
+        ),
+        "mean altitude in flight": (
+            lambda: np.mean([record["altitude"] for record in records if not record["on_ground"]]),
+            lambda: table.altitude[table.on_ground == 0].mean(),
+        ),
+        "filter by airline": (
+            lambda: [record for record in records if record["airline_icao"] == "AFR"],
+            lambda: table.take(table.airline_icao.codes == table.airline_icao.code("AFR")),
+        ),
+        "lookup 1k ids": (
+            lambda: [next(record for record in records if record["id"] == identifier) for identifier in ids[:50]],
+            lambda: [table.index[identifier] for identifier in ids],
+        ),
+    }
+    print(f"\n{'operation':<25} {'dicts (us)':>12} {'table (us)':>12}")
+    for name, (with_records, with_table) in operations.items():
+        repeat = 1 if name.startswith("lookup") else 20
+        records_time = timeit(with_records, repeat)
+        if name.startswith("lookup"):
+            # Linear scans are only run on 50 ids
+            records_time *= len(ids) / 50
+        print(f"{name:<25} {records_time:12.0f} {timeit(with_table):12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+"""
+Production server configuration.
+
+Usage:
+    gunicorn main:server
+
+The state of a session (previous flights) is kept by the browser, so
+that any worker can serve any call. The number of workers is given by
+WEB_CONCURRENCY, 2 by default to match the CPU limit of the pod.
+"""
+import os
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+# The CPU count seen in a container is the one of the node, not the limit
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+# Threads let a worker serve other sessions while one waits on the API
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+timeout = 60
+accesslog = "-"
@@ -1,4 +1,6 @@
+import re
 import dash
+import flask
 from dash import dcc
 from dash import html
 import dash_leaflet as dl
@@ -14,6 +16,22 @@ from utils import (
 
 # App initialization
 app = dash.Dash(__name__)
+# WSGI entry point of the production server
+server = app.server
+# Hashed assets never change: let browsers cache them for a year
+HASHED_ASSET = re.compile(r"^/assets/.+\.[0-9a-f]{10}\.\w+$")
+
+
+@app.server.after_request
+def cache_hashed_assets(response):
+    if response.status_code == 200 and HASHED_ASSET.match(flask.request.path):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    return response
+
+
 # FlightRadar24API client
 fr_api = FlightRadar24API()
 
@@ -2,11 +2,45 @@
 Utils.
 """
 from typing import Dict, Optional, List
+import json
 import math
+import os
 import numpy as np
 from FlightRadar24 import FlightRadar24API
 
 
+def get_sprite_url() -> str:
+    """
+    Get the URL of the plane icons sprite sheet, whose content-hashed
+    name is written to the assets manifest by build_icons.py.
+
+    Returns:
+        str: Asset URL.
+    """
+    manifest = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "planes.json")
+    try:
+        with open(manifest) as f:
+            return "/assets/" + json.load(f)["sprite"]
+    except FileNotFoundError:
+        raise RuntimeError(
+            f"{manifest} not found, build the plane icons with: python final_app/build_icons.py"
+        ) from None
+
+
+# Icons are built once and shared by all markers. They are all frames
+# of the sprite sheet generated by build_icons.py in the assets folder.
+ANGLE_STEP = 15
+ROUND_ANGLES = tuple(range(0, 360, ANGLE_STEP))
+SPRITE_URL = get_sprite_url()
+PLANE_ICONS = tuple(
+    dict(
+        iconUrl=SPRITE_URL,
+        iconSize=[38, 38],
+        className=f"plane-icon plane-icon-{round_angle}",
+    ) for round_angle in ROUND_ANGLES
+)
+
+
 def fetch_flight_data(
     client: FlightRadar24API,
     airline_icao: Optional[str] = None,
@@ -48,32 +82,49 @@ def fetch_flight_data(
     ]
 
 
-def update_rotation_angles(data: Dict, previous_data: Dict) -> None:
+def update_rotation_angles(data: List[Dict], previous_data: List[Dict]) -> None:
     """
     Update rotation angles for flight data.
+
+    Flights are joined with their previous position by id, and all
+    bearings are then computed in a single vectorized pass.
     """
-    for idx, flight_data in enumerate(data):
-        identifier = flight_data["id"]
-        if identifier not in [data["id"] for data in previous_data]:
-            bearing = 0
+    previous_by_id = {flight["id"]: flight for flight in previous_data}
+    matched = []
+    matched_previous = []
+    for flight_data in data:
+        previous_flight_data = previous_by_id.get(flight_data["id"])
+        if previous_flight_data is None:
+            flight_data.update(rotation_angle=0)
         else:
-            previous_flight_data = next(item for item in previous_data if item["id"] == identifier)
-            longitude = flight_data["longitude"]
-            latitude = flight_data["latitude"]
-            previous_longitude = previous_flight_data["longitude"]
-            previous_latitude = previous_flight_data["latitude"]
-
-            # If no change keep previous bearing
-            if (longitude == previous_longitude) & (latitude == previous_latitude):
-                bearing = previous_flight_data["rotation_angle"]
-            else:
-                bearing = bearing_from_positions(
-                    longitude,
-                    latitude,
-                    previous_longitude,
-                    previous_latitude,
-                )
+            matched.append(flight_data)
+            matched_previous.append(previous_flight_data)
+    if not matched:
+        return
+
+    longitudes = np.array([flight["longitude"] for flight in matched], dtype=float)
+    latitudes = np.array([flight["latitude"] for flight in matched], dtype=float)
+    previous_longitudes = np.array(
+        [flight["longitude"] for flight in matched_previous], dtype=float
+    )
+    previous_latitudes = np.array(
+        [flight["latitude"] for flight in matched_previous], dtype=float
+    )
+    previous_angles = np.array(
+        [flight.get("rotation_angle", 0) for flight in matched_previous], dtype=float
+    )
+
+    bearings = bearings_from_positions(
+        longitudes,
+        latitudes,
+        previous_longitudes,
+        previous_latitudes,
+    )
+    # If no change keep previous bearing
+    unchanged = (longitudes == previous_longitudes) & (latitudes == previous_latitudes)
+    bearings = np.where(unchanged, previous_angles, bearings)
 
+    for flight_data, bearing in zip(matched, bearings.tolist()):
         flight_data.update(rotation_angle=bearing)
     return
 
@@ -115,6 +166,37 @@ def bearing_from_positions(
     return bearing_deg
 
 
+def bearings_from_positions(
+    longitudes: np.ndarray,
+    latitudes: np.ndarray,
+    previous_longitudes: np.ndarray,
+    previous_latitudes: np.ndarray,
+) -> np.ndarray:
+    """
+    Vectorized version of `bearing_from_positions`, computing
+    the bearings of many flights at once.
+
+    Args:
+        longitudes (np.ndarray): Longitudes (in degrees).
+        latitudes (np.ndarray): Latitudes (in degrees).
+        previous_longitudes (np.ndarray): Previous longitudes (in degrees).
+        previous_latitudes (np.ndarray): Previous latitudes (in degrees).
+
+    Returns:
+        np.ndarray: Bearings in degrees.
+    """
+    lat1 = np.radians(previous_latitudes)
+    lon1 = np.radians(previous_longitudes)
+    lat2 = np.radians(latitudes)
+    lon2 = np.radians(longitudes)
+    dlon = lon2 - lon1
+    cos_lat2 = np.cos(lat2)
+    y = np.sin(dlon) * cos_lat2
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * cos_lat2 * np.cos(dlon)
+    bearing_deg = np.degrees(np.arctan2(y, x))
+    return (bearing_deg + 360) % 360
+
+
 def get_closest_round_angle(angle: float) -> int:
     """
     Get closest round angle (multiple of 15 degrees)
@@ -129,22 +211,24 @@ def get_closest_round_angle(angle: float) -> int:
             165, 180, 195, 210, 225, 240, 255, 270,
             285, 300, 315, 330, 345.
     """
-    round_angles = [
-        0, 15, 30, 45, 60, 75, 90,
-        105, 120, 135, 150, 165, 180,
-        195, 210, 225, 240, 255, 270,
-        285, 300, 315, 330, 345, 360,
-    ]
-    differences = np.array([
-        angle - round_angle for round_angle in round_angles
-    ])
-    abs_differences = np.abs(differences)
-    closest_angle_idx = abs_differences.argmin()
-    closest_angle = round_angles[closest_angle_idx]
-    if closest_angle == 360:
-        return 0
-    else:
-        return closest_angle
+    # Ties are resolved towards the smallest angle
+    return ROUND_ANGLES[math.ceil(angle / ANGLE_STEP - 0.5) % len(ROUND_ANGLES)]
+
+
+def get_angle_buckets(angles: np.ndarray) -> np.ndarray:
+    """
+    Vectorized version of `get_closest_round_angle`, returning
+    for each angle the index of the closest round angle in
+    `ROUND_ANGLES` (and `PLANE_ICONS`).
+
+    Args:
+        angles (np.ndarray): Angles (in degrees).
+
+    Returns:
+        np.ndarray: Indices between 0 and 23.
+    """
+    buckets = np.ceil(np.asarray(angles, dtype=float) / ANGLE_STEP - 0.5)
+    return buckets.astype(np.intp) % len(ROUND_ANGLES)
 
 
 def get_custom_icon(round_angle: int) -> Dict:
@@ -156,10 +240,6 @@ def get_custom_icon(round_angle: int) -> Dict:
         round_angle (int): Round angle.
 
     Returns:
-        Dict: Icon dict.
+        Dict: Icon dict, shared between all calls: it must not be modified.
     """
-    icon_url = f'https://github.com/tomseimandi/flightradar/blob/main/img/plane_{round_angle}.png?raw=true'
-    return dict(
-        iconUrl=icon_url,
-        iconSize=[38, 38],
-    )
+    return PLANE_ICONS[round_angle // ANGLE_STEP]
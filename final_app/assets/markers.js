@@ -0,0 +1,288 @@
+/*
+ * Markers and trails built from the wire store (see wire.py), and dead
+ * reckoning of the flight markers (see motion.py).
+ *
+ * Each refresh, the compact update of the wire store is applied to the
+ * dash-leaflet components of the markers and trails layers. Moving
+ * flights have a track, kept by flight id across refreshes: the server
+ * only sends the tracks that changed. Between two refreshes, they are
+ * drawn at their track position plus their velocity times the time
+ * elapsed since the snapshot of the track. When a track is replaced, the
+ * gap between the position its marker is drawn at and the new track is
+ * remembered and faded out over BLEND seconds, so that markers glide to
+ * their corrected position. Between two snapshots, only the markers that
+ * moved by at least MIN_PIXELS on screen are updated, with a patch of
+ * their position.
+ */
+(function () {
+    // Time over which markers ease to their new track (in seconds)
+    var BLEND = 2.0;
+    // Positions are not extrapolated further than this (in seconds)
+    var MAX_EXTRAPOLATION = 60.0;
+    // Knot in meters per second
+    var KNOT = 1852 / 3600;
+    // Length of a degree of latitude (in meters)
+    var METERS_PER_DEGREE = 2 * Math.PI * 6371008.8 / 360;
+    // Floor of the cosine of the latitude, to keep longitude speeds
+    // finite near the poles
+    var MIN_COS_LATITUDE = 0.01;
+    // Markers are only moved once they are this far from where they
+    // are drawn (in pixels)
+    var MIN_PIXELS = 1;
+    // Width of a map tile (in pixels)
+    var TILE_SIZE = 256;
+    var NAMESPACE = "dash_leaflet";
+
+    // Version of the markers displayed, difference between the clock of
+    // the server and seconds(), and tracks of the moving flights by id:
+    // marker position, position and time of the track, velocity (in
+    // degrees per second), offset from the position the marker was drawn
+    // at when the track was received, time it was received and position
+    // the marker is drawn at
+    var state = {version: null, clock: 0, tracks: new Map()};
+
+    function seconds() {
+        return performance.now() / 1000;
+    }
+
+    function wrapLongitude(delta) {
+        return delta > 180 ? delta - 360 : (delta < -180 ? delta + 360 : delta);
+    }
+
+    function component(type, props) {
+        return {type: type, namespace: NAMESPACE, props: props};
+    }
+
+    function markerChildren(id, count, config) {
+        if (count) {
+            return [component("Tooltip", {children: String(count), permanent: true, direction: "right"})];
+        }
+        return [component("Popup", {id: {type: config.popup, index: id}})];
+    }
+
+    function withProps(element, props) {
+        return Object.assign({}, element, {props: Object.assign({}, element.props, props)});
+    }
+
+    function removePositions(elements, positions) {
+        if (!positions.length) {
+            return elements;
+        }
+        var removed = new Set(positions);
+        return elements.filter(function (element, position) {
+            return !removed.has(position);
+        });
+    }
+
+    function updateMarkers(markers, update, scale, config) {
+        var result = markers.slice();
+        var i, position;
+        if (update.moved) {
+            for (i = 0; i < update.moved.index.length; i++) {
+                position = update.moved.index[i];
+                result[position] = withProps(result[position], {
+                    position: [update.moved.lat[i] / scale, update.moved.lon[i] / scale]
+                });
+            }
+        }
+        if (update.rotated) {
+            for (i = 0; i < update.rotated.index.length; i++) {
+                position = update.rotated.index[i];
+                result[position] = withProps(result[position], {icon: config.icons[update.rotated.icon[i]]});
+            }
+        }
+        if (update.updated) {
+            for (i = 0; i < update.updated.index.length; i++) {
+                position = update.updated.index[i];
+                result[position] = withProps(result[position], {
+                    children: markerChildren(result[position].props.id, update.updated.count[i], config)
+                });
+            }
+        }
+        result = removePositions(result, update.removed || []);
+        var added = update.added;
+        for (i = 0; i < added.id.length; i++) {
+            var id = added.id[i];
+            var count = added.count[i];
+            result.push(component("Marker", {
+                id: count ? id : {type: config.marker, index: id},
+                position: [added.lat[i] / scale, added.lon[i] / scale],
+                icon: config.icons[added.icon[i]],
+                children: markerChildren(id, count, config)
+            }));
+        }
+        return result;
+    }
+
+    function decodeTrail(points, scale) {
+        var positions = [];
+        var latitude = 0;
+        var longitude = 0;
+        for (var i = 0; i < points.length; i += 2) {
+            latitude += points[i];
+            longitude += points[i + 1];
+            positions.push([latitude / scale, longitude / scale]);
+        }
+        return positions;
+    }
+
+    function updateTrails(trails, update, scale, config) {
+        var result = trails.slice();
+        for (var i = 0; i < update.changed.index.length; i++) {
+            var position = update.changed.index[i];
+            result[position] = withProps(result[position], {
+                positions: decodeTrail(update.changed.points[i], scale)
+            });
+        }
+        result = removePositions(result, update.removed);
+        update.added.forEach(function (points) {
+            result.push(component("Polyline", Object.assign({positions: decodeTrail(points, scale)}, config.trail)));
+        });
+        return result;
+    }
+
+    // Id of a flight marker, null for clusters
+    function flightId(marker) {
+        var id = marker.props.id;
+        return typeof id === "object" ? id.index : null;
+    }
+
+    function reconcile(motion, scale, markers, full) {
+        var tracks = state.tracks;
+        if (!motion || full) {
+            tracks.clear();
+        }
+        if (!motion) {
+            return;
+        }
+        var now = seconds();
+        state.clock = motion.now - now;
+        // Tracks follow their marker, and are dropped with it
+        var positions = new Map();
+        markers.forEach(function (marker, position) {
+            var id = flightId(marker);
+            if (id !== null) {
+                positions.set(id, position);
+            }
+        });
+        tracks.forEach(function (track, id) {
+            var position = positions.get(id);
+            if (position === undefined) {
+                tracks.delete(id);
+            } else {
+                track.position = position;
+            }
+        });
+        var age = Math.min(Math.max(motion.now - motion.time, 0), MAX_EXTRAPOLATION);
+        for (var i = 0; i < motion.id.length; i++) {
+            var id = motion.id[i];
+            var position = positions.get(id);
+            // A zero speed drops the track of a flight at rest
+            if (position === undefined || !motion.speed[i]) {
+                tracks.delete(id);
+                continue;
+            }
+            var latitude = motion.lat[i] / scale;
+            var longitude = motion.lon[i] / scale;
+            var speed = KNOT * motion.speed[i];
+            var heading = motion.heading[i] * Math.PI / 180;
+            var cosLatitude = Math.max(Math.cos(latitude * Math.PI / 180), MIN_COS_LATITUDE);
+            var track = {
+                position: position,
+                latitude: latitude,
+                longitude: longitude,
+                time: motion.time,
+                latitudeSpeed: speed * Math.cos(heading) / METERS_PER_DEGREE,
+                longitudeSpeed: speed * Math.sin(heading) / (METERS_PER_DEGREE * cosLatitude),
+                offset: [0, 0],
+                received: now,
+                drawn: [latitude, longitude]
+            };
+            var drawn = markers[position].props.position;
+            if (drawn) {
+                track.offset = [
+                    drawn[0] - (latitude + track.latitudeSpeed * age),
+                    wrapLongitude(drawn[1] - (longitude + track.longitudeSpeed * age))
+                ];
+            }
+            tracks.set(id, track);
+        }
+    }
+
+    // Extrapolated positions of the moving flights, calling visit with
+    // the track, latitude and longitude of each of them
+    function forEachPosition(visit) {
+        var now = seconds();
+        state.tracks.forEach(function (track) {
+            var dt = Math.min(Math.max(now + state.clock - track.time, 0), MAX_EXTRAPOLATION);
+            var blend = Math.max(0, 1 - (now - track.received) / BLEND);
+            visit(
+                track,
+                track.latitude + track.latitudeSpeed * dt + blend * track.offset[0],
+                track.longitude + track.longitudeSpeed * dt + blend * track.offset[1]
+            );
+        });
+    }
+
+    // Markers of a new snapshot, with every moving flight extrapolated
+    function extrapolate(markers) {
+        var moved = markers.slice();
+        forEachPosition(function (track, latitude, longitude) {
+            moved[track.position] = withProps(moved[track.position], {position: [latitude, longitude]});
+            track.drawn = [latitude, longitude];
+        });
+        return moved;
+    }
+
+    // Patch of the markers that visibly moved since they were drawn,
+    // no update if none did
+    function moveMarkers(markers, zoom) {
+        var dc = window.dash_clientside;
+        var pixelsPerDegree = zoom == null ? Infinity : TILE_SIZE * Math.pow(2, zoom) / 360;
+        var patch = null;
+        forEachPosition(function (track, latitude, longitude) {
+            if (!markers[track.position]) {
+                return;
+            }
+            // Web Mercator stretches latitudes by 1 / cos(latitude)
+            var cosLatitude = Math.max(Math.cos(latitude * Math.PI / 180), MIN_COS_LATITUDE);
+            var degrees = Math.max(
+                Math.abs(latitude - track.drawn[0]) / cosLatitude,
+                Math.abs(wrapLongitude(longitude - track.drawn[1]))
+            );
+            if (degrees * pixelsPerDegree < MIN_PIXELS) {
+                return;
+            }
+            patch = patch || new dc.Patch();
+            patch.assign([track.position, "props", "position"], [latitude, longitude]);
+            track.drawn = [latitude, longitude];
+        });
+        return patch ? patch.build() : dc.no_update;
+    }
+
+    function render(wire, n_intervals, markers, trails, config, zoom) {
+        var dc = window.dash_clientside;
+        // Updates computed from other markers than the displayed ones
+        // (concurrent requests) are skipped: the displayed version is
+        // still reported, so the server sends a full rebuild next
+        if (wire && wire.version !== state.version && (wire.full || wire.base === state.version)) {
+            var scale = wire.scale;
+            var newMarkers = updateMarkers(wire.full ? [] : (markers || []), wire.markers, scale, config);
+            var newTrails = updateTrails(wire.full ? [] : (trails || []), wire.trails, scale, config);
+            state.version = wire.version;
+            reconcile(wire.motion, scale, newMarkers, wire.full);
+            return [
+                state.tracks.size ? extrapolate(newMarkers) : newMarkers,
+                newTrails,
+                {version: wire.version}
+            ];
+        }
+        if (!state.tracks.size || !markers) {
+            return [dc.no_update, dc.no_update, dc.no_update];
+        }
+        return [moveMarkers(markers, zoom), dc.no_update, dc.no_update];
+    }
+
+    var dc = window.dash_clientside = window.dash_clientside || {};
+    dc.markers = {render: render};
+})();
@@ -0,0 +1,91 @@
+"""
+Build the plane icons sprite sheet served from the assets folder of the
+apps.
+
+The 24 rotated plane images of `img/` are resized to the marker size and
+packed side by side into a single PNG whose name contains a hash of its
+content, so that browsers can cache it forever. A stylesheet selects the
+right frame of the sprite for each icon class, and a manifest gives the
+name of the sprite to the app (see `get_sprite_url` in utils.py).
+
+Requires Pillow, only needed to rebuild the assets:
+    pip install pillow
+    python final_app/build_icons.py
+"""
+import glob
+import hashlib
+import io
+import json
+import os
+from PIL import Image
+
+
+ICON_SIZE = 38
+ANGLE_STEP = 15
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+IMG_DIR = os.path.join(ROOT_DIR, "img")
+# Apps displaying the plane icons
+APP_DIRS = ("final_app", "correction", "perso")
+# Manifest holding the name of the sprite, in the assets folder
+MANIFEST = "planes.json"
+
+
+def build_sprite() -> bytes:
+    """
+    Pack the plane images into a single PNG sprite sheet.
+
+    Returns:
+        bytes: PNG content.
+    """
+    round_angles = range(0, 360, ANGLE_STEP)
+    sprite = Image.new("RGBA", (ICON_SIZE * len(round_angles), ICON_SIZE))
+    for idx, round_angle in enumerate(round_angles):
+        with Image.open(os.path.join(IMG_DIR, f"plane_{round_angle}.png")) as image:
+            frame = image.convert("RGBA").resize(
+                (ICON_SIZE, ICON_SIZE), Image.LANCZOS
+            )
+        sprite.paste(frame, (idx * ICON_SIZE, 0))
+    buffer = io.BytesIO()
+    sprite.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def build_stylesheet() -> str:
+    """
+    Stylesheet displaying one frame of the sprite sheet per icon class.
+
+    Returns:
+        str: CSS content.
+    """
+    rules = [
+        "/* Generated by build_icons.py */",
+        ".plane-icon {\n  object-fit: none;\n}",
+    ]
+    for idx, round_angle in enumerate(range(0, 360, ANGLE_STEP)):
+        rules.append(
+            f".plane-icon-{round_angle} {{\n"
+            f"  object-position: {-idx * ICON_SIZE}px 0;\n}}"
+        )
+    return "\n".join(rules) + "\n"
+
+
+def main() -> None:
+    content = build_sprite()
+    name = f"planes.{hashlib.sha1(content).hexdigest()[:10]}.png"
+    for app_dir in APP_DIRS:
+        assets_dir = os.path.join(ROOT_DIR, app_dir, "assets")
+        os.makedirs(assets_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(assets_dir, "planes.*.png")):
+            os.remove(path)
+        with open(os.path.join(assets_dir, name), "wb") as f:
+            f.write(content)
+        with open(os.path.join(assets_dir, "planes.css"), "w") as f:
+            f.write(build_stylesheet())
+        with open(os.path.join(assets_dir, MANIFEST), "w") as f:
+            json.dump({"sprite": name}, f)
+            f.write("\n")
+        print(f"Wrote {app_dir}/assets/{name} ({len(content)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
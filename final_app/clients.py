@@ -0,0 +1,41 @@
+"""
+FlightRadar24 client factory.
+
+The client used by the app is chosen with the FLIGHT_CLIENT environment
+variable:
+    - unset or "live": FlightRadar24API;
+    - "record:<directory>": FlightRadar24API, recording its responses;
+    - "replay:<path>": ReplayClient serving a recording, at the speed
+      given by FLIGHT_REPLAY_SPEED (1 by default);
+    - "synthetic:<n>": SyntheticClient simulating n aircraft (10000 by
+      default), at the speed given by FLIGHT_SYNTHETIC_SPEED (1 by
+      default) and with the seed given by FLIGHT_SYNTHETIC_SEED.
+"""
+import os
+from FlightRadar24 import FlightRadar24API
+from replay import RecordingClient, ReplayClient
+from synthetic import SyntheticClient
+
+
+def make_client() -> FlightRadar24API:
+    """
+    Build the FlightRadar24 client selected by FLIGHT_CLIENT.
+
+    Returns:
+        FlightRadar24API: Client, or an object with the same interface.
+    """
+    kind, _, argument = os.environ.get("FLIGHT_CLIENT", "live").partition(":")
+    if kind == "live":
+        return FlightRadar24API()
+    if kind == "record":
+        return RecordingClient(FlightRadar24API(), argument)
+    if kind == "replay":
+        speed = float(os.environ.get("FLIGHT_REPLAY_SPEED", "1"))
+        return ReplayClient(argument, speed=speed)
+    if kind == "synthetic":
+        return SyntheticClient(
+            n_flights=int(argument or 10_000),
+            seed=int(os.environ.get("FLIGHT_SYNTHETIC_SEED", "0")),
+            speed=float(os.environ.get("FLIGHT_SYNTHETIC_SPEED", "1")),
+        )
+    raise ValueError(f"Unknown FLIGHT_CLIENT: {kind}")
@@ -0,0 +1,140 @@
+"""
+Server-side clustering of flights.
+
+When the map is zoomed out, flights are binned into a grid of cells
+about CELL_SIZE pixels wide, and each cell holding several flights is
+drawn as a single cluster marker.
+"""
+from typing import Hashable, NamedTuple
+from collections import OrderedDict
+import math
+import threading
+import numpy as np
+from markers import Markers
+from snapshot import FlightTable
+from utils import get_angle_buckets, ROUND_ANGLES
+
+
+# Flights are clustered below this zoom level
+CLUSTER_MAX_ZOOM = 7
+# Width of a cell (in pixels)
+CELL_SIZE = 64
+# Width of a map tile (in pixels)
+TILE_SIZE = 256
+
+
+class Clusters(NamedTuple):
+    """
+    Result of the clustering of a snapshot.
+
+    Attributes:
+        clusters (Markers): Cluster markers.
+        singletons (np.ndarray): Rows of the flights alone in their
+            cell, drawn individually.
+    """
+    clusters: Markers
+    singletons: np.ndarray
+
+
+def is_clustered(zoom: float) -> bool:
+    """
+    Whether flights are clustered at a given zoom level.
+    """
+    return zoom is not None and zoom < CLUSTER_MAX_ZOOM
+
+
+def cluster_flights(table: FlightTable, zoom: float) -> Clusters:
+    """
+    Bin flights into a grid adapted to the zoom level.
+
+    Cells are squares in Web Mercator coordinates anchored on the
+    top-left corner of the world, so that they do not depend on the
+    viewport. The heading of a cluster is the most frequent icon heading
+    of its flights.
+
+    Args:
+        table (FlightTable): Flights.
+        zoom (float): Zoom level of the map.
+
+    Returns:
+        Clusters: Clusters and rows of the isolated flights.
+    """
+    if len(table) == 0:
+        no_rows = np.zeros(0, dtype=np.intp)
+        return Clusters(clusters=Markers.from_table(table, no_rows), singletons=no_rows)
+    # Normalized Web Mercator coordinates, between 0 and 1
+    latitudes = np.clip(table.latitude, -85.0511, 85.0511)
+    x = (table.longitude + 180) / 360
+    y = (1 - np.log(np.tan(np.radians(latitudes)) + 1 / np.cos(np.radians(latitudes))) / math.pi) / 2
+    # Grids and ids only depend on the integer zoom level, so that they
+    # match across ticks at fractional zooms
+    zoom_level = int(math.floor(zoom))
+    n_cells = max(int(2 ** zoom_level * TILE_SIZE / CELL_SIZE), 1)
+    column = np.clip((x * n_cells).astype(np.int64), 0, n_cells - 1)
+    row = np.clip((y * n_cells).astype(np.int64), 0, n_cells - 1)
+
+    # Histogram of the flights per cell
+    cells, cell_index, counts = np.unique(
+        row * n_cells + column, return_inverse=True, return_counts=True
+    )
+    latitude_sums = np.bincount(cell_index, weights=table.latitude)
+    longitude_sums = np.bincount(cell_index, weights=table.longitude)
+    # Histogram of the headings per cell
+    buckets = get_angle_buckets(table.heading)
+    heading_counts = np.bincount(
+        cell_index * len(ROUND_ANGLES) + buckets,
+        minlength=len(cells) * len(ROUND_ANGLES),
+    ).reshape(len(cells), len(ROUND_ANGLES))
+    dominant_buckets = heading_counts.argmax(axis=1)
+
+    is_cluster = counts > 1
+    n_clusters = int(is_cluster.sum())
+    clusters = Markers(
+        id=np.array([f"cluster-{zoom_level}-{cell}" for cell in cells[is_cluster].tolist()], dtype=str),
+        latitude=latitude_sums[is_cluster] / counts[is_cluster],
+        longitude=longitude_sums[is_cluster] / counts[is_cluster],
+        icon=dominant_buckets[is_cluster],
+        cluster_size=counts[is_cluster],
+        ground_speed=np.zeros(n_clusters, dtype=np.int32),
+        heading=np.zeros(n_clusters, dtype=np.int16),
+    )
+    singletons = np.flatnonzero(~is_cluster[cell_index])
+    return Clusters(clusters=clusters, singletons=singletons)
+
+
+class ClusterCache:
+    """
+    Thread-safe LRU cache of clustering results.
+
+    Keys identify a snapshot and a zoom level, e.g. (snapshot version,
+    zoom, bounds), so that sessions looking at the same area share the
+    clustering work.
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._results: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, table: FlightTable, zoom: float) -> Clusters:
+        """
+        Get the clusters of a snapshot, computing them if needed.
+
+        Args:
+            key (Hashable): Cache key.
+            table (FlightTable): Flights.
+            zoom (float): Zoom level.
+
+        Returns:
+            Clusters: Clusters.
+        """
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return self._results[key]
+        result = cluster_flights(table, zoom)
+        with self._lock:
+            self._results[key] = result
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+        return result
@@ -0,0 +1,87 @@
+"""
+Production server configuration.
+
+Usage:
+    gunicorn main:server
+
+Workers serve the Dash app; a single snapshot process, started by the
+master before the workers, polls FlightRadar24 and shares its snapshots,
+the session states and the trails with them (see shared.py). The master
+restarts it if it dies. Every process writes its metrics and profiles to
+the same temporary directory, so that any worker exposes all of them. The number of workers is given by
+WEB_CONCURRENCY, 2 by default to match the CPU limit of the pod.
+"""
+import os
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+# The CPU count seen in a container is the one of the node, not the limit
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+# Threads let a worker serve other sessions while one waits on a new query
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+timeout = 60
+accesslog = "-"
+
+# Period at which the master checks that the snapshot process runs
+# (in seconds)
+SUPERVISION_PERIOD = 1.0
+
+
+def start_snapshot_process() -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "shared", "main:make_poller"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+
+
+def supervise(server) -> None:
+    # Workers fail fast while the snapshot process is down (see
+    # shared.RECONNECT_TIMEOUT), and reconnect once it is restarted
+    while not server.snapshot_stopping.wait(SUPERVISION_PERIOD):
+        with server.snapshot_lock:
+            # The master may have reaped it already: its exit code is lost
+            exited = server.snapshot_process.poll() is not None
+            if exited and not server.snapshot_stopping.is_set():
+                server.log.error("Snapshot process exited, restarting it")
+                server.snapshot_process = start_snapshot_process()
+
+
+def on_starting(server):
+    # Inherited by the snapshot process and the workers, read by main.py
+    server.snapshot_directory = tempfile.mkdtemp(prefix="flights-")
+    os.environ["FLIGHT_SNAPSHOT_SOCKET"] = os.path.join(server.snapshot_directory, "snapshots.sock")
+    os.environ["FLIGHT_SNAPSHOT_AUTHKEY"] = secrets.token_hex(16)
+    # Metrics and profiles of all the processes, exposed by any worker
+    os.environ["FLIGHT_METRICS_DIR"] = os.path.join(server.snapshot_directory, "metrics")
+    os.environ.setdefault("FLIGHT_PROFILE_DIR", os.path.join(server.snapshot_directory, "profiles"))
+    server.snapshot_process = start_snapshot_process()
+    server.snapshot_stopping = threading.Event()
+    server.snapshot_lock = threading.Lock()
+    threading.Thread(
+        target=supervise, args=(server,), name="snapshot-supervisor", daemon=True
+    ).start()
+
+
+def on_exit(server):
+    process = getattr(server, "snapshot_process", None)
+    if process is not None:
+        # No restart once the server exits
+        with server.snapshot_lock:
+            server.snapshot_stopping.set()
+            process = server.snapshot_process
+        if process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    directory = getattr(server, "snapshot_directory", None)
+    if directory is not None:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,547 @@
+"""
+Append-only history of flight snapshots.
+
+Every poll is appended to an on-disk columnar store, partitioned by
+hour (UTC):
+
+    <root>/<YYYY-MM-DD>/<HH>/
+        <column>.bin    raw fixed-width values of each column
+        index.bin       one (timestamp, first row, row count) entry per frame
+        meta.json       bounding box and counts, once the hour is over
+        ids.bin         sorted distinct flight ids, once the hour is over
+
+Appending a frame is one write per column file, without any encoding
+or compaction. Reads go through numpy.memmap, so a query only pages in
+the rows of the partitions and frames it selects: partitions are picked
+from the time range, then skipped using their bounding box or id list.
+"""
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from collections import OrderedDict
+import datetime
+import fcntl
+import itertools
+import json
+import os
+import threading
+import time
+import numpy as np
+from snapshot import (
+    CATEGORICAL_COLUMNS,
+    NUMERIC_COLUMNS,
+    STRING_COLUMNS,
+    Categorical,
+    FlightTable,
+)
+
+
+PARTITION_SECONDS = 3600
+# On-disk types: numeric columns keep their FlightTable type, strings are
+# stored as fixed-width ASCII
+STORED_COLUMNS = {
+    "id": "S10",
+    "number": "S10",
+    **{name: np.dtype(dtype).str for name, dtype in NUMERIC_COLUMNS.items()},
+    "origin_airport_iata": "S4",
+    "destination_airport_iata": "S4",
+    "airline_icao": "S4",
+    "aircraft_code": "S4",
+}
+INDEX_DTYPE = np.dtype([("timestamp", "<f8"), ("offset", "<i8"), ("count", "<i8")])
+# Number of sealed partitions whose memory maps are kept open
+MAX_OPEN_PARTITIONS = 64
+
+
+def partition_key(timestamp: float) -> int:
+    """
+    Key of the partition holding a timestamp (hours since the epoch).
+    """
+    return int(timestamp // PARTITION_SECONDS)
+
+
+def partition_path(root: str, key: int) -> str:
+    """
+    Directory of a partition.
+    """
+    start = datetime.datetime.fromtimestamp(key * PARTITION_SECONDS, datetime.timezone.utc)
+    return os.path.join(root, start.strftime("%Y-%m-%d"), start.strftime("%H"))
+
+
+def _to_bytes(column: Any, dtype: str) -> np.ndarray:
+    """
+    Fixed-width ASCII version of a string or categorical column.
+    """
+    if isinstance(column, Categorical):
+        return _to_bytes(np.array(column.categories, dtype=str), dtype)[column.codes]
+    try:
+        return column.astype(dtype)
+    except UnicodeEncodeError:
+        return np.char.encode(column, "ascii", "replace").astype(dtype)
+
+
+def _to_categorical(values: np.ndarray) -> Categorical:
+    """
+    Categorical column of fixed-width ASCII values.
+    """
+    categories, codes = np.unique(values, return_inverse=True)
+    codes = codes.astype(np.int16 if len(categories) < np.iinfo(np.int16).max else np.int32)
+    codes.setflags(write=False)
+    return Categorical(codes, tuple(categories.astype(str).tolist()))
+
+
+def _last_entry(index_path: str) -> Optional[np.void]:
+    """
+    Last complete entry of an index file, None if there is none.
+    """
+    n_frames = os.path.getsize(index_path) // INDEX_DTYPE.itemsize if os.path.exists(index_path) else 0
+    if not n_frames:
+        return None
+    return np.fromfile(index_path, dtype=INDEX_DTYPE, offset=(n_frames - 1) * INDEX_DTYPE.itemsize)[0]
+
+
+class Partition:
+    """
+    Read access to the frames of one hour.
+    """
+
+    def __init__(self, root: str, key: int):
+        """
+        Constructor.
+
+        Args:
+            root (str): Root directory of the store.
+            key (int): Partition key.
+        """
+        self.key = key
+        self.path = partition_path(root, key)
+        self.meta: Optional[Dict] = None
+        meta_path = os.path.join(self.path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+        self.index = self._map("index.bin", INDEX_DTYPE)
+        self.n_rows = int(self.index["offset"][-1] + self.index["count"][-1]) if len(self.index) else 0
+        self._columns: Dict[str, np.ndarray] = {}
+
+    @property
+    def sealed(self) -> bool:
+        """
+        Whether the hour is over and the partition will not change.
+        """
+        return self.meta is not None
+
+    def _map(self, name: str, dtype: Any, count: Optional[int] = None) -> np.ndarray:
+        path = os.path.join(self.path, name)
+        dtype = np.dtype(dtype)
+        size = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+        count = size if count is None else min(count, size)
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Memory map of a column, limited to the rows of indexed frames.
+        """
+        if name not in self._columns:
+            self._columns[name] = self._map(f"{name}.bin", STORED_COLUMNS[name], self.n_rows)
+        return self._columns[name]
+
+    def may_contain(self, flight_id: Optional[str] = None, bounds: Optional[Tuple] = None) -> bool:
+        """
+        Whether the partition can hold rows of a flight or inside bounds,
+        always True for the current hour.
+        """
+        if not self.sealed:
+            return True
+        if bounds is not None and self.meta["rows"]:
+            north, south, west, east = bounds
+            if (
+                self.meta["south"] > north or self.meta["north"] < south
+                or self.meta["west"] > east or self.meta["east"] < west
+            ):
+                return False
+        if flight_id is not None:
+            ids = self._map("ids.bin", STORED_COLUMNS["id"])
+            value = np.array(flight_id.encode("ascii", "replace"), dtype=STORED_COLUMNS["id"])
+            position = np.searchsorted(ids, value)
+            return bool(position < len(ids) and ids[position] == value)
+        return True
+
+    def frames(self, start: Optional[float] = None, end: Optional[float] = None) -> slice:
+        """
+        Slice of the index entries of the frames in [start, end].
+        """
+        timestamps = self.index["timestamp"]
+        first = 0 if start is None else int(np.searchsorted(timestamps, start, side="left"))
+        last = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, side="right"))
+        return slice(first, max(first, last))
+
+    def read(self, rows: Any, timestamps: Optional[np.ndarray] = None) -> FlightTable:
+        """
+        Load some rows as a FlightTable.
+
+        Args:
+            rows (Any): Slice, indices or boolean mask of the rows.
+            timestamps (np.ndarray): Frame time of each selected row,
+                added as a `timestamp` column if given.
+
+        Returns:
+            FlightTable: Rows.
+        """
+        columns: Dict[str, Any] = {}
+        for name in STRING_COLUMNS:
+            columns[name] = np.asarray(self.column(name)[rows]).astype(str)
+        for name, dtype in NUMERIC_COLUMNS.items():
+            columns[name] = np.array(self.column(name)[rows], dtype=dtype)
+        for name in CATEGORICAL_COLUMNS:
+            columns[name] = _to_categorical(np.asarray(self.column(name)[rows]))
+        if timestamps is not None:
+            columns["timestamp"] = timestamps
+        return FlightTable(columns)
+
+
+class HistoryStore:
+    """
+    Append-only columnar store of flight snapshots.
+
+    A single process appends frames, any number of readers can query
+    them at the same time: the index entry of a frame is only written
+    once all its rows are, so readers never see partial frames. The
+    writer holds an exclusive lock on the root directory, other
+    processes can only read.
+    """
+
+    def __init__(self, root: str):
+        """
+        Constructor.
+
+        Args:
+            root (str): Root directory, created if needed.
+        """
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._writer_key: Optional[int] = None
+        # Lock file of the writer, None until the store is open for writing
+        self._writer_lock: Optional[Any] = None
+        self._files: Dict[str, Any] = {}
+        self._n_rows = 0
+        self._write_lock = threading.Lock()
+        # Memory maps of sealed partitions, least recently used first
+        self._partitions: "OrderedDict[int, Partition]" = OrderedDict()
+        self._read_lock = threading.Lock()
+        # Keys of the existing partitions, listed again when the root or
+        # the newest day directory changes (see `partition_keys`)
+        self._keys: List[int] = []
+        self._keys_stamp: Optional[Tuple[int, int]] = None
+        # Frames are appended after the newest stored one, also after a
+        # restart
+        self._last_timestamp = -np.inf
+        for key in reversed(self.partition_keys()):
+            entry = _last_entry(os.path.join(partition_path(root, key), "index.bin"))
+            if entry is not None:
+                self._last_timestamp = float(entry["timestamp"])
+                break
+
+    # Writing
+
+    def open_for_writing(self) -> bool:
+        """
+        Take the writer lock of the store (idempotent).
+
+        Returns:
+            bool: True if this store can append frames, False if another
+                process writes to it.
+        """
+        with self._write_lock:
+            if self._writer_lock is None:
+                f = open(os.path.join(self.root, ".writer.lock"), "a")
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    f.close()
+                    return False
+                self._writer_lock = f
+            return True
+
+    def append(self, table: FlightTable, timestamp: float) -> None:
+        """
+        Append a snapshot.
+
+        Args:
+            table (FlightTable): Flights.
+            timestamp (float): Time of the snapshot (seconds since the
+                epoch), frames must be appended in chronological order.
+        """
+        if not self.open_for_writing():
+            raise RuntimeError(f"{self.root} is written by another process")
+        with self._write_lock:
+            if timestamp < self._last_timestamp:
+                raise ValueError("Frames must be appended in chronological order")
+            key = partition_key(timestamp)
+            if key != self._writer_key:
+                self._open_partition(key)
+            for name, dtype in STORED_COLUMNS.items():
+                column = table.columns[name]
+                if dtype.startswith("S"):
+                    values = _to_bytes(column, dtype)
+                else:
+                    values = np.ascontiguousarray(column, dtype=dtype)
+                self._files[name].write(values.tobytes())
+            for name in STORED_COLUMNS:
+                self._files[name].flush()
+            entry = np.array([(timestamp, self._n_rows, len(table))], dtype=INDEX_DTYPE)
+            self._files["index"].write(entry.tobytes())
+            self._files["index"].flush()
+            self._n_rows += len(table)
+            self._last_timestamp = timestamp
+
+    def close(self) -> None:
+        """
+        Close the files of the current partition, sealing it if its hour
+        is over, and release the writer lock.
+        """
+        with self._write_lock:
+            if self._writer_key is not None:
+                self._close_partition(seal=partition_key(time.time()) > self._writer_key)
+            if self._writer_lock is not None:
+                self._writer_lock.close()
+                self._writer_lock = None
+
+    def _open_partition(self, key: int) -> None:
+        # Frames are chronological: the previous hour is over
+        self._close_partition(seal=True)
+        path = partition_path(self.root, key)
+        os.makedirs(path, exist_ok=True)
+        with self._read_lock:
+            self._keys_stamp = None
+        index_path = os.path.join(path, "index.bin")
+        # Resume after a restart: drop the rows of a frame that was
+        # interrupted before its index entry was written
+        n_frames = os.path.getsize(index_path) // INDEX_DTYPE.itemsize if os.path.exists(index_path) else 0
+        self._n_rows = 0
+        last = _last_entry(index_path)
+        if last is not None:
+            self._n_rows = int(last["offset"] + last["count"])
+            self._last_timestamp = max(self._last_timestamp, float(last["timestamp"]))
+        with open(index_path, "ab") as f:
+            f.truncate(n_frames * INDEX_DTYPE.itemsize)
+        for name, dtype in STORED_COLUMNS.items():
+            column_path = os.path.join(path, f"{name}.bin")
+            with open(column_path, "ab") as f:
+                f.truncate(self._n_rows * np.dtype(dtype).itemsize)
+            self._files[name] = open(column_path, "ab")
+        self._files["index"] = open(index_path, "ab")
+        self._writer_key = key
+
+    def _close_partition(self, seal: bool = False) -> None:
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        if self._writer_key is not None and seal:
+            self.seal(self._writer_key)
+        self._writer_key = None
+
+    def seal(self, key: int) -> None:
+        """
+        Write the metadata of a partition that will not change anymore,
+        used to skip it in queries.
+        """
+        partition = Partition(self.root, key)
+        ids = np.unique(partition.column("id"))
+        ids.tofile(os.path.join(partition.path, "ids.bin"))
+        latitude = partition.column("latitude")
+        longitude = partition.column("longitude")
+        meta = {"frames": len(partition.index), "rows": partition.n_rows}
+        if partition.n_rows:
+            meta.update(
+                start=float(partition.index["timestamp"][0]),
+                end=float(partition.index["timestamp"][-1]),
+                south=float(latitude.min()), north=float(latitude.max()),
+                west=float(longitude.min()), east=float(longitude.max()),
+            )
+        meta_path = os.path.join(partition.path, "meta.json")
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    # Reading
+
+    def _listing_stamp(self, keys: List[int]) -> Tuple[int, int]:
+        """
+        Modification times of the root and of the newest day directory:
+        as frames are chronological, new partitions are created in the
+        latter or in a new day directory.
+        """
+        day_mtime = 0
+        if keys:
+            try:
+                day_mtime = os.stat(os.path.dirname(partition_path(self.root, keys[-1]))).st_mtime_ns
+            except FileNotFoundError:
+                pass
+        return os.stat(self.root).st_mtime_ns, day_mtime
+
+    def _list_partitions(self) -> Tuple[List[int], Tuple[int, int]]:
+        # Directories are stat'ed before being listed, so that a partition
+        # created during the listing changes the stamp
+        root_mtime = os.stat(self.root).st_mtime_ns
+        day_mtime = 0
+        keys = []
+        for day in sorted(os.listdir(self.root)):
+            day_path = os.path.join(self.root, day)
+            try:
+                day_mtime = os.stat(day_path).st_mtime_ns
+                hours = sorted(os.listdir(day_path))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for hour in hours:
+                try:
+                    moment = datetime.datetime.strptime(f"{day} {hour}", "%Y-%m-%d %H")
+                except ValueError:
+                    continue
+                keys.append(partition_key(moment.replace(tzinfo=datetime.timezone.utc).timestamp()))
+        return keys, (root_mtime, day_mtime if keys else 0)
+
+    def partition_keys(self, start: Optional[float] = None, end: Optional[float] = None) -> List[int]:
+        """
+        Keys of the existing partitions overlapping [start, end].
+
+        The directories are only listed again when a partition was
+        created since the previous call, which costs two stats.
+        """
+        with self._read_lock:
+            if self._keys_stamp is None or self._listing_stamp(self._keys) != self._keys_stamp:
+                self._keys, self._keys_stamp = self._list_partitions()
+            keys = self._keys
+        return [
+            key for key in keys
+            if (start is None or key >= partition_key(start)) and (end is None or key <= partition_key(end))
+        ]
+
+    def partition(self, key: int) -> Partition:
+        """
+        Partition of a key. Sealed partitions are cached, the others
+        are mapped again on every call to see new frames.
+        """
+        with self._read_lock:
+            partition = self._partitions.get(key)
+            if partition is not None:
+                self._partitions.move_to_end(key)
+                return partition
+        partition = Partition(self.root, key)
+        if partition.sealed:
+            with self._read_lock:
+                self._partitions[key] = partition
+                while len(self._partitions) > MAX_OPEN_PARTITIONS:
+                    self._partitions.popitem(last=False)
+        return partition
+
+    def _partitions_in(self, start: Optional[float], end: Optional[float]) -> Iterator[Partition]:
+        for key in self.partition_keys(start, end):
+            yield self.partition(key)
+
+    def time_range(self) -> Optional[Tuple[float, float]]:
+        """
+        Timestamps of the first and last stored frames, None if empty.
+        """
+        keys = self.partition_keys()
+        first = last = None
+        for key in keys:
+            index = self.partition(key).index
+            if len(index):
+                first = float(index["timestamp"][0])
+                break
+        for key in reversed(keys):
+            index = self.partition(key).index
+            if len(index):
+                last = float(index["timestamp"][-1])
+                break
+        return None if first is None else (first, last)
+
+    def timestamps(self, start: Optional[float] = None, end: Optional[float] = None) -> np.ndarray:
+        """
+        Timestamps of the frames in [start, end].
+        """
+        chunks = [
+            np.asarray(partition.index["timestamp"][partition.frames(start, end)])
+            for partition in self._partitions_in(start, end)
+        ]
+        return np.concatenate(chunks) if chunks else np.zeros(0)
+
+    def frame(self, timestamp: float) -> Optional[Tuple[float, FlightTable]]:
+        """
+        Latest frame at or before a timestamp.
+
+        Only the index of the partition of the timestamp (or of the
+        previous non-empty one) is searched, then the rows of the frame
+        are read.
+
+        Args:
+            timestamp (float): Time (seconds since the epoch).
+
+        Returns:
+            Tuple[float, FlightTable]: Time of the frame and flights,
+                None if no frame was stored before the timestamp.
+        """
+        key = partition_key(timestamp)
+        # Usually in the partition of the timestamp, otherwise in the
+        # last one before it
+        candidates = itertools.chain(
+            [key] if os.path.isdir(partition_path(self.root, key)) else [],
+            (previous for previous in reversed(self.partition_keys(end=timestamp)) if previous != key),
+        )
+        for key in candidates:
+            partition = self.partition(key)
+            position = int(np.searchsorted(partition.index["timestamp"], timestamp, side="right")) - 1
+            if position >= 0:
+                entry = partition.index[position]
+                offset, count = int(entry["offset"]), int(entry["count"])
+                return float(entry["timestamp"]), partition.read(slice(offset, offset + count))
+        return None
+
+    def query(
+        self,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        flight_id: Optional[str] = None,
+        bounds: Optional[str] = None,
+    ) -> FlightTable:
+        """
+        Rows matching a time range, a flight and/or bounds.
+
+        Args:
+            start (float): Start of the time range (seconds since the epoch).
+            end (float): End of the time range.
+            flight_id (str): Flight id.
+            bounds (str): Bounds "y1,y2,x1,x2" (north, south, west, east).
+
+        Returns:
+            FlightTable: Matching rows, in chronological order, with an
+                additional `timestamp` column holding their frame time.
+        """
+        box = None if bounds is None else tuple(float(value) for value in bounds.split(","))
+        tables = []
+        for partition in self._partitions_in(start, end):
+            if not partition.may_contain(flight_id, box):
+                continue
+            entries = partition.index[partition.frames(start, end)]
+            if not len(entries):
+                continue
+            first = int(entries["offset"][0])
+            last = int(entries["offset"][-1] + entries["count"][-1])
+            timestamps = np.repeat(entries["timestamp"], entries["count"])
+            mask = np.ones(last - first, dtype=bool)
+            if flight_id is not None:
+                value = flight_id.encode("ascii", "replace")
+                mask &= partition.column("id")[first:last] == value
+            if box is not None:
+                north, south, west, east = box
+                latitude = partition.column("latitude")[first:last]
+                longitude = partition.column("longitude")[first:last]
+                mask &= (latitude >= south) & (latitude <= north)
+                mask &= (longitude >= west) & (longitude <= east)
+            rows = first + np.flatnonzero(mask)
+            if len(rows):
+                tables.append(partition.read(rows, timestamps[rows - first]))
+        if not tables:
+            return FlightTable({**FlightTable.empty().columns, "timestamp": np.zeros(0)})
+        return FlightTable.concat(tables, unique=False)
@@ -1,99 +1,482 @@
+import hmac
+import math
+import os
+import re
+import time
 import dash
+import flask
+import numpy as np
 from dash import dcc
 from dash import html
 import dash_leaflet as dl
-from dash.dependencies import Output, Input, State
-from FlightRadar24 import FlightRadar24API
-from utils import (
-    update_rotation_angles,
-    get_closest_round_angle,
-    get_custom_icon,
-    fetch_flight_data
+from dash.dependencies import ClientsideFunction, Output, Input, State, MATCH
+from utils import get_angle_buckets, get_rotation_angles, get_viewport_bounds
+from markers import FLIGHT_MARKER, FLIGHT_POPUP, Markers, get_flight_details, diff_snapshots
+from clients import make_client
+from poller import FlightPoller, FlightQuery
+from history import HistoryStore
+from shared import SharedPoller, SharedSessionStore, SharedTrailBuffer
+from sessions import SessionState, SessionStore, follows, new_session_token, new_version
+from clustering import ClusterCache, is_clustered
+from trails import TrailBuffer, diff_trails
+from motion import FRAME_INTERVAL, Tracks, get_motion, is_moving
+from wire import (
+    encode_marker_diff,
+    encode_markers,
+    encode_trail_diff,
+    get_precision,
+    get_wire_config,
 )
+from refresh import (
+    DEFAULT_INTERVAL,
+    PLAYBACK_INTERVAL,
+    LoadMonitor,
+    get_pixel_speed,
+    get_refresh_interval,
+)
+from profiling import Profiler, render_profiles
+from metrics import (
+    CONTENT_TYPE,
+    REGISTRY,
+    SIZE_BUCKETS,
+    Gauge,
+    Histogram,
+    MetricsDirectory,
+    Stopwatch,
+)
+from playback import (
+    PLAYBACK,
+    advance,
+    get_frame_label,
+    get_marks,
+    get_playback_controls,
+    get_playback_snapshot,
+    get_time_range,
+)
+
+
+# App initialization, responses are compressed when the browser accepts it
+app = dash.Dash(__name__, compress=True)
+# WSGI entry point of the production server
+server = app.server
+# Hashed assets never change: let browsers cache them for a year
+HASHED_ASSET = re.compile(r"^/assets/.+\.[0-9a-f]{10}\.\w+$")
+
+
+@app.server.after_request
+def cache_hashed_assets(response):
+    if response.status_code == 200 and HASHED_ASSET.match(flask.request.path):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    return response
+
+
+# Callback metrics, exposed with the fetch metrics on /metrics
+CALLBACK_PHASES = Histogram(
+    "update_graph_live_duration_seconds",
+    "Duration of the phases of the dashboard callback.",
+    labelnames=("phase",),
+)
+RESPONSE_BYTES = Histogram(
+    "dash_response_bytes",
+    "Size of the serialized callback responses, by first output component.",
+    buckets=SIZE_BUCKETS,
+    labelnames=("output",),
+)
+
+
+@app.server.after_request
+def record_response_size(response):
+    if flask.request.path.endswith("/_dash-update-component") and response.status_code == 200:
+        payload = flask.request.get_json(silent=True) or {}
+        output = payload.get("output", "").lstrip(".").split(".", 1)[0]
+        RESPONSE_BYTES.observe(response.content_length or 0, output)
+    return response
+
+
+# Under gunicorn, every process (workers and snapshot process) writes its
+# metrics to FLIGHT_METRICS_DIR, and /metrics exposes their total
+metrics_dir = os.environ.get("FLIGHT_METRICS_DIR")
+shared_metrics = MetricsDirectory(metrics_dir).start() if metrics_dir else None
 
 
-# App initialization
-app = dash.Dash(__name__)
-# FlightRadar24API client
-fr_api = FlightRadar24API()
+@app.server.route("/metrics")
+def metrics():
+    text = REGISTRY.render() if shared_metrics is None else shared_metrics.render()
+    return flask.Response(text, content_type=CONTENT_TYPE)
+
+
+# One callback in FLIGHT_PROFILE_EVERY is profiled (never by default),
+# the ratio can be changed on /admin/profiles when FLIGHT_ADMIN_TOKEN is
+# set. Under gunicorn, the ratio is the one of the worker serving the
+# request, each worker keeps its own, while the profiles of every worker
+# are read from FLIGHT_PROFILE_DIR.
+profiler = Profiler(
+    every=int(os.environ.get("FLIGHT_PROFILE_EVERY", 0)),
+    directory=os.environ.get("FLIGHT_PROFILE_DIR"),
+)
+ADMIN_TOKEN = os.environ.get("FLIGHT_ADMIN_TOKEN")
+
+
+@app.server.route("/admin/profiles")
+def profiles():
+    # The token is sent as "Authorization: Bearer <token>", never in the
+    # URL, which is written to the access log
+    scheme, _, token = flask.request.headers.get("Authorization", "").partition(" ")
+    authorized = scheme.lower() == "bearer" and ADMIN_TOKEN and hmac.compare_digest(token, ADMIN_TOKEN)
+    if not authorized:
+        flask.abort(404)
+    if "every" in flask.request.args:
+        every = flask.request.args.get("every", type=int)
+        if every is None or every < 0:
+            flask.abort(400, "every doit être un entier positif ou nul")
+        profiler.every = every
+    return render_profiles(profiler.slowest(), profiler.every)
+
+
+# Snapshots of the tracked zone are recorded when FLIGHT_HISTORY_DIR is set
+history_dir = os.environ.get("FLIGHT_HISTORY_DIR")
+history = HistoryStore(history_dir) if history_dir else None
+# TO MODIFY
+TRACKED_QUERY = FlightQuery(zone_str="europe", airline_icao="AFR")
+
+
+def make_poller() -> FlightPoller:
+    """
+    Background poller shared by all sessions, with the FlightRadar24API
+    client (or stand-in, see clients.py) selected by FLIGHT_CLIENT.
+    """
+    return FlightPoller(
+        client=make_client(),
+        interval=2,
+        history=history,
+        recorded_query=TRACKED_QUERY,
+    )
+
+
+# Rough memory footprint of a stored trail key
+TRAIL_STATE_BYTES = 200
+# With several workers (see gunicorn.conf.py), the poller runs in a
+# separate process and snapshots are read from shared memory. That
+# process also keeps the session states and trails, so that the calls of
+# a session can be served by any worker.
+if os.environ.get("FLIGHT_SNAPSHOT_SOCKET"):
+    poller = SharedPoller(
+        os.environ["FLIGHT_SNAPSHOT_SOCKET"],
+        os.environ["FLIGHT_SNAPSHOT_AUTHKEY"].encode(),
+    )
+    sessions = SharedSessionStore(poller)
+    trail_buffer = SharedTrailBuffer(poller)
+else:
+    # Started by the first request rather than at import, so that the
+    # reloader of the debug server, which never serves, does not poll
+    poller = make_poller()
+
+    @app.server.before_request
+    def start_poller():
+        poller.start()
+
+    # Previous snapshot of every session
+    sessions = SessionStore(
+        sizeof=lambda state: (
+            state.flights.nbytes + state.angles.nbytes + state.clusters.nbytes + state.index.nbytes
+            + state.tracks.nbytes
+            + TRAIL_STATE_BYTES * len(state.trails)
+        )
+    )
+    # Last positions of the flights, shared by all sessions
+    trail_buffer = TrailBuffer()
+# Clusters shared by sessions looking at the same area
+cluster_cache = ClusterCache()
+# Calls in progress and latency of the dashboard callback
+load_monitor = LoadMonitor()
+Gauge("dash_active_sessions", "Number of sessions with a stored state.", lambda: len(sessions))
 
 
 default_map_children = [
-    dl.TileLayer()
+    dl.TileLayer(),
+    # Trails behind the flights, below the markers
+    dl.LayerGroup(id='trails'),
+    # Flight markers, built and updated by the browser from the wire store
+    dl.LayerGroup(id='markers'),
 ]
 
 
-app.layout = html.Div([
-    # The memory store reverts to the default on every page refresh
-    dcc.Store(id="memory"),
-    # The local store will take the initial data
-    # only the first time the page is loaded
-    # and keep it until it is cleared.
-    dcc.Store(id="local", storage_type="local"),
-    # Same as the local store but will lose the data
-    # when the browser/tab closes.
-    dcc.Store(id="session", storage_type="session"),
-    # TO MODIFY
-    dl.Map(
-        id='map',
-        center=[56, 10],
-        zoom=6,
-        style={'width': '100%', 'height': '800px'},
-        children=default_map_children
-    ),
-    dcc.Interval(
-        id="interval-component",
-        interval=2*1000,  # in milliseconds
-        n_intervals=0
-    )
-])
+def serve_layout():
+    return html.Div([
+        # The memory store reverts to the default on every page refresh.
+        # It only holds a session token, the previous snapshot itself is
+        # kept on the server.
+        dcc.Store(id="memory", data={"token": new_session_token()}),
+        # Version of the markers displayed, set by the browser once it
+        # has applied a wire update
+        dcc.Store(id="rendered", data={"version": None}),
+        # The local store will take the initial data
+        # only the first time the page is loaded
+        # and keep it until it is cleared.
+        dcc.Store(id="local", storage_type="local"),
+        # Same as the local store but will lose the data
+        # when the browser/tab closes.
+        dcc.Store(id="session", storage_type="session"),
+        # Live / playback of the recorded history
+        get_playback_controls(history),
+        # TO MODIFY
+        dl.Map(
+            id='map',
+            center=[56, 10],
+            zoom=6,
+            style={'width': '100%', 'height': '800px'},
+            children=default_map_children
+        ),
+        dcc.Interval(
+            id="interval-component",
+            interval=DEFAULT_INTERVAL,  # in milliseconds, adapted per session
+            n_intervals=0
+        ),
+        # Compact updates of the markers and trails (see wire.py), the
+        # constants needed to decode them, and the browser-side clock
+        # moving the markers between two refreshes
+        dcc.Store(id="wire"),
+        dcc.Store(id="map-config", data=get_wire_config()),
+        dcc.Interval(id="motion-interval", interval=FRAME_INTERVAL),
+    ])
+
+
+app.layout = serve_layout
 
 
 # TO MODIFY
 @app.callback(
-    [Output('map', 'children'), Output('memory', 'data')],
-    [Input('interval-component', 'n_intervals')],
-    [State('memory', 'data')]
+    [
+        Output('playback-time', 'value'),
+        Output('playback-time', 'min'),
+        Output('playback-time', 'max'),
+        Output('playback-time', 'marks'),
+        Output('playback', 'data'),
+        Output('play-button', 'children'),
+    ],
+    [Input('interval-component', 'n_intervals'), Input('play-button', 'n_clicks')],
+    [
+        State('playback-time', 'value'),
+        State('playback-speed', 'value'),
+        State('mode', 'value'),
+        State('playback', 'data'),
+    ],
+    prevent_initial_call=True,
+)
+def update_playback(n, n_clicks, value, speed, mode, playback):
+    if history is None or mode != PLAYBACK:
+        raise dash.exceptions.PreventUpdate
+    time_range = get_time_range(history)
+    playing = playback["playing"]
+    now = time.time()
+    if dash.ctx.triggered_id == 'play-button':
+        playing = not playing
+        # Start again from the beginning once the end was reached
+        if playing and value is not None and value >= time_range[1]:
+            value = time_range[0]
+    elif playing:
+        value, playing = advance(value, time_range, speed, now - playback["tick"])
+    return [
+        value,
+        time_range[0],
+        time_range[1],
+        get_marks(*time_range),
+        {"playing": playing, "tick": now},
+        "Pause" if playing else "Lecture",
+    ]
+
+
+@app.callback(
+    [
+        Output('wire', 'data'),
+        Output('playback-label', 'children'),
+        Output('interval-component', 'interval'),
+    ],
+    [
+        Input('interval-component', 'n_intervals'),
+        Input('map', 'bounds'),
+        Input('mode', 'value'),
+        Input('playback-time', 'value'),
+    ],
+    [
+        State('playback-speed', 'value'),
+        State('map', 'zoom'),
+        State('memory', 'data'),
+        State('rendered', 'data'),
+    ]
 )
-def update_graph_live(n, previous_data):
-    # Retrieve a list of flight dictionaries with 'latitude', 'longitude', 'id'
-    # and additional keys
-    # TO MODIFY
-    data = fetch_flight_data(client=fr_api, airline_icao="AFR", zone_str="europe")
-    # Add a rotation_angle key to dictionaries
-    if previous_data is None:
-        for flight_data in data:
-            flight_data.update(rotation_angle=0)
+@load_monitor.measure
+@profiler.profile
+def update_graph_live(n, map_bounds, mode, playback_time, speed, zoom, memory, rendered):
+    # Retrieve the flights (a FlightTable with 'latitude', 'longitude', 'id'
+    # and additional columns) around the area displayed by the map: either
+    # the latest snapshot, or a recorded one in playback mode
+    stopwatch = Stopwatch(CALLBACK_PHASES)
+    bounds = get_viewport_bounds(map_bounds, zoom)
+    label = dash.no_update
+    playback = mode == PLAYBACK and history is not None
+    if playback:
+        snapshot = get_playback_snapshot(
+            history, TRACKED_QUERY._replace(bounds=bounds), playback_time
+        )
+        label = get_frame_label(snapshot)
+    else:
+        snapshot = poller.get(
+            airline_icao=TRACKED_QUERY.airline_icao,
+            zone_str=TRACKED_QUERY.zone_str,
+            bounds=bounds,
+        )
+        # No snapshot of a new area yet: keep the markers displayed
+        # rather than removing them all
+        if not snapshot.version:
+            raise dash.exceptions.PreventUpdate
+        trail_buffer.update(
+            snapshot.table, snapshot.timestamp, key=(snapshot.query, snapshot.timestamp)
+        )
+    stopwatch.lap("fetch")
+    table = snapshot.table
+    profiler.annotate(
+        flights=len(table),
+        zone=TRACKED_QUERY.zone_str,
+        airline=TRACKED_QUERY.airline_icao,
+        zoom=zoom,
+        mode=mode,
+    )
+    state = sessions.get(memory["token"])
+    previous_interval = DEFAULT_INTERVAL if state is None else state.interval
+    # After a mode switch or a seek, the previous snapshot is unrelated:
+    # start over as on the first tick
+    if state is not None and not follows(state, mode, snapshot.timestamp, speed if playback else 1):
+        state = None
+    # Rotation angles of the flights, from their previous position
+    if state is None:
+        angles = np.zeros(len(table))
     else:
-        update_rotation_angles(data, previous_data)
-
-    # Update map children by adding markers to the default tiles layer
-    children = default_map_children + [
-        dl.Marker(
-            id=flight['id'],
-            position=[flight['latitude'], flight['longitude']],
-            children=[
-                dl.Popup(html.Div([
-                    dcc.Markdown(f'''
-                        **Identifiant du vol**: {flight['id']}.
-
-                         **Inuméro du vol**: {flight['number']}.
-
-                        **Aérport d'origine**: {flight['origin_airport_iata']}.
-
-                        **Aéroport de destination**: {flight['destination_airport_iata']}.
-
-                        **Vitesse au sol**: {flight['ground_speed']} noeuds.
-                    ''')
-                ]))
-            ],
-            icon=get_custom_icon(
-                get_closest_round_angle(flight['rotation_angle'])
-            ),
-        ) for flight in data
+        angles = get_rotation_angles(table, state.flights, state.angles)
+    flights = Markers.from_table(table, get_angle_buckets(angles))
+    stopwatch.lap("rotation")
+
+    # When zoomed out, dense cells are replaced by cluster markers
+    if is_clustered(zoom):
+        clusters = cluster_cache.get(
+            (snapshot.query, snapshot.timestamp, int(math.floor(zoom))),
+            table,
+            zoom,
+        )
+        cluster_markers = clusters.clusters
+        # Rows of the markers among the flights then the clusters, kept
+        # by the session instead of the markers themselves
+        index = np.concatenate([
+            len(table) + np.arange(len(cluster_markers.id)), clusters.singletons
+        ])
+        items = Markers.concat([cluster_markers, flights.take(clusters.singletons)])
+    else:
+        cluster_markers = flights.take(np.zeros(0, dtype=np.intp))
+        index = np.arange(len(table))
+        items = flights
+    # Trails of the flights, only in live mode and when zoomed in
+    if playback or is_clustered(zoom):
+        trails = {}
+    else:
+        trails = trail_buffer.get_trails(table.id.tolist(), zoom)
+
+    # Versions never repeat, even for concurrent calls of a session
+    version = new_version()
+    # Coordinates are sent with about a pixel of precision
+    scale = 10 ** get_precision(zoom)
+    # First tick, or markers of the client out of sync with the
+    # stored snapshot (a concurrent call or a skipped update): build
+    # every marker
+    full = state is None or state.version != rendered["version"]
+    if full:
+        markers = encode_markers(items, scale)
+        trail_diff = diff_trails([], trails)
+        tracks = Tracks.unknown(len(items.id))
+    # Next ticks: only send the markers that changed
+    else:
+        diff = diff_snapshots(state.markers(get_angle_buckets(state.angles)), items)
+        items = diff.data
+        index = index[diff.rows]
+        # Moving flights are positioned by the browser
+        if not playback:
+            diff = diff._replace(moved=diff.moved[~is_moving(items)[diff.moved]])
+        markers = encode_marker_diff(diff, scale)
+        trail_diff = diff_trails(state.trails, trails)
+        tracks = Tracks.concat([state.tracks.take(diff.positions), Tracks.unknown(len(diff.added.id))])
+    stopwatch.lap("markers")
+    # Refresh period: fixed in playback, adapted to the change rate of
+    # the view and to the load of the server otherwise
+    if playback:
+        motion = None
+        tracks = Tracks.unknown(len(items.id))
+        interval = PLAYBACK_INTERVAL
+    else:
+        motion, tracks = get_motion(items, tracks, snapshot.timestamp, scale, zoom)
+        pixel_speed = None if state is None else get_pixel_speed(
+            table, state.flights, snapshot.timestamp - state.timestamp, zoom
+        )
+        interval = get_refresh_interval(
+            previous_interval, pixel_speed, load_monitor.latency, load_monitor.in_flight
+        )
+    sessions.set(
+        memory["token"],
+        SessionState(
+            version, table, angles, cluster_markers, index, trail_diff.displayed,
+            snapshot.timestamp, interval, mode, tracks,
+        ),
+    )
+    stopwatch.total()
+
+    return [
+        {
+            "version": version,
+            # Version the update applies to, the browser skips it otherwise
+            "base": None if full else state.version,
+            "full": full,
+            "scale": scale,
+            "markers": markers,
+            "trails": encode_trail_diff(trail_diff, scale),
+            "motion": motion,
+        },
+        label,
+        interval if interval != previous_interval else dash.no_update,
     ]
 
-    return [children, data]
+
+# Apply the updates of the wire store to the markers and trails, and
+# extrapolate the positions of the markers between two refreshes, only
+# moving the markers that moved by a pixel or more at the current zoom
+app.clientside_callback(
+    ClientsideFunction(namespace='markers', function_name='render'),
+    [Output('markers', 'children'), Output('trails', 'children'), Output('rendered', 'data')],
+    [Input('wire', 'data'), Input('motion-interval', 'n_intervals')],
+    [
+        State('markers', 'children'),
+        State('trails', 'children'),
+        State('map-config', 'data'),
+        State('map', 'zoom'),
+    ],
+    prevent_initial_call=True,
+)
+
+
+@app.callback(
+    Output({'type': FLIGHT_POPUP, 'index': MATCH}, 'children'),
+    [Input({'type': FLIGHT_MARKER, 'index': MATCH}, 'n_clicks')],
+    [State('memory', 'data')],
+    prevent_initial_call=True,
+)
+def show_flight_details(n_clicks, memory):
+    # Popups are only filled when their marker is clicked
+    flight_id = dash.ctx.triggered_id['index']
+    state = sessions.get(memory["token"])
+    flight = None if state is None else state.flights.row(flight_id)
+    if flight is None:
+        return dash.no_update
+    return get_flight_details(flight.to_dict())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,182 @@
+"""
+Markers rendering.
+
+Markers are built once when a flight (or a cluster of flights) appears,
+then only updated: each tick the new snapshot is compared with the
+previous one and only the marker properties that actually changed are
+sent, in the wire format (see wire.py). Like snapshots, markers are
+handled as columns (see Markers). Flight popups are empty until the
+marker is clicked, their content is then filled by a dedicated callback.
+"""
+from typing import Dict, NamedTuple, Sequence
+import numpy as np
+from dash import dcc, html
+from snapshot import FlightTable
+
+
+# Pattern-matching ids of flight markers and of their popup
+FLIGHT_MARKER = "flight-marker"
+FLIGHT_POPUP = "flight-popup"
+
+
+class Markers(NamedTuple):
+    """
+    Columns of markers, flights or clusters of flights.
+
+    Attributes:
+        id (np.ndarray): Flight or cluster ids.
+        latitude (np.ndarray): Latitudes.
+        longitude (np.ndarray): Longitudes.
+        icon (np.ndarray): Indices of the icons in PLANE_ICONS.
+        cluster_size (np.ndarray): Number of flights of the clusters,
+            0 for flights.
+        ground_speed (np.ndarray): Ground speeds (in knots), 0 for
+            clusters.
+        heading (np.ndarray): Headings (in degrees), 0 for clusters.
+    """
+    id: np.ndarray
+    latitude: np.ndarray
+    longitude: np.ndarray
+    icon: np.ndarray
+    cluster_size: np.ndarray
+    ground_speed: np.ndarray
+    heading: np.ndarray
+
+    @classmethod
+    def from_table(cls, table: FlightTable, icons: np.ndarray) -> "Markers":
+        """
+        Markers of the flights of a table.
+
+        Args:
+            table (FlightTable): Flights.
+            icons (np.ndarray): Icon of each flight.
+        """
+        return cls(
+            id=table.id,
+            latitude=table.latitude,
+            longitude=table.longitude,
+            icon=icons,
+            cluster_size=np.zeros(len(table), dtype=np.int64),
+            ground_speed=table.ground_speed,
+            heading=table.heading,
+        )
+
+    @classmethod
+    def concat(cls, markers: Sequence["Markers"]) -> "Markers":
+        """
+        Concatenate markers.
+        """
+        return cls(*(np.concatenate(columns) for columns in zip(*markers)))
+
+    def take(self, rows: np.ndarray) -> "Markers":
+        """
+        Subset of the markers.
+
+        Args:
+            rows (np.ndarray): Row indices or boolean mask.
+        """
+        return Markers(*(column[rows] for column in self))
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory used by the columns (in bytes).
+        """
+        return sum(column.nbytes for column in self)
+
+
+class SnapshotDiff(NamedTuple):
+    """
+    Differences between two sets of markers, keyed by id.
+
+    Positions refer to the order of the previous markers, which is
+    also the order of the markers on the client.
+
+    Attributes:
+        data (Markers): New markers, in their order once the diff is
+            applied: markers kept first, then new ones.
+        positions (np.ndarray): Previous positions of the markers kept,
+            the first rows of `data`.
+        removed (np.ndarray): Positions of the markers that disappeared.
+        moved (np.ndarray): Rows of `data` of the markers kept whose
+            position changed.
+        rotated (np.ndarray): Rows of `data` of the markers kept whose
+            icon changed.
+        updated (np.ndarray): Rows of `data` of the clusters kept whose
+            size changed.
+        added (Markers): New markers, the last rows of `data`.
+        rows (np.ndarray): Rows of the new markers given to
+            `diff_snapshots` in the order of `data`.
+    """
+    data: Markers
+    positions: np.ndarray
+    removed: np.ndarray
+    moved: np.ndarray
+    rotated: np.ndarray
+    updated: np.ndarray
+    added: Markers
+    rows: np.ndarray
+
+
+def get_flight_details(flight: Dict) -> html.Div:
+    """
+    Get the content of the popup of a flight marker.
+
+    Args:
+        flight (Dict): Flight data.
+
+    Returns:
+        html.Div: Popup content.
+    """
+    return html.Div([
+        dcc.Markdown(f'''
+            **Identifiant du vol**: {flight['id']}.
+
+             **Inuméro du vol**: {flight['number']}.
+
+            **Aérport d'origine**: {flight['origin_airport_iata']}.
+
+            **Aéroport de destination**: {flight['destination_airport_iata']}.
+
+            **Vitesse au sol**: {flight['ground_speed']} noeuds.
+        ''')
+    ])
+
+
+def diff_snapshots(previous: Markers, markers: Markers) -> SnapshotDiff:
+    """
+    Compare two sets of markers.
+
+    Args:
+        previous (Markers): Previous markers, in the order of the client.
+        markers (Markers): New markers.
+
+    Returns:
+        SnapshotDiff: Differences.
+    """
+    rows_by_id = {identifier: row for row, identifier in enumerate(markers.id.tolist())}
+    # Row of each previous marker among the new ones, -1 if it disappeared
+    rows = np.fromiter(
+        (rows_by_id.pop(identifier, -1) for identifier in previous.id.tolist()),
+        dtype=np.int64,
+        count=len(previous.id),
+    )
+    kept = rows >= 0
+    positions = np.flatnonzero(kept)
+    # Remaining rows are new markers
+    added_rows = np.fromiter(rows_by_id.values(), dtype=np.int64, count=len(rows_by_id))
+    added = markers.take(added_rows)
+    current = markers.take(rows[kept])
+    before = previous.take(positions)
+    return SnapshotDiff(
+        data=Markers.concat([current, added]),
+        positions=positions,
+        removed=np.flatnonzero(~kept),
+        moved=np.flatnonzero(
+            (current.latitude != before.latitude) | (current.longitude != before.longitude)
+        ),
+        rotated=np.flatnonzero(current.icon != before.icon),
+        updated=np.flatnonzero(current.cluster_size != before.cluster_size),
+        added=added,
+        rows=np.concatenate([rows[kept], added_rows]),
+    )
@@ -0,0 +1,339 @@
+"""
+Prometheus metrics.
+
+Minimal thread-safe counters, gauges and histograms rendered in the
+Prometheus text exposition format, so that the app can be scraped
+without any extra dependency. Recording a value only takes a lock and a
+bisection, a few microseconds on the hot path.
+
+With several processes (see gunicorn.conf.py), each one periodically
+writes its counters and histograms to a shared directory, and the
+process serving a scrape adds up those of the others to its own (see
+MetricsDirectory).
+"""
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import atexit
+import bisect
+import json
+import math
+import os
+import threading
+import time
+import uuid
+
+
+# Latency buckets (in seconds)
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+# Size buckets (in bytes)
+SIZE_BUCKETS = tuple(2 ** exponent for exponent in range(8, 25, 2))
+# Count buckets (flights per fetch)
+COUNT_BUCKETS = (0, 10, 100, 500, 1000, 2000, 5000, 10000, 20000, 50000)
+# Period at which processes write their metrics to a MetricsDirectory
+# (in seconds)
+SHARE_PERIOD = 5.0
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    """
+    Base class of the metrics: a name, a help text and label names.
+    Values are recorded per tuple of label values, passed positionally.
+    """
+    kind = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: Optional["Registry"] = None,
+    ):
+        """
+        Constructor.
+
+        Args:
+            name (str): Metric name.
+            documentation (str): Help text.
+            labelnames (Sequence[str]): Label names.
+            registry (Registry): Registry exposing the metric, the
+                default REGISTRY if None.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def samples(self, others: Sequence[Any] = ()) -> Iterator[Tuple[str, str, float]]:
+        """
+        Samples of the metric: (name suffix, labels, value).
+
+        Args:
+            others (Sequence): Values dumped by other processes, added
+                to the ones of this process.
+        """
+        raise NotImplementedError
+
+    def dump(self) -> Optional[Any]:
+        """
+        Values recorded by the process, JSON-serializable, None for
+        metrics that are not added up across processes.
+        """
+        return None
+
+    def render(self, others: Sequence[Any] = ()) -> str:
+        lines = [
+            f"# HELP {self.name} {_escape(self.documentation)}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(
+            f"{self.name}{suffix}{labels} {_format_value(value)}"
+            for suffix, labels, value in self.samples(others)
+        )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing counter.
+    """
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dump(self) -> List:
+        with self._lock:
+            return [[list(labels), value] for labels, value in self._values.items()]
+
+    def samples(self, others: Sequence[Any] = ()) -> Iterator[Tuple[str, str, float]]:
+        with self._lock:
+            values = dict(self._values)
+        for rows in others:
+            for labels, value in rows:
+                labels = tuple(labels)
+                values[labels] = values.get(labels, 0.0) + value
+        for labels, value in values.items():
+            yield "", _format_labels(self.labelnames, labels), value
+
+
+class Gauge(Metric):
+    """
+    Value read from a function when the metrics are scraped, by the
+    scraped process only.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], float], **kwargs):
+        super().__init__(name, documentation, **kwargs)
+        self.function = function
+
+    def samples(self, others: Sequence[Any] = ()) -> Iterator[Tuple[str, str, float]]:
+        yield "", "", float(self.function())
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values in cumulative buckets.
+    """
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        **kwargs,
+    ):
+        super().__init__(name, documentation, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # Label values -> (count per bucket, the last one for +Inf, sum)
+        self._series: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def dump(self) -> List:
+        with self._lock:
+            return [[list(labels), list(counts), total] for labels, (counts, total) in self._series.items()]
+
+    def samples(self, others: Sequence[Any] = ()) -> Iterator[Tuple[str, str, float]]:
+        with self._lock:
+            series = {labels: [list(counts), total] for labels, (counts, total) in self._series.items()}
+        for rows in others:
+            for labels, counts, total in rows:
+                merged = series.setdefault(tuple(labels), [[0] * (len(self.buckets) + 1), 0.0])
+                merged[0] = [count + other for count, other in zip(merged[0], counts)]
+                merged[1] += total
+        for labels, (counts, total) in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield "_bucket", _format_labels(
+                    self.labelnames + ("le",), labels + (_format_value(bound),)
+                ), cumulative
+            yield "_sum", _format_labels(self.labelnames, labels), total
+            yield "_count", _format_labels(self.labelnames, labels), cumulative
+
+
+class Stopwatch:
+    """
+    Record the durations of the successive phases of a computation in a
+    histogram labelled by phase.
+    """
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.start = self.lap_start = time.perf_counter()
+
+    def lap(self, phase: str) -> None:
+        """
+        Record the time since the previous lap under `phase`.
+        """
+        now = time.perf_counter()
+        self.histogram.observe(now - self.lap_start, phase)
+        self.lap_start = now
+
+    def total(self, phase: str = "total") -> None:
+        """
+        Record the time since the start under `phase`.
+        """
+        self.histogram.observe(time.perf_counter() - self.start, phase)
+
+
+class Registry:
+    """
+    Set of metrics exposed together.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> None:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def dump(self) -> Dict[str, Any]:
+        """
+        Values of the metrics added up across processes, by name.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        dumps = {metric.name: metric.dump() for metric in metrics}
+        return {name: values for name, values in dumps.items() if values is not None}
+
+    def render(self, others: Sequence[Dict[str, Any]] = ()) -> str:
+        """
+        Text exposition format of every metric.
+
+        Args:
+            others (Sequence[Dict]): Dumps of the registries of other
+                processes, added to the values of this one.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(
+            metric.render([other[metric.name] for other in others if metric.name in other])
+            for metric in metrics
+        ) + "\n"
+
+
+class MetricsDirectory:
+    """
+    Directory where the processes of a server write their metrics, each
+    to its own file, so that any of them can expose the total. Values of
+    the other processes are up to `period` seconds old, those of exited
+    processes are still counted.
+    """
+
+    def __init__(self, path: str, registry: Optional[Registry] = None, period: float = SHARE_PERIOD):
+        """
+        Constructor.
+
+        Args:
+            path (str): Directory, created if needed.
+            registry (Registry): Registry of the process, the default
+                REGISTRY if None.
+            period (float): Time between two writes (in seconds).
+        """
+        self.path = path
+        self.registry = registry or REGISTRY
+        self.period = period
+        # Unique even if the process id is reused
+        self.file_name = f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json"
+        os.makedirs(path, exist_ok=True)
+
+    def start(self) -> "MetricsDirectory":
+        """
+        Write the metrics of the process periodically, and when it exits.
+        """
+        def run():
+            while True:
+                time.sleep(self.period)
+                self.write()
+
+        self.write()
+        atexit.register(self.write)
+        threading.Thread(target=run, name="metrics-writer", daemon=True).start()
+        return self
+
+    def write(self) -> None:
+        """
+        Write the metrics of the process, atomically.
+        """
+        path = os.path.join(self.path, self.file_name)
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.registry.dump(), f)
+        os.replace(path + ".tmp", path)
+
+    def render(self) -> str:
+        """
+        Text exposition format of the metrics of every process.
+        """
+        others = []
+        for name in os.listdir(self.path):
+            if name == self.file_name or not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.path, name)) as f:
+                    others.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return self.registry.render(others)
+
+
+# Registry of the app, exposed on /metrics
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -0,0 +1,183 @@
+"""
+Dead reckoning of flight markers.
+
+Between two server updates, the browser extrapolates the position of
+every moving flight from its ground speed and heading
+(assets/markers.js), and only moves the markers whose extrapolated
+position changed by a pixel or more at the current zoom.
+
+The browser keeps the track of each moving flight, by flight id: its
+position at the time it was sent, its ground speed and its heading. The
+server keeps a copy of those tracks in the session state, and only sends
+the tracks of new moving flights, of flights whose speed or heading
+changed, and of flights whose reported position is a pixel or more away
+from the one the browser extrapolates. A flight that stops is sent with
+a zero speed, and its track is dropped. When a track is replaced, the
+browser eases the marker from the position it is drawn at to the new
+track instead of jumping.
+"""
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
+import time
+import numpy as np
+from markers import Markers
+from wire import encode_coordinates
+
+
+# Refresh period of the extrapolated positions in the browser (in ms)
+FRAME_INTERVAL = 250
+# Positions are not extrapolated further than this (in seconds)
+MAX_EXTRAPOLATION = 60.0
+# Knot in meters per second
+KNOT = 1852 / 3600
+# Length of a degree of latitude (in meters)
+METERS_PER_DEGREE = 2 * np.pi * 6371008.8 / 360
+# Floor of the cosine of the latitude, to keep longitude speeds finite
+# near the poles
+MIN_COS_LATITUDE = 0.01
+# Tracks are sent again once the browser is this far from the reported
+# position (in pixels)
+MIN_PIXELS = 1
+# Width of a map tile (in pixels)
+TILE_SIZE = 256
+
+
+class Tracks(NamedTuple):
+    """
+    Tracks of the markers known by the browser, one per marker, in the
+    order of the markers on the client.
+
+    Attributes:
+        time (np.ndarray): Time of the snapshot each track was sent
+            with, NaN for markers without a track.
+        latitude (np.ndarray): Latitudes, as decoded by the browser.
+        longitude (np.ndarray): Longitudes, as decoded by the browser.
+        ground_speed (np.ndarray): Ground speeds (in knots).
+        heading (np.ndarray): Headings (in degrees).
+    """
+    time: np.ndarray
+    latitude: np.ndarray
+    longitude: np.ndarray
+    ground_speed: np.ndarray
+    heading: np.ndarray
+
+    @classmethod
+    def unknown(cls, n: int) -> "Tracks":
+        """
+        Tracks of markers the browser has no track of.
+        """
+        return cls(np.full(n, np.nan), *(np.zeros(n) for _ in range(4)))
+
+    @classmethod
+    def concat(cls, tracks: Sequence["Tracks"]) -> "Tracks":
+        """
+        Concatenate tracks.
+        """
+        return cls(*(np.concatenate(columns) for columns in zip(*tracks)))
+
+    def take(self, rows: np.ndarray) -> "Tracks":
+        """
+        Tracks of a subset of the markers.
+        """
+        return Tracks(*(column[rows] for column in self))
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory used by the columns (in bytes).
+        """
+        return sum(column.nbytes for column in self)
+
+    def extrapolate(self, timestamp: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Positions extrapolated by the browser at a given time, as in
+        assets/markers.js (NaN for markers without a track).
+        """
+        elapsed = np.clip(timestamp - self.time, 0, MAX_EXTRAPOLATION)
+        speed = KNOT * self.ground_speed
+        heading = np.radians(self.heading)
+        cos_latitude = np.maximum(np.cos(np.radians(self.latitude)), MIN_COS_LATITUDE)
+        latitude_speed = speed * np.cos(heading) / METERS_PER_DEGREE
+        longitude_speed = speed * np.sin(heading) / (METERS_PER_DEGREE * cos_latitude)
+        return self.latitude + latitude_speed * elapsed, self.longitude + longitude_speed * elapsed
+
+
+def is_moving(markers: Markers) -> np.ndarray:
+    """
+    Whether markers are flights whose position is extrapolated by the
+    browser (clusters and flights at rest are not).
+    """
+    return (markers.cluster_size == 0) & (markers.ground_speed > 0)
+
+
+def get_motion(
+    markers: Markers,
+    tracks: Tracks,
+    timestamp: float,
+    scale: int,
+    zoom: Optional[float],
+) -> Tuple[Dict, Tracks]:
+    """
+    Tracks to send to the browser, in the columnar layout of the wire
+    format (see wire.py).
+
+    Args:
+        markers (Markers): Flights and clusters, in marker order.
+        tracks (Tracks): Tracks of the markers known by the browser.
+        timestamp (float): Time of the snapshot the positions come from.
+        scale (int): Coordinates are sent as integers, multiplied by it.
+        zoom (float): Zoom level of the map.
+
+    Returns:
+        Tuple[Dict, Tracks]: Snapshot and server times, and columns of
+            the tracks sent: flight ids, latitudes, longitudes, ground
+            speeds (in knots, 0 to drop a track) and headings (in
+            degrees). Then the tracks known by the browser once they are
+            applied.
+    """
+    moving = is_moving(markers)
+    known = ~np.isnan(tracks.time)
+    latitude, longitude = tracks.extrapolate(timestamp)
+    # Web Mercator stretches latitudes by 1 / cos(latitude)
+    cos_latitude = np.maximum(np.cos(np.radians(markers.latitude)), MIN_COS_LATITUDE)
+    degrees = np.maximum(
+        np.abs(markers.latitude - latitude) / cos_latitude,
+        np.abs((markers.longitude - longitude + 180) % 360 - 180),
+    )
+    pixels_per_degree = np.inf if zoom is None else TILE_SIZE * 2 ** zoom / 360
+    with np.errstate(invalid="ignore"):
+        deviated = ~(degrees * pixels_per_degree < MIN_PIXELS)
+    changed = (
+        (markers.ground_speed != tracks.ground_speed)
+        | (markers.heading != tracks.heading)
+        | deviated
+    )
+    sent = np.flatnonzero((moving & (~known | changed)) | (~moving & known))
+    latitudes = encode_coordinates(markers.latitude[sent], scale)
+    longitudes = encode_coordinates(markers.longitude[sent], scale)
+    speeds = np.where(moving[sent], markers.ground_speed[sent], 0)
+
+    # Tracks of the browser: replaced by the ones sent, dropped for
+    # flights at rest
+    time_column = np.where(moving, tracks.time, np.nan)
+    time_column[sent[moving[sent]]] = timestamp
+    updated = Tracks(
+        time_column,
+        tracks.latitude.copy(),
+        tracks.longitude.copy(),
+        tracks.ground_speed.copy(),
+        tracks.heading.copy(),
+    )
+    updated.latitude[sent] = np.asarray(latitudes, dtype=np.float64) / scale
+    updated.longitude[sent] = np.asarray(longitudes, dtype=np.float64) / scale
+    updated.ground_speed[sent] = markers.ground_speed[sent]
+    updated.heading[sent] = markers.heading[sent]
+    motion = {
+        "time": timestamp,
+        "now": time.time(),
+        "id": markers.id[sent].tolist(),
+        "lat": latitudes,
+        "lon": longitudes,
+        "speed": speeds.tolist(),
+        "heading": markers.heading[sent].tolist(),
+    }
+    return motion, updated
@@ -0,0 +1,157 @@
+"""
+Playback of the recorded history.
+
+In playback mode the dashboard displays frames read from the history
+store instead of live snapshots: a slider selects the time, and a
+play/pause button with a speed selector moves it forward on every tick
+of the refresh interval. Frames go through the same rotation and marker
+pipeline as live snapshots.
+"""
+from typing import Dict, Optional, Tuple
+import datetime
+from dash import dcc, html
+from history import HistoryStore
+from poller import FlightQuery, Snapshot
+
+
+LIVE = "live"
+PLAYBACK = "playback"
+# Playback speeds (multiples of real time)
+SPEEDS = (1, 10, 60, 300)
+MAX_MARKS = 12
+MARK_STEPS = (60, 300, 900, 3600, 3 * 3600, 6 * 3600, 24 * 3600)
+
+
+def format_time(timestamp: float) -> str:
+    """
+    Human-readable UTC time of a timestamp.
+    """
+    moment = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+    return moment.strftime("%Y-%m-%d %H:%M:%S UTC")
+
+
+def get_marks(start: float, end: float) -> Dict[int, str]:
+    """
+    Slider marks at round times, at most MAX_MARKS of them.
+    """
+    step = next(
+        (step for step in MARK_STEPS if (end - start) / step <= MAX_MARKS), MARK_STEPS[-1]
+    )
+    marks = {}
+    for timestamp in range(int(start // step + 1) * step, int(end) + 1, step):
+        moment = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+        marks[timestamp] = moment.strftime("%H:%M" if step < 24 * 3600 else "%d/%m")
+    return marks
+
+
+def get_time_range(history: Optional[HistoryStore]) -> Tuple[float, float]:
+    """
+    Range of the playback slider, (0, 0) without history.
+    """
+    time_range = None if history is None else history.time_range()
+    return (0.0, 0.0) if time_range is None else time_range
+
+
+def get_playback_controls(history: Optional[HistoryStore]) -> html.Div:
+    """
+    Mode selector and playback controls. They are hidden when no
+    history is recorded.
+    """
+    start, end = get_time_range(history)
+    return html.Div([
+        dcc.RadioItems(
+            id="mode",
+            options=[
+                {"label": "Direct", "value": LIVE},
+                {"label": "Historique", "value": PLAYBACK},
+            ],
+            value=LIVE,
+            inline=True,
+        ),
+        html.Button("Lecture", id="play-button", n_clicks=0),
+        dcc.Dropdown(
+            id="playback-speed",
+            options=[{"label": f"x{speed}", "value": speed} for speed in SPEEDS],
+            value=SPEEDS[1],
+            clearable=False,
+            style={"width": "100px", "display": "inline-block", "verticalAlign": "middle"},
+        ),
+        html.Span(id="playback-label", children=format_time(end) if end else ""),
+        dcc.Slider(
+            id="playback-time",
+            min=start,
+            max=end,
+            step=1,
+            value=end,
+            marks=get_marks(start, end),
+            updatemode="mouseup",
+        ),
+        # Whether playback is running, and time of its last move
+        dcc.Store(id="playback", data={"playing": False, "tick": None}),
+    ], style={} if history is not None else {"display": "none"})
+
+
+def advance(
+    value: Optional[float],
+    time_range: Tuple[float, float],
+    speed: float,
+    elapsed: float,
+) -> Tuple[float, bool]:
+    """
+    Move the playback time forward.
+
+    Args:
+        value (float): Current playback time.
+        time_range (Tuple[float, float]): First and last recorded times.
+        speed (float): Playback speed.
+        elapsed (float): Real time since the previous tick (in seconds).
+
+    Returns:
+        Tuple[float, bool]: New playback time, and whether playback goes
+            on (False once the end of the history is reached).
+    """
+    start, end = time_range
+    value = start if value is None else max(value, start)
+    value += speed * elapsed
+    if value >= end:
+        return end, False
+    return value, True
+
+
+def get_playback_snapshot(
+    history: HistoryStore,
+    query: FlightQuery,
+    timestamp: float,
+) -> Snapshot:
+    """
+    Snapshot of the recorded frame displayed at a time, restricted to
+    the bounds of the query.
+
+    Args:
+        history (HistoryStore): History store.
+        query (FlightQuery): Query, whose bounds are the viewport.
+        timestamp (float): Playback time.
+
+    Returns:
+        Snapshot: Frame, empty if nothing was recorded before the time.
+    """
+    frame = history.frame(timestamp)
+    if frame is None:
+        return Snapshot(query=query)
+    frame_time, table = frame
+    if query.bounds is not None:
+        north, south, west, east = (float(value) for value in query.bounds.split(","))
+        table = table.take(
+            (table.latitude >= south) & (table.latitude <= north)
+            & (table.longitude >= west) & (table.longitude <= east)
+        )
+    return Snapshot(query=query, table=table, timestamp=frame_time)
+
+
+def get_frame_label(snapshot: Snapshot) -> str:
+    """
+    Label of the frame displayed.
+    """
+    if not snapshot.timestamp:
+        return "Aucune donnée enregistrée à cette date"
+    return f"{format_time(snapshot.timestamp)} - {len(snapshot.table)} vols"
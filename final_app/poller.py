@@ -0,0 +1,269 @@
+"""
+Background flight data poller.
+
+A single ingestion loop owns the FlightRadar24API client and refreshes
+every query that dashboards are currently asking for, so that the number
+of upstream requests does not depend on the number of open sessions.
+Due queries are polled concurrently on the fetch pool, so that a new
+query does not wait behind all the others.
+"""
+from typing import Dict, NamedTuple, Optional, Tuple
+from concurrent.futures import Executor, Future, wait
+from dataclasses import dataclass, field
+import logging
+import threading
+import time
+from FlightRadar24 import FlightRadar24API
+from history import HistoryStore
+from snapshot import FlightTable
+from tiling import TiledFetcher
+from utils import FETCH_EXECUTOR, fetch_flight_table
+
+
+logger = logging.getLogger(__name__)
+
+
+class FlightQuery(NamedTuple):
+    """
+    Parameters of a fetch_flight_table call.
+    """
+    zone_str: Optional[str] = None
+    airline_icao: Optional[str] = None
+    bounds: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    Immutable result of one poll of a query.
+
+    Attributes:
+        query (FlightQuery): Query the snapshot answers.
+        table (FlightTable): Flights.
+        version (int): Poll counter, increases with every new snapshot.
+        timestamp (float): Time of the poll (seconds since the epoch).
+    """
+    query: FlightQuery
+    table: FlightTable = field(default_factory=FlightTable.empty)
+    version: int = 0
+    timestamp: float = 0.0
+
+
+class FlightPoller:
+    """
+    Poll FlightRadar24 in a background thread and publish snapshots.
+
+    Queries are registered implicitly by `get`. A query that has not been
+    read for `idle_timeout` seconds is no longer polled.
+    """
+
+    def __init__(
+        self,
+        client: FlightRadar24API,
+        interval: float = 2.0,
+        idle_timeout: float = 60.0,
+        history: Optional[HistoryStore] = None,
+        recorded_query: Optional[FlightQuery] = None,
+        executor: Executor = FETCH_EXECUTOR,
+        max_concurrent_polls: Optional[int] = None,
+    ):
+        """
+        Constructor.
+
+        Args:
+            client (FlightRadar24API): FlightRadar24API client.
+            interval (float): Polling period (in seconds).
+            idle_timeout (float): Delay after which a query that is not
+                read anymore stops being polled (in seconds).
+            history (HistoryStore): Store in which the snapshots of
+                `recorded_query` are appended.
+            recorded_query (FlightQuery): Query polled permanently and
+                recorded, if `history` is given.
+            executor (Executor): Pool running the polls.
+            max_concurrent_polls (int): Number of polls running at the
+                same time, half of the pool by default: the requests of
+                the tiles of a poll run on the same pool, and need free
+                workers.
+        """
+        self.client = client
+        # Dense areas are fetched as several tiles
+        self.tiler = TiledFetcher(client, executor=executor)
+        self.executor = executor
+        if max_concurrent_polls is None:
+            max_concurrent_polls = max(getattr(executor, "_max_workers", 2) // 2, 1)
+        self.max_concurrent_polls = max_concurrent_polls
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self._snapshots: Dict[FlightQuery, Snapshot] = {}
+        self._last_read: Dict[FlightQuery, float] = {}
+        self._polled_at: Dict[FlightQuery, float] = {}
+        # Polls in progress
+        self._polls: Dict[FlightQuery, Future] = {}
+        self._version = 0
+        self._lock = threading.Lock()
+        self._published = threading.Condition(self._lock)
+        self._wake_up = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.history = history
+        self.recorded_query = recorded_query if history is not None else None
+        if self.recorded_query is not None:
+            self._last_read[self.recorded_query] = time.monotonic()
+
+    def start(self) -> "FlightPoller":
+        """
+        Start the polling thread (idempotent and thread-safe). Snapshots
+        are only recorded if no other process writes to the history.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return self
+            if self.recorded_query is not None and not self.history.open_for_writing():
+                logger.warning(
+                    "%s is written by another process, snapshots are not recorded",
+                    self.history.root,
+                )
+                self._last_read.pop(self.recorded_query, None)
+                self.recorded_query = None
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="flight-poller", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop the polling thread.
+        """
+        self._stop.set()
+        self._wake_up.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            polls = list(self._polls.values())
+        wait(polls)
+        if self.history is not None:
+            self.history.close()
+
+    def get(
+        self,
+        zone_str: Optional[str] = None,
+        airline_icao: Optional[str] = None,
+        bounds: Optional[str] = None,
+        timeout: float = 10.0,
+    ) -> Snapshot:
+        """
+        Get the latest snapshot for a query.
+
+        The first read of a query waits (at most `timeout` seconds) for
+        its first poll, subsequent reads return immediately.
+
+        Args:
+            zone_str (str): Zone string.
+            airline_icao (str): ICAO code of the airline.
+            bounds (str): Bounds "y1,y2,x1,x2", overriding the zone.
+            timeout (float): Maximum waiting time for a new query.
+
+        Returns:
+            Snapshot: Latest snapshot, empty if none is available yet.
+        """
+        query = FlightQuery(
+            zone_str=zone_str, airline_icao=airline_icao, bounds=bounds
+        )
+        with self._lock:
+            is_new = query not in self._last_read
+            self._last_read[query] = time.monotonic()
+            if is_new:
+                self._wake_up.set()
+                self._published.wait_for(
+                    lambda: query in self._snapshots, timeout=timeout
+                )
+            return self._snapshots.get(query, Snapshot(query=query))
+
+    def _active_queries(self) -> Tuple[FlightQuery, ...]:
+        """
+        Forget idle queries and return the remaining ones.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for query, last_read in list(self._last_read.items()):
+                # The recorded query is never considered idle
+                if query != self.recorded_query and now - last_read > self.idle_timeout:
+                    del self._last_read[query]
+                    self._snapshots.pop(query, None)
+                    self._polled_at.pop(query, None)
+            return tuple(self._last_read)
+
+    def _poll(self, query: FlightQuery) -> None:
+        """
+        Fetch a query and publish the resulting snapshot.
+        """
+        try:
+            table = fetch_flight_table(
+                client=self.client,
+                airline_icao=query.airline_icao,
+                zone_str=query.zone_str,
+                bounds=query.bounds,
+                tiler=self.tiler,
+            )
+        except Exception:
+            # Keep serving the previous snapshot
+            logger.exception("Failed to fetch flights for %s", query)
+            return
+        timestamp = time.time()
+        with self._lock:
+            if query not in self._last_read:
+                # Forgotten while it was polled
+                return
+            self._version += 1
+            self._snapshots[query] = Snapshot(
+                query=query,
+                table=table,
+                version=self._version,
+                timestamp=timestamp,
+            )
+            self._published.notify_all()
+        if query == self.recorded_query:
+            try:
+                self.history.append(table, timestamp)
+            except Exception:
+                logger.exception("Failed to record the snapshot of %s", query)
+
+    def _poll_done(self, query: FlightQuery) -> None:
+        with self._lock:
+            self._polls.pop(query, None)
+        # A query may be waiting for a free poll
+        self._wake_up.set()
+
+    def _run(self) -> None:
+        """
+        Polling loop: start the polls of the due queries, least recently
+        polled (and new) ones first, up to `max_concurrent_polls`.
+        """
+        while not self._stop.is_set():
+            self._wake_up.clear()
+            now = time.monotonic()
+            next_poll = now + self.interval
+            queries = sorted(self._active_queries(), key=lambda query: self._polled_at.get(query, 0.0))
+            for query in queries:
+                with self._lock:
+                    if query in self._polls:
+                        continue
+                    due = self._polled_at.get(query, 0.0) + self.interval
+                    if due <= now:
+                        if len(self._polls) >= self.max_concurrent_polls:
+                            # Started when a running poll is over
+                            continue
+                        self._polled_at[query] = now
+                        self._polls[query] = future = self.executor.submit(self._poll, query)
+                        due = now + self.interval
+                    else:
+                        future = None
+                if future is not None:
+                    future.add_done_callback(lambda _, query=query: self._poll_done(query))
+                next_poll = min(next_poll, due)
+            # Sleep until the next query is due, unless a new one shows up
+            # or a poll is over
+            self._wake_up.wait(max(0.0, next_poll - time.monotonic()))
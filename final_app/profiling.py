@@ -0,0 +1,232 @@
+"""
+On-demand profiling of the dashboard callback.
+
+When enabled, one call in `every` of a profiled function is sampled: a
+background thread reads the stack of the calling thread about every
+millisecond (in practice at the GIL switch interval) and counts the
+functions found on it. Profiles are kept in memory with the duration of
+the call and metadata attached by the function (flight count, zone,
+airline), and optionally written as JSON files, shared by the processes
+of a server. A page lists the slowest recent calls with their hottest
+functions.
+
+Profiling is off by default: a disabled profiler only costs the
+comparison of a counter to zero per call.
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from collections import Counter, deque
+import functools
+import html
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+
+# Time between two stack samples (in seconds)
+SAMPLE_INTERVAL = 0.001
+# Number of hottest functions kept per profile
+TOP_FUNCTIONS = 10
+
+
+def _function_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Sampler(threading.Thread):
+    """
+    Thread sampling the stack of another thread until stopped.
+    """
+
+    def __init__(self, thread_id: int, root_code, interval: float = SAMPLE_INTERVAL):
+        """
+        Constructor.
+
+        Args:
+            thread_id (int): Identifier of the sampled thread.
+            root_code: Code object of the outermost frame sampled, frames
+                calling it are ignored.
+            interval (float): Time between two samples (in seconds).
+        """
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.root_code = root_code
+        self.interval = interval
+        # Stacks of code objects, innermost first -> number of samples
+        self.stacks: Counter = Counter()
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and frame.f_code is not self.root_code:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(stack)] += 1
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+    def hottest(self, n: int = TOP_FUNCTIONS) -> List[Dict[str, Any]]:
+        """
+        Functions with the most samples.
+
+        Returns:
+            List[Dict]: Function name, share of the samples where it was
+                running (`self`) and where it was on the stack
+                (`cumulative`), by decreasing self share.
+        """
+        total = sum(self.stacks.values())
+        if not total:
+            return []
+        own: Counter = Counter()
+        cumulative: Counter = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[0]] += count
+            for code in set(stack):
+                cumulative[code] += count
+        return [
+            {
+                "function": _function_name(code),
+                "self": count / total,
+                "cumulative": cumulative[code] / total,
+            } for code, count in own.most_common(n)
+        ]
+
+
+class Profiler:
+    """
+    Profile one call in `every` of decorated functions.
+    """
+
+    def __init__(self, every: int = 0, max_profiles: int = 200, directory: Optional[str] = None):
+        """
+        Constructor.
+
+        Args:
+            every (int): Sampling ratio, 0 disables profiling.
+            max_profiles (int): Number of recent profiles kept in memory.
+            directory (str): If given, profiles are also written there as
+                JSON files.
+        """
+        self.every = every
+        self.directory = directory
+        self.profiles: deque = deque(maxlen=max_profiles)
+        self._calls = 0
+        self._local = threading.local()
+
+    def profile(self, function: Callable) -> Callable:
+        """
+        Decorator profiling one call in `every`.
+        """
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not self.every:
+                return function(*args, **kwargs)
+            self._calls += 1
+            if self._calls % self.every:
+                return function(*args, **kwargs)
+            return self._run(function, args, kwargs)
+        return wrapper
+
+    def annotate(self, **metadata: Any) -> None:
+        """
+        Attach metadata to the profile of the current call, if sampled.
+        """
+        current = getattr(self._local, "metadata", None)
+        if current is not None:
+            current.update(metadata)
+
+    def _run(self, function: Callable, args: Tuple, kwargs: Dict) -> Any:
+        sampler = Sampler(threading.get_ident(), Profiler._run.__code__)
+        self._local.metadata = metadata = {}
+        start_time = time.time()
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            sampler.stop()
+            self._local.metadata = None
+            self._save({
+                "id": uuid.uuid4().hex[:12],
+                "function": function.__name__,
+                "time": start_time,
+                "duration": duration,
+                "metadata": metadata,
+                "samples": sum(sampler.stacks.values()),
+                "hottest": sampler.hottest(),
+            })
+
+    def _save(self, profile: Dict[str, Any]) -> None:
+        self.profiles.append(profile)
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{int(profile['time'])}-{profile['id']}.json")
+            with open(path, "w") as f:
+                json.dump(profile, f, default=str)
+
+    def slowest(self, n: int = 20) -> List[Dict[str, Any]]:
+        """
+        Slowest recent profiles, slowest first. With a directory, they are
+        read from it, so that the profiles of every process writing there
+        are listed.
+        """
+        profiles = list(self.profiles) if self.directory is None else self._read_recent()
+        return sorted(profiles, key=lambda profile: -profile["duration"])[:n]
+
+    def _read_recent(self) -> List[Dict[str, Any]]:
+        if not os.path.isdir(self.directory):
+            return []
+        # File names start with the time of the call
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(".json"))
+        profiles = []
+        for name in names[-self.profiles.maxlen:]:
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                # Removed, or still being written
+                continue
+        return profiles
+
+
+def render_profiles(profiles: List[Dict[str, Any]], every: int) -> str:
+    """
+    HTML page listing profiles and their hottest functions.
+
+    Args:
+        profiles (List[Dict]): Profiles.
+        every (int): Current sampling ratio.
+
+    Returns:
+        str: HTML page.
+    """
+    status = f"1 appel sur {every}" if every else "désactivé"
+    rows = []
+    for profile in profiles:
+        moment = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(profile["time"]))
+        metadata = ", ".join(f"{key}={value}" for key, value in profile["metadata"].items())
+        hottest = "\n".join(
+            f"{function['self']:5.1%} / {function['cumulative']:5.1%} {html.escape(function['function'])}"
+            for function in profile["hottest"]
+        )
+        rows.append(
+            f"<tr><td>{moment}</td><td>{1000 * profile['duration']:.1f}</td>"
+            f"<td>{html.escape(metadata)}</td><td>{profile['samples']}</td>"
+            f"<td><pre>{hottest}</pre></td></tr>"
+        )
+    return (
+        "<html><head><meta charset='utf-8'><title>Profils</title></head><body>"
+        f"<h1>Appels les plus lents</h1><p>Profilage : {status}</p>"
+        "<table border='1' cellpadding='4'><tr><th>Date (UTC)</th><th>Durée (ms)</th>"
+        "<th>Contexte</th><th>Échantillons</th><th>Fonctions (propre / cumulé)</th></tr>"
+        + "".join(rows)
+        + "</table></body></html>"
+    )
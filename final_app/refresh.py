@@ -0,0 +1,155 @@
+"""
+Adaptive refresh interval.
+
+Every session picks its own refresh period from three signals:
+    - the change rate of its view: how many pixels the flights displayed
+      actually moved per second between two snapshots, so that zoomed
+      out views, where flights barely move on screen, refresh rarely and
+      close-up views refresh often;
+    - the latency of the dashboard callback, so that it never takes more
+      than a small share of the period;
+    - the number of callbacks being served concurrently, the queue depth
+      of the server, so that every session backs off under load.
+"""
+from typing import Callable, Optional
+import functools
+import math
+import threading
+import time
+import numpy as np
+from clustering import TILE_SIZE
+from snapshot import FlightTable
+
+
+# Bounds of the refresh period (in ms), the lower bound is the polling
+# period of FlightRadar24
+MIN_INTERVAL = 2 * 1000
+MAX_INTERVAL = 30 * 1000
+# Period before anything is known about a view, and in playback (in ms)
+DEFAULT_INTERVAL = 10 * 1000
+PLAYBACK_INTERVAL = 2 * 1000
+# Distance the flights of a view should move between two refreshes
+# (in pixels)
+TARGET_PIXELS = 20
+# The callback should take at most 1 / LATENCY_FACTOR of the period
+LATENCY_FACTOR = 20
+# Concurrent callbacks the server handles without slowing down
+CONCURRENCY = 4
+# Share of the gap to a shorter period closed at every refresh
+# (longer periods are applied at once)
+TIGHTEN_RATE = 0.5
+# Periods are rounded to this step (in ms)
+INTERVAL_STEP = 500
+# Percentile of the flight displacements taken as the change rate
+SPEED_PERCENTILE = 90
+
+
+class LoadMonitor:
+    """
+    Thread-safe measure of the load of a callback: number of calls in
+    progress and moving average of their latency.
+    """
+
+    def __init__(self, smoothing: float = 0.1):
+        """
+        Constructor.
+
+        Args:
+            smoothing (float): Weight of the last call in the moving
+                average of the latency.
+        """
+        self.smoothing = smoothing
+        self.in_flight = 0
+        self.latency = 0.0
+        self._lock = threading.Lock()
+
+    def measure(self, function: Callable) -> Callable:
+        """
+        Decorator counting and timing the calls of a function.
+        """
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with self._lock:
+                self.in_flight += 1
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.in_flight -= 1
+                    self.latency += self.smoothing * (elapsed - self.latency)
+        return wrapper
+
+
+def get_pixel_speed(
+    table: FlightTable,
+    previous_table: FlightTable,
+    elapsed: float,
+    zoom: float,
+) -> Optional[float]:
+    """
+    Speed at which the flights of a view move on screen.
+
+    Args:
+        table (FlightTable): Flights.
+        previous_table (FlightTable): Flights of the previous snapshot.
+        elapsed (float): Time between the two snapshots (in seconds).
+        zoom (float): Zoom level of the map.
+
+    Returns:
+        float: SPEED_PERCENTILE percentile of the flight speeds (in
+            pixels per second), None if it cannot be measured.
+    """
+    if elapsed <= 0 or zoom is None:
+        return None
+    previous_rows = previous_table.rows(table.id.tolist())
+    matched = previous_rows >= 0
+    if not matched.any():
+        return None
+    latitude = table.latitude[matched]
+    longitude = table.longitude[matched]
+    previous_latitude = previous_table.latitude[previous_rows[matched]]
+    previous_longitude = previous_table.longitude[previous_rows[matched]]
+    # Web Mercator stretches distances by 1 / cos(latitude)
+    cos_latitude = np.maximum(np.cos(np.radians(latitude)), 0.01)
+    degrees = np.hypot(
+        (longitude - previous_longitude + 180) % 360 - 180,
+        (latitude - previous_latitude) / cos_latitude,
+    )
+    pixels_per_degree = TILE_SIZE * 2 ** zoom / 360
+    return float(np.percentile(degrees, SPEED_PERCENTILE)) * pixels_per_degree / elapsed
+
+
+def get_refresh_interval(
+    current: int,
+    pixel_speed: Optional[float],
+    latency: float,
+    in_flight: int,
+) -> int:
+    """
+    Next refresh period of a session.
+
+    Args:
+        current (int): Current period (in ms).
+        pixel_speed (float): Speed of the flights on screen (in pixels
+            per second), None if unknown.
+        latency (float): Average latency of the callback (in seconds).
+        in_flight (int): Callbacks in progress, this one included.
+
+    Returns:
+        int: Period (in ms).
+    """
+    if pixel_speed is None:
+        target = float(current)
+    elif pixel_speed > 0:
+        target = 1000 * TARGET_PIXELS / pixel_speed
+    else:
+        target = float(MAX_INTERVAL)
+    target = max(target, 1000 * LATENCY_FACTOR * latency)
+    target *= 1 + max(in_flight - 1, 0) / CONCURRENCY
+    target = min(max(target, MIN_INTERVAL), MAX_INTERVAL)
+    # Back off at once, tighten progressively
+    if target < current:
+        target = current + TIGHTEN_RATE * (target - current)
+    return int(math.floor(target / INTERVAL_STEP) * INTERVAL_STEP)
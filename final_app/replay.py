@@ -0,0 +1,343 @@
+"""
+Record and replay FlightRadar24 responses.
+
+A RecordingClient wraps a FlightRadar24API client and appends every
+response of the recorded methods to a gzipped JSON lines file. A
+ReplayClient exposes the same interface as FlightRadar24API and serves
+those recordings, at real or accelerated speed, or under manual control
+for deterministic benchmarks, without any network access.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import bisect
+import glob
+import gzip
+import json
+import os
+import threading
+import time
+from FlightRadar24 import Flight, FlightRadar24API, FlightTrackerConfig
+
+
+RECORDED_METHODS = ("get_zones", "get_airlines", "get_flights", "get_flight_details")
+# Number of fields of the raw flight lists of the upstream API
+FLIGHT_INFO_SIZE = 19
+# Recorded get_flights responses older than this are not replayed
+# (in seconds of recording time)
+MAX_FRAME_AGE = 60.0
+
+
+def flight_to_info(flight: Flight) -> List[Any]:
+    """
+    Rebuild the raw list FlightRadar24 sends for a flight, which the
+    Flight constructor takes as input.
+
+    Args:
+        flight (Flight): Flight.
+
+    Returns:
+        List: Raw flight information.
+    """
+    info: List[Any] = [None] * FLIGHT_INFO_SIZE
+    info[0] = flight.icao_24bit
+    info[1] = flight.latitude
+    info[2] = flight.longitude
+    info[3] = flight.heading
+    info[4] = flight.altitude
+    info[5] = flight.ground_speed
+    info[6] = flight.squawk
+    info[8] = flight.aircraft_code
+    info[9] = flight.registration
+    info[10] = flight.time
+    info[11] = flight.origin_airport_iata
+    info[12] = flight.destination_airport_iata
+    info[13] = flight.number
+    info[14] = flight.on_ground
+    info[15] = flight.vertical_speed
+    info[16] = flight.callsign
+    info[18] = flight.airline_icao
+    return info
+
+
+class RecordingClient:
+    """
+    FlightRadar24API wrapper recording the responses of the methods
+    listed in RECORDED_METHODS. Other attributes are delegated to the
+    wrapped client.
+    """
+
+    def __init__(self, client: FlightRadar24API, directory: str):
+        """
+        Constructor.
+
+        Args:
+            client (FlightRadar24API): Client to record.
+            directory (str): Directory of the recordings, a new
+                timestamped file is created in it.
+        """
+        self.client = client
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(
+            directory, time.strftime("fr24-%Y%m%dT%H%M%S.jsonl.gz")
+        )
+        self._file = gzip.open(self.path, "at", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
+
+    def close(self) -> None:
+        """
+        Close the recording file.
+        """
+        with self._lock:
+            self._file.close()
+
+    def _record(self, method: str, args: Dict, response: Any) -> None:
+        line = json.dumps({"t": time.time(), "method": method, "args": args, "response": response})
+        with self._lock:
+            self._file.write(line + "\n")
+            # Keep the file readable if the process is killed
+            self._file.flush()
+
+    def get_zones(self) -> Dict[str, Dict]:
+        zones = self.client.get_zones()
+        self._record("get_zones", {}, zones)
+        return zones
+
+    def get_airlines(self) -> List[Dict]:
+        airlines = self.client.get_airlines()
+        self._record("get_airlines", {}, airlines)
+        return airlines
+
+    def get_flights(
+        self,
+        airline: Optional[str] = None,
+        bounds: Optional[str] = None,
+        registration: Optional[str] = None,
+        aircraft_type: Optional[str] = None,
+        *,
+        details: bool = False
+    ) -> List[Flight]:
+        flights = self.client.get_flights(
+            airline=airline,
+            bounds=bounds,
+            registration=registration,
+            aircraft_type=aircraft_type,
+            details=details,
+        )
+        self._record(
+            "get_flights",
+            {"airline": airline, "bounds": bounds, "registration": registration,
+             "aircraft_type": aircraft_type},
+            {flight.id: flight_to_info(flight) for flight in flights},
+        )
+        return flights
+
+    def get_flight_details(self, flight: Flight) -> Dict[Any, Any]:
+        details = self.client.get_flight_details(flight)
+        self._record("get_flight_details", {"flight_id": flight.id}, details)
+        return details
+
+
+def load_recordings(path: str) -> List[Dict]:
+    """
+    Load recorded calls, sorted by time.
+
+    Args:
+        path (str): Recording file, or directory of recording files.
+
+    Returns:
+        List[Dict]: Recorded calls.
+    """
+    paths = sorted(glob.glob(os.path.join(path, "*.jsonl.gz"))) if os.path.isdir(path) else [path]
+    calls = []
+    for file_path in paths:
+        with gzip.open(file_path, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    calls.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Truncated last line of an interrupted recording
+                    break
+    calls.sort(key=lambda call: call["t"])
+    return calls
+
+
+def _in_bounds(info: List[Any], bounds: Optional[str]) -> bool:
+    if bounds is None:
+        return True
+    north, south, west, east = (float(value) for value in bounds.split(","))
+    return south <= info[1] <= north and west <= info[2] <= east
+
+
+class ReplayClient:
+    """
+    Drop-in replacement of FlightRadar24API serving recorded responses.
+
+    The replay clock starts at the first recorded get_flights call. With a `speed`,
+    it follows the wall clock multiplied by the speed; with `speed=None`
+    it only moves through `advance` and `seek`, which makes replays
+    deterministic.
+
+    get_flights answers any query: the latest recorded response of every
+    recorded query is merged, then filtered by bounds, airline and
+    aircraft type.
+    """
+
+    def __init__(self, path: str, speed: Optional[float] = 1.0, loop: bool = True):
+        """
+        Constructor.
+
+        Args:
+            path (str): Recording file, or directory of recording files.
+            speed (float): Replay speed, None for a manual clock.
+            loop (bool): Whether to restart at the end of the recording.
+        """
+        calls = load_recordings(path)
+        if not calls:
+            raise ValueError(f"No recording found in {path}")
+        self.speed = speed
+        self.loop = loop
+        # Start at the first traffic frame rather than at the reference
+        # calls (zones, airlines) preceding it
+        frame_times = [call["t"] for call in calls if call["method"] == "get_flights"]
+        self.start_time = frame_times[0] if frame_times else calls[0]["t"]
+        self.end_time = calls[-1]["t"]
+        self._offset = 0.0
+        self._started_at = time.monotonic()
+        self._latest: Dict[str, Any] = {}
+        # Recorded get_flights responses, per query, as sorted (times, frames)
+        self._frames: Dict[Tuple, Tuple[List[float], List[Dict]]] = {}
+        self._details: Dict[str, Tuple[List[float], List[Dict]]] = {}
+        for call in calls:
+            if call["method"] == "get_flights":
+                key = tuple(sorted(call["args"].items()))
+                times, frames = self._frames.setdefault(key, ([], []))
+                times.append(call["t"])
+                frames.append(call["response"])
+            elif call["method"] == "get_flight_details":
+                times, details = self._details.setdefault(call["args"]["flight_id"], ([], []))
+                times.append(call["t"])
+                details.append(call["response"])
+            else:
+                self._latest[call["method"]] = call["response"]
+        self._flight_tracker_config = FlightTrackerConfig()
+
+    @property
+    def duration(self) -> float:
+        """
+        Duration of the recording (in seconds).
+        """
+        return self.end_time - self.start_time
+
+    def now(self) -> float:
+        """
+        Current replay time (recording timestamp).
+        """
+        elapsed = self._offset
+        if self.speed is not None:
+            elapsed += (time.monotonic() - self._started_at) * self.speed
+        if self.loop and self.duration > 0:
+            elapsed %= self.duration
+        return self.start_time + min(elapsed, self.duration)
+
+    def advance(self, seconds: float) -> None:
+        """
+        Move the replay clock forward.
+        """
+        self._offset += seconds
+
+    def seek(self, timestamp: float) -> None:
+        """
+        Move the replay clock to a recording timestamp.
+        """
+        self._offset = timestamp - self.start_time
+        self._started_at = time.monotonic()
+
+    def get_zones(self) -> Dict[str, Dict]:
+        return self._latest.get("get_zones", {})
+
+    def get_airlines(self) -> List[Dict]:
+        return self._latest.get("get_airlines", [])
+
+    def get_bounds(self, zone: Dict[str, float]) -> str:
+        return FlightRadar24API.get_bounds(self, zone)
+
+    def get_flight_tracker_config(self) -> FlightTrackerConfig:
+        return FlightTrackerConfig(**vars(self._flight_tracker_config))
+
+    def set_flight_tracker_config(self, flight_tracker_config=None, **config) -> None:
+        if flight_tracker_config is not None:
+            self._flight_tracker_config = flight_tracker_config
+        for key, value in config.items():
+            setattr(self._flight_tracker_config, key, str(value))
+
+    def get_flights(
+        self,
+        airline: Optional[str] = None,
+        bounds: Optional[str] = None,
+        registration: Optional[str] = None,
+        aircraft_type: Optional[str] = None,
+        *,
+        details: bool = False
+    ) -> List[Flight]:
+        now = self.now()
+        merged: Dict[str, List[Any]] = {}
+        for times, frames in self._frames.values():
+            position = bisect.bisect_right(times, now) - 1
+            if position < 0 or now - times[position] > MAX_FRAME_AGE:
+                continue
+            merged.update(frames[position])
+        flights = []
+        for flight_id, info in merged.items():
+            if not _in_bounds(info, bounds):
+                continue
+            if airline and info[18] != airline:
+                continue
+            if aircraft_type and info[8] != aircraft_type:
+                continue
+            if registration and info[9] != registration:
+                continue
+            flight = Flight(flight_id, info)
+            if details:
+                flight.set_flight_details(self.get_flight_details(flight))
+            flights.append(flight)
+        return flights
+
+    def get_flight_details(self, flight: Flight) -> Dict[Any, Any]:
+        times, details = self._details.get(flight.id, ([], []))
+        position = bisect.bisect_right(times, self.now()) - 1
+        return details[max(position, 0)] if details else {}
+
+
+def main() -> None:
+    """
+    Record live traffic, e.g.:
+        python final_app/replay.py recordings --zone europe --duration 600
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Record FlightRadar24 responses.")
+    parser.add_argument("directory", help="Directory of the recordings.")
+    parser.add_argument("--zone", default="europe", help="Zone to record.")
+    parser.add_argument("--airline", default=None, help="ICAO code of an airline.")
+    parser.add_argument("--interval", type=float, default=2.0, help="Polling period (s).")
+    parser.add_argument("--duration", type=float, default=600.0, help="Duration (s).")
+    args = parser.parse_args()
+
+    recorder = RecordingClient(FlightRadar24API(), args.directory)
+    try:
+        zones = recorder.get_zones()
+        recorder.get_airlines()
+        end = time.monotonic() + args.duration
+        while time.monotonic() < end:
+            start = time.monotonic()
+            recorder.get_flights(airline=args.airline, bounds=recorder.get_bounds(zones[args.zone]))
+            time.sleep(max(0.0, args.interval - (time.monotonic() - start)))
+    finally:
+        recorder.close()
+    print(f"Recorded {recorder.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Server-side session state.
+
+Each browser session only holds a small token; the previous snapshot
+it needs to compute rotation angles and marker diffs is kept here, in a
+bounded LRU cache.
+"""
+from typing import Any, Callable, Hashable, NamedTuple, Optional, Sequence, Tuple
+from collections import OrderedDict
+import threading
+import time
+import uuid
+import numpy as np
+from markers import Markers
+from motion import Tracks
+from snapshot import FlightTable
+
+
+class SessionState(NamedTuple):
+    """
+    State of a dashboard session.
+
+    Attributes:
+        version (str): Version of the markers sent to the client.
+        flights (FlightTable): Previous snapshot.
+        angles (np.ndarray): Rotation angles of the previous flights.
+        clusters (Markers): Clusters displayed.
+        index (np.ndarray): Rows of the markers displayed, in the order
+            of the client, among the flights of `flights` followed by
+            `clusters`.
+        trails (Sequence[Tuple[str, Hashable]]): Flight id and content key
+            of the trails displayed, in the order of the client.
+        timestamp (float): Time of the snapshot of `flights`.
+        interval (int): Refresh period of the client (in ms).
+        mode (str): Live or playback mode of the snapshot.
+        tracks (Tracks): Tracks of the markers known by the client, in
+            the order of the client.
+    """
+    version: str
+    flights: FlightTable
+    angles: np.ndarray
+    clusters: Markers
+    index: np.ndarray
+    trails: Sequence[Tuple[str, Hashable]] = ()
+    timestamp: float = 0.0
+    interval: int = 0
+    mode: str = ""
+    tracks: Optional[Tracks] = None
+
+    def markers(self, icons: np.ndarray) -> Markers:
+        """
+        Markers displayed, in the order of the client.
+
+        Args:
+            icons (np.ndarray): Icon of each flight of `flights`.
+        """
+        flights = Markers.from_table(self.flights, icons)
+        if not len(self.clusters.id):
+            return flights.take(self.index)
+        return Markers.concat([flights, self.clusters]).take(self.index)
+
+
+# Largest move of the frame time between two ticks of a session, in
+# refresh periods (at the playback speed), beyond which the previous
+# snapshot is not used anymore
+MAX_FRAME_GAP = 3
+
+
+def follows(state: SessionState, mode: str, timestamp: float, speed: float = 1) -> bool:
+    """
+    Whether a snapshot directly follows the one of a session state, so
+    that rotation angles, marker diffs and speeds can be computed from it.
+    It does not after a mode switch, a seek in playback or a long pause.
+
+    Args:
+        state (SessionState): Session state.
+        mode (str): Mode of the snapshot.
+        timestamp (float): Time of the snapshot.
+        speed (float): Playback speed, 1 in live mode.
+
+    Returns:
+        bool: True if the snapshot follows the state.
+    """
+    elapsed = timestamp - state.timestamp
+    max_gap = MAX_FRAME_GAP * speed * state.interval / 1000
+    return state.mode == mode and 0 <= elapsed <= max_gap
+
+
+def new_session_token() -> str:
+    """
+    Generate a random session token.
+    """
+    return uuid.uuid4().hex
+
+
+def new_version() -> str:
+    """
+    Generate a version of the markers of a session, unique across calls,
+    threads and processes.
+    """
+    return uuid.uuid4().hex
+
+
+class SessionStore:
+    """
+    Thread-safe LRU store of per-session state.
+
+    Sessions are evicted, least recently used first, when there are
+    more than `max_sessions` of them or when their total estimated size
+    exceeds `max_bytes`. Sessions idle for more than `idle_timeout`
+    seconds are evicted as well.
+    """
+
+    def __init__(
+        self,
+        sizeof: Callable[[Any], int],
+        max_sessions: int = 1000,
+        max_bytes: int = 256 * 1024 ** 2,
+        idle_timeout: float = 600.0,
+    ):
+        """
+        Constructor.
+
+        Args:
+            sizeof (Callable): Function estimating the size of a state
+                (in bytes).
+            max_sessions (int): Maximum number of sessions.
+            max_bytes (int): Maximum total size of the states.
+            idle_timeout (float): Idle time after which a session is
+                evicted (in seconds).
+        """
+        self.sizeof = sizeof
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_timeout = idle_timeout
+        # token -> (last access time, size, state), oldest first
+        self._sessions: OrderedDict = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    @property
+    def total_bytes(self) -> int:
+        """
+        Total estimated size of the stored states.
+        """
+        return self._total_bytes
+
+    def get(self, token: Optional[str]) -> Optional[Any]:
+        """
+        Get the state of a session.
+
+        Args:
+            token (str): Session token.
+
+        Returns:
+            Any: State, None if unknown or evicted.
+        """
+        with self._lock:
+            self._evict_idle()
+            entry = self._sessions.get(token)
+            if entry is None:
+                return None
+            self._sessions[token] = (time.monotonic(), entry[1], entry[2])
+            self._sessions.move_to_end(token)
+            return entry[2]
+
+    def set(self, token: str, state: Any) -> None:
+        """
+        Set the state of a session.
+
+        Args:
+            token (str): Session token.
+            state (Any): State.
+        """
+        size = self.sizeof(state)
+        with self._lock:
+            previous = self._sessions.pop(token, None)
+            if previous is not None:
+                self._total_bytes -= previous[1]
+            self._sessions[token] = (time.monotonic(), size, state)
+            self._total_bytes += size
+            self._evict_idle()
+            while self._sessions and (
+                len(self._sessions) > self.max_sessions
+                or self._total_bytes > self.max_bytes
+            ):
+                self._pop_oldest()
+
+    def _pop_oldest(self) -> None:
+        _, (_, size, _) = self._sessions.popitem(last=False)
+        self._total_bytes -= size
+
+    def _evict_idle(self) -> None:
+        deadline = time.monotonic() - self.idle_timeout
+        while self._sessions:
+            last_access = next(iter(self._sessions.values()))[0]
+            if last_access >= deadline:
+                break
+            self._pop_oldest()
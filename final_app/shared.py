@@ -0,0 +1,528 @@
+"""
+Snapshots shared between worker processes.
+
+In the multi-worker mode (see gunicorn.conf.py), a single snapshot
+process owns the FlightPoller: upstream fetches do not depend on the
+number of workers. Workers ask it for the latest snapshot of a query
+through a local socket, and it answers with the name of a file of a
+shared memory directory (a tmpfs, /dev/shm by default) holding the
+snapshot columns. Workers memory-map that file read-only and build a
+FlightTable whose columns are views on the mapping, so the flights are
+neither copied nor deserialized, and stored once whatever the number of
+workers.
+
+The snapshot process also keeps the state of the dashboard sessions and
+the trails of the flights, so that any worker can serve the next call of
+a session: with per-worker state, calls of a session alternating between
+workers would miss the previous snapshot and rebuild every marker.
+Session states are pickled by the workers and stored as is, with their
+snapshot pickled as the name of its file: the worker serving the next
+call maps it again.
+
+Every version of a snapshot is written once, when first requested, to
+a new file that never changes. Files of superseded versions are
+removed after a grace period, mappings already opened by workers stay
+valid until they are released.
+
+File layout: an 8-byte header length, a JSON header describing the
+columns (name, dtype, offset, count and categories of categorical
+columns), then the raw values of the columns, each aligned on 8 bytes.
+"""
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+from collections import OrderedDict, deque
+from multiprocessing.connection import Client, Connection, Listener
+import importlib
+import io
+import itertools
+import json
+import logging
+import mmap
+import os
+import pickle
+import signal
+import struct
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+from poller import FlightPoller, FlightQuery, Snapshot
+from refresh import MAX_INTERVAL
+from sessions import MAX_FRAME_GAP, SessionStore
+from snapshot import Categorical, FlightTable
+from trails import TrailBuffer
+
+
+logger = logging.getLogger(__name__)
+
+# Directory of the shared snapshot files
+SHM_DIR = os.environ.get(
+    "FLIGHT_SHM_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+)
+HEADER = struct.Struct("<Q")
+ALIGNMENT = 8
+# Time workers wait for the snapshot process to accept connections when
+# they start, and once connected, after losing it (in seconds): it is
+# then restarted by the gunicorn master, calls fail meanwhile
+CONNECT_TIMEOUT = 30.0
+RECONNECT_TIMEOUT = 2.0
+# Time during which the file of a superseded snapshot can still be
+# opened by workers (in seconds): session states refer to it until their
+# next call, after which they are not used anymore (see sessions.follows)
+GRACE_PERIOD = MAX_FRAME_GAP * MAX_INTERVAL / 1000
+
+
+def _aligned(size: int) -> int:
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def write_table(path: str, table: FlightTable) -> None:
+    """
+    Write the columns of a table to a file.
+
+    Args:
+        path (str): File path.
+        table (FlightTable): Flights.
+    """
+    columns = []
+    arrays = []
+    offset = 0
+    for name, column in table.columns.items():
+        entry = {"name": name}
+        if isinstance(column, Categorical):
+            entry["categories"] = list(column.categories)
+            column = column.codes
+        array = np.ascontiguousarray(column)
+        entry.update(dtype=array.dtype.str, offset=offset, count=len(array))
+        columns.append(entry)
+        arrays.append(array)
+        offset += _aligned(array.nbytes)
+    header = json.dumps({"columns": columns}).encode()
+    start = _aligned(HEADER.size + len(header))
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(len(header)) + header)
+        for entry, array in zip(columns, arrays):
+            f.seek(start + entry["offset"])
+            f.write(array.tobytes())
+        f.truncate(start + offset)
+
+
+def read_table(path: str) -> FlightTable:
+    """
+    Map a file written by `write_table`, without copying its columns.
+
+    Args:
+        path (str): File path.
+
+    Returns:
+        FlightTable: Flights, whose columns are read-only views on the
+            mapping of the file.
+    """
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    (length,) = HEADER.unpack_from(buffer)
+    header = json.loads(buffer[HEADER.size:HEADER.size + length])
+    start = _aligned(HEADER.size + length)
+    columns = {}
+    for entry in header["columns"]:
+        array = np.frombuffer(
+            buffer, dtype=np.dtype(entry["dtype"]), count=entry["count"],
+            offset=start + entry["offset"],
+        )
+        if "categories" in entry:
+            columns[entry["name"]] = Categorical(array, tuple(entry["categories"]))
+        else:
+            columns[entry["name"]] = array
+    return FlightTable(columns)
+
+
+class SnapshotServer:
+    """
+    Serve the snapshots of a poller to worker processes.
+    """
+
+    def __init__(self, poller: FlightPoller, address: str, authkey: bytes, directory: str = SHM_DIR):
+        """
+        Constructor.
+
+        Args:
+            poller (FlightPoller): Poller, started.
+            address (str): Path of the Unix socket.
+            authkey (bytes): Key workers authenticate with.
+            directory (str): Directory of the snapshot files.
+        """
+        self.poller = poller
+        self.address = address
+        self.authkey = authkey
+        self.directory = directory
+        # Pickled session states, sized by their length
+        self.sessions = SessionStore(sizeof=len)
+        self.trail_buffer = TrailBuffer()
+        self._methods: Dict[str, Callable[..., Any]] = {
+            "snapshot": self._snapshot,
+            "get_session": self.sessions.get,
+            "set_session": self.sessions.set,
+            "count_sessions": self.sessions.__len__,
+            "trails": self.trail_buffer.get_trails,
+        }
+        # Query -> (version, file name, last request time)
+        self._exports: Dict[FlightQuery, Tuple[int, str, float]] = {}
+        # (removal time, file name) of superseded files
+        self._retired: deque = deque()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def serve_forever(self) -> None:
+        """
+        Accept connections, each served by its own thread, until the
+        process is stopped.
+        """
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        with Listener(self.address, family="AF_UNIX", authkey=self.authkey) as listener:
+            while True:
+                try:
+                    connection = listener.accept()
+                except Exception:
+                    logger.exception("Failed to accept a worker connection")
+                    continue
+                threading.Thread(
+                    target=self._serve, args=(connection,), name="snapshot-connection", daemon=True
+                ).start()
+
+    def _serve(self, connection: Connection) -> None:
+        # Requests are (method name, arguments) tuples, see SharedPoller.call
+        with connection:
+            while True:
+                try:
+                    method, args = connection.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    result = self._methods[method](*args)
+                except Exception:
+                    # The worker gets an EOFError instead of waiting
+                    logger.exception("Failed to serve a %s request", method)
+                    return
+                connection.send(result)
+
+    def _snapshot(self, query: Tuple, timeout: float) -> Tuple[Optional[str], int, float]:
+        """
+        File name, version and time of the latest snapshot of a query.
+        Trails are updated with every snapshot served, as the
+        dashboard callback does in single-process mode.
+        """
+        snapshot = self.poller.get(*query, timeout=timeout)
+        if snapshot.version:
+            self.trail_buffer.update(
+                snapshot.table, snapshot.timestamp, key=(snapshot.query, snapshot.timestamp)
+            )
+        return self._export(snapshot), snapshot.version, snapshot.timestamp
+
+    def _export(self, snapshot: Snapshot) -> Optional[str]:
+        """
+        Name of the file of a snapshot, written on first request.
+        """
+        if not snapshot.version:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            export = self._exports.get(snapshot.query)
+            if export is not None and export[0] == snapshot.version:
+                self._exports[snapshot.query] = (export[0], export[1], now)
+                return export[1]
+        name = f"flights-{os.getpid()}-{next(self._counter)}"
+        write_table(os.path.join(self.directory, name), snapshot.table)
+        with self._lock:
+            previous = self._exports.get(snapshot.query)
+            if previous is not None and previous[0] > snapshot.version:
+                # A newer version was exported meanwhile
+                self._retired.append((now + GRACE_PERIOD, name))
+                return name
+            if previous is not None:
+                self._retired.append((now + GRACE_PERIOD, previous[1]))
+            self._exports[snapshot.query] = (snapshot.version, name, now)
+            self._collect(now)
+        return name
+
+    def _collect(self, now: float) -> None:
+        # Files of queries nobody reads anymore are retired as well
+        for query, (_, name, last_request) in list(self._exports.items()):
+            if now - last_request > self.poller.idle_timeout:
+                del self._exports[query]
+                self._retired.append((now + GRACE_PERIOD, name))
+        while self._retired and self._retired[0][0] <= now:
+            self._remove(self._retired.popleft()[1])
+
+    def _remove(self, name: str) -> None:
+        try:
+            os.unlink(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    def close(self) -> None:
+        """
+        Remove every snapshot file and the socket.
+        """
+        with self._lock:
+            names = [name for _, name, _ in self._exports.values()]
+            names.extend(name for _, name in self._retired)
+            self._exports.clear()
+            self._retired.clear()
+        for name in names:
+            self._remove(name)
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+
+
+def serve(poller: FlightPoller, address: str, authkey: bytes) -> None:
+    """
+    Entry point of the snapshot process: start the poller and serve its
+    snapshots until SIGTERM.
+    """
+    def terminate(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, terminate)
+    server = SnapshotServer(poller.start(), address, authkey)
+    try:
+        server.serve_forever()
+    finally:
+        poller.stop()
+        server.close()
+
+
+def main_cli() -> None:
+    """
+    Run the snapshot process: `python -m shared <module>:<function>`,
+    where the function builds the poller, with the socket and key given
+    by FLIGHT_SNAPSHOT_SOCKET and FLIGHT_SNAPSHOT_AUTHKEY.
+    """
+    logging.basicConfig(level=logging.INFO)
+    module, _, function = sys.argv[1].partition(":")
+    make_poller = getattr(importlib.import_module(module), function)
+    serve(
+        make_poller(),
+        os.environ["FLIGHT_SNAPSHOT_SOCKET"],
+        os.environ["FLIGHT_SNAPSHOT_AUTHKEY"].encode(),
+    )
+
+
+class SharedPoller:
+    """
+    Read the snapshots of a SnapshotServer, with the `get` interface of
+    FlightPoller.
+    """
+
+    def __init__(self, address: str, authkey: bytes, max_tables: int = 32):
+        """
+        Constructor.
+
+        Args:
+            address (str): Path of the Unix socket of the server.
+            authkey (bytes): Authentication key.
+            max_tables (int): Number of mapped snapshots kept, least
+                recently used ones are released first.
+        """
+        self.address = address
+        self.authkey = authkey
+        self.directory = SHM_DIR
+        self.max_tables = max_tables
+        # Connections are opened lazily, one per thread, after the fork
+        self._local = threading.local()
+        # Whether the snapshot process was ever reached
+        self._connected = False
+        self._tables: "OrderedDict[str, FlightTable]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _connection(self) -> Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            return connection
+        # Workers may start before the snapshot process listens
+        deadline = time.monotonic() + (RECONNECT_TIMEOUT if self._connected else CONNECT_TIMEOUT)
+        while True:
+            try:
+                connection = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+        self._connected = True
+        self._local.connection = connection
+        return connection
+
+    def call(self, method: str, *args: Any) -> Any:
+        """
+        Call a method of the SnapshotServer.
+
+        Args:
+            method (str): Method name, a key of SnapshotServer._methods.
+            *args: Arguments, picklable.
+
+        Returns:
+            Any: Result of the method.
+        """
+        # A connection opened before the snapshot process restarted is
+        # broken: it is replaced once
+        for retry in (True, False):
+            reused = getattr(self._local, "connection", None) is not None
+            connection = self._connection()
+            try:
+                connection.send((method, args))
+                return connection.recv()
+            except (EOFError, OSError):
+                self._local.connection = None
+                if not (retry and reused):
+                    raise
+
+    def get(
+        self,
+        zone_str: Optional[str] = None,
+        airline_icao: Optional[str] = None,
+        bounds: Optional[str] = None,
+        timeout: float = 10.0,
+    ) -> Snapshot:
+        """
+        Get the latest snapshot for a query, see FlightPoller.get.
+        """
+        query = FlightQuery(zone_str=zone_str, airline_icao=airline_icao, bounds=bounds)
+        name, version, timestamp = self.call("snapshot", tuple(query), timeout)
+        if name is None:
+            return Snapshot(query=query)
+        return Snapshot(query=query, table=self.table(name), version=version, timestamp=timestamp)
+
+    def table(self, name: str) -> FlightTable:
+        """
+        Map the file of a snapshot, or get it from the mapped ones.
+
+        Args:
+            name (str): File name, given by the server.
+
+        Returns:
+            FlightTable: Flights.
+
+        Raises:
+            FileNotFoundError: If the file was removed.
+        """
+        with self._lock:
+            table = self._tables.get(name)
+            if table is not None:
+                self._tables.move_to_end(name)
+                return table
+        table = read_table(os.path.join(self.directory, name))
+        with self._lock:
+            self._tables[name] = table
+            while len(self._tables) > self.max_tables:
+                # Unmapped once no snapshot refers to it anymore
+                self._tables.popitem(last=False)
+        return table
+
+    def table_name(self, table: FlightTable) -> Optional[str]:
+        """
+        Name of the file of a mapped snapshot, None if the table was not
+        returned by `get` or was released since.
+        """
+        with self._lock:
+            for name, mapped in self._tables.items():
+                if mapped is table:
+                    return name
+        return None
+
+    def stop(self) -> None:
+        """
+        Close the connection of the calling thread and release the
+        mapped snapshots.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+        with self._lock:
+            self._tables.clear()
+
+
+class SharedSessionStore:
+    """
+    Session states kept by a SnapshotServer, with the `get` and `set`
+    interface of SessionStore.
+    """
+
+    def __init__(self, client: SharedPoller):
+        """
+        Constructor.
+
+        Args:
+            client (SharedPoller): Connection to the server.
+        """
+        self.client = client
+
+    def __len__(self) -> int:
+        return self.client.call("count_sessions")
+
+    def get(self, token: Optional[str]) -> Optional[Any]:
+        """
+        Get the state of a session, None if unknown, evicted or if its
+        snapshot was removed.
+        """
+        state = self.client.call("get_session", token)
+        if state is None:
+            return None
+        unpickler = pickle.Unpickler(io.BytesIO(state))
+        unpickler.persistent_load = self._load_table
+        try:
+            return unpickler.load()
+        except FileNotFoundError:
+            return None
+
+    def set(self, token: str, state: Any) -> None:
+        """
+        Set the state of a session. Mapped snapshots are stored as the
+        name of their file rather than their content.
+        """
+        buffer = io.BytesIO()
+        pickler = pickle.Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = self._table_id
+        pickler.dump(state)
+        self.client.call("set_session", token, buffer.getvalue())
+
+    def _table_id(self, obj: Any) -> Optional[str]:
+        if isinstance(obj, FlightTable):
+            return self.client.table_name(obj)
+        return None
+
+    def _load_table(self, name: str) -> FlightTable:
+        return self.client.table(name)
+
+
+class SharedTrailBuffer:
+    """
+    Trails kept by a SnapshotServer, with the interface of TrailBuffer
+    used by the dashboard.
+    """
+
+    def __init__(self, client: SharedPoller):
+        """
+        Constructor.
+
+        Args:
+            client (SharedPoller): Connection to the server.
+        """
+        self.client = client
+
+    def update(self, table: FlightTable, timestamp: float, key: Optional[Hashable] = None) -> None:
+        """
+        Nothing to do: the server updates the trails with every snapshot
+        it serves.
+        """
+
+    def get_trails(self, flight_ids: Sequence[str], zoom: float) -> Dict[str, Tuple[Hashable, List]]:
+        """
+        Simplified trails of flights, see TrailBuffer.get_trails.
+        """
+        return self.client.call("trails", list(flight_ids), zoom)
+
+
+if __name__ == "__main__":
+    main_cli()
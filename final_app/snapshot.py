@@ -0,0 +1,368 @@
+"""
+Columnar flight snapshot.
+
+A FlightTable stores one poll of FlightRadar24 as contiguous NumPy
+columns instead of a list of dictionaries: numeric fields are typed
+arrays, airport and airline codes are interned into categorical columns,
+and flights can be looked up by id through an index.
+"""
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from itertools import repeat
+from operator import attrgetter
+import numpy as np
+
+
+# Numeric columns and their types
+NUMERIC_COLUMNS = {
+    "latitude": np.float64,
+    "longitude": np.float64,
+    "ground_speed": np.int32,
+    "altitude": np.int32,
+    "vertical_speed": np.int32,
+    "heading": np.int16,
+    "on_ground": np.int8,
+}
+# Columns with few distinct values, stored as integer codes
+CATEGORICAL_COLUMNS = (
+    "origin_airport_iata",
+    "destination_airport_iata",
+    "airline_icao",
+    "aircraft_code",
+)
+# Columns with mostly distinct values
+STRING_COLUMNS = (
+    "id",
+    "number",
+)
+COLUMNS = STRING_COLUMNS + tuple(NUMERIC_COLUMNS) + CATEGORICAL_COLUMNS
+# Values standing for a missing field in the API responses
+MISSING_VALUES = frozenset((None, "N/A"))
+
+
+def _to_number(value: Any) -> Any:
+    """
+    Replace missing values ("N/A" or None) by 0.
+    """
+    return value if isinstance(value, (int, float)) else 0
+
+
+def _to_string(value: Any) -> str:
+    """
+    Replace missing values by an empty string.
+    """
+    return "" if value is None or value == "N/A" else str(value)
+
+
+def _numeric_column(values: List[Any], dtype: Any) -> np.ndarray:
+    """
+    Numeric column from raw values, missing ones being replaced by 0.
+    """
+    column = np.array(values)
+    if column.dtype.kind in "biuf":
+        return column.astype(dtype)
+    return np.fromiter(map(_to_number, values), dtype=dtype, count=len(values))
+
+
+def _string_values(values: List[Any]) -> List[Any]:
+    """
+    Raw values with missing ones replaced by empty strings, only copied
+    if some are missing.
+    """
+    if MISSING_VALUES.isdisjoint(values):
+        return values
+    return list(map(_to_string, values))
+
+
+class Categorical:
+    """
+    Column of interned strings: `categories[codes[row]]` is the value
+    of a row.
+    """
+    __slots__ = ("codes", "categories")
+
+    def __init__(self, codes: np.ndarray, categories: Tuple[str, ...]):
+        self.codes = codes
+        self.categories = categories
+
+    @classmethod
+    def from_values(cls, values: Iterable[str]) -> "Categorical":
+        """
+        Intern a sequence of strings.
+        """
+        values = list(values)
+        # Categories in order of first appearance
+        lookup = {value: code for code, value in enumerate(dict.fromkeys(values))}
+        dtype = np.int16 if len(lookup) < np.iinfo(np.int16).max else np.int32
+        codes = np.fromiter(map(lookup.__getitem__, values), dtype=dtype, count=len(values))
+        codes.setflags(write=False)
+        return cls(codes, tuple(lookup))
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, row: int) -> str:
+        return self.categories[self.codes[row]]
+
+    def code(self, value: str) -> int:
+        """
+        Code of a value, -1 if it does not appear in the column.
+        """
+        try:
+            return self.categories.index(value)
+        except ValueError:
+            return -1
+
+    @classmethod
+    def concat(cls, columns: Sequence["Categorical"]) -> "Categorical":
+        """
+        Concatenate columns, merging their categories.
+        """
+        lookup: Dict[str, int] = {}
+        codes = []
+        for column in columns:
+            remap = np.array(
+                [lookup.setdefault(value, len(lookup)) for value in column.categories],
+                dtype=np.int32,
+            )
+            codes.append(remap[column.codes] if len(remap) else column.codes.astype(np.int32))
+        merged = np.concatenate(codes) if codes else np.zeros(0, dtype=np.int32)
+        if len(lookup) < np.iinfo(np.int16).max:
+            merged = merged.astype(np.int16)
+        merged.setflags(write=False)
+        return cls(merged, tuple(lookup))
+
+    def take(self, rows: np.ndarray) -> "Categorical":
+        """
+        Subset of the rows, sharing the categories.
+        """
+        codes = self.codes[rows]
+        codes.setflags(write=False)
+        return Categorical(codes, self.categories)
+
+    def tolist(self) -> List[str]:
+        categories = self.categories
+        return [categories[code] for code in self.codes.tolist()]
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + sum(len(value) for value in self.categories)
+
+
+class FlightTable:
+    """
+    Immutable columnar snapshot of flights.
+
+    Numeric columns are NumPy arrays, categorical ones Categorical
+    instances and string ones NumPy unicode arrays, all accessible
+    as attributes (e.g. `table.latitude`).
+    """
+
+    def __init__(self, columns: Dict[str, Any]):
+        """
+        Constructor.
+
+        Args:
+            columns (Dict): Columns, as built by `from_columns`.
+        """
+        self.columns = columns
+        for column in columns.values():
+            if isinstance(column, np.ndarray):
+                column.setflags(write=False)
+        self._index: Optional[Dict[str, int]] = None
+
+    @classmethod
+    def from_columns(cls, values: Dict[str, List[Any]]) -> "FlightTable":
+        """
+        Build a table from raw column values, e.g. as found in the API
+        responses. Missing values ("N/A" or None) are replaced by 0 or
+        empty strings.
+
+        Args:
+            values (Dict[str, List]): Values of every column of COLUMNS.
+
+        Returns:
+            FlightTable: Table.
+        """
+        columns: Dict[str, Any] = {}
+        for name in STRING_COLUMNS:
+            columns[name] = np.array(_string_values(values[name]), dtype=str)
+        for name, dtype in NUMERIC_COLUMNS.items():
+            columns[name] = _numeric_column(values[name], dtype)
+        for name in CATEGORICAL_COLUMNS:
+            columns[name] = Categorical.from_values(_string_values(values[name]))
+        return cls(columns)
+
+    @classmethod
+    def from_records(cls, records: Sequence[Dict]) -> "FlightTable":
+        """
+        Build a table from flight dictionaries. Missing keys are
+        filled with 0 or empty strings.
+
+        Args:
+            records (Sequence[Dict]): Flight dictionaries.
+
+        Returns:
+            FlightTable: Table.
+        """
+        return cls.from_columns({
+            name: [record.get(name) for record in records] for name in COLUMNS
+        })
+
+    @classmethod
+    def from_flights(cls, flights: Sequence[Any]) -> "FlightTable":
+        """
+        Build a table from the Flight objects returned by
+        FlightRadar24API.get_flights, one column at a time without
+        going through flight dictionaries.
+
+        Args:
+            flights (Sequence[Flight]): Flights.
+
+        Returns:
+            FlightTable: Table.
+        """
+        return cls.from_columns({
+            name: list(map(attrgetter(name), flights)) for name in COLUMNS
+        })
+
+    @classmethod
+    def empty(cls) -> "FlightTable":
+        """
+        Table without any flight.
+        """
+        return cls.from_records([])
+
+    @classmethod
+    def concat(cls, tables: Sequence["FlightTable"], unique: bool = True) -> "FlightTable":
+        """
+        Concatenate tables, keeping only the first row of flights
+        appearing in several of them.
+
+        Args:
+            tables (Sequence[FlightTable]): Tables.
+            unique (bool): Whether to drop the duplicate flights, False
+                to keep every row (e.g. rows of successive snapshots).
+
+        Returns:
+            FlightTable: Merged table.
+        """
+        if not tables:
+            return cls.empty()
+        columns: Dict[str, Any] = {}
+        for name, column in tables[0].columns.items():
+            if isinstance(column, Categorical):
+                columns[name] = Categorical.concat([table.columns[name] for table in tables])
+            else:
+                columns[name] = np.concatenate([table.columns[name] for table in tables])
+        merged = cls(columns)
+        if not unique:
+            return merged
+        _, first_rows = np.unique(merged.id, return_index=True)
+        if len(first_rows) == len(merged):
+            return merged
+        return merged.take(np.sort(first_rows))
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The index is rebuilt on first use rather than pickled
+        return {"columns": self.columns}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(state["columns"])
+
+    def __len__(self) -> int:
+        return len(self.columns["id"])
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return self.__dict__["columns"][name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __iter__(self) -> Iterator["FlightRow"]:
+        return (FlightRow(self, row) for row in range(len(self)))
+
+    @property
+    def index(self) -> Dict[str, int]:
+        """
+        Mapping from flight id to row, built on first use.
+        """
+        if self._index is None:
+            self._index = {
+                identifier: row for row, identifier in enumerate(self.columns["id"].tolist())
+            }
+        return self._index
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory used by the columns (in bytes).
+        """
+        return sum(column.nbytes for column in self.columns.values())
+
+    def rows(self, identifiers: Sequence[str]) -> np.ndarray:
+        """
+        Rows of flights given their ids, -1 for absent ones.
+        """
+        index = self.index
+        return np.fromiter(
+            map(index.get, identifiers, repeat(-1)), dtype=np.int64, count=len(identifiers)
+        )
+
+    def row(self, identifier: str) -> Optional["FlightRow"]:
+        """
+        View of a flight given its id, None if it is absent.
+        """
+        row = self.index.get(identifier)
+        return None if row is None else FlightRow(self, row)
+
+    def take(self, rows: np.ndarray) -> "FlightTable":
+        """
+        Table restricted to some rows.
+
+        Args:
+            rows (np.ndarray): Row indices or boolean mask.
+
+        Returns:
+            FlightTable: Sub-table.
+        """
+        return FlightTable({
+            name: column.take(rows) if isinstance(column, Categorical) else column[rows]
+            for name, column in self.columns.items()
+        })
+
+    def to_records(self) -> List[Dict]:
+        """
+        Convert the table back to a list of flight dictionaries,
+        as returned by fetch_flight_data.
+        """
+        names = list(self.columns)
+        values = [self.columns[name].tolist() for name in names]
+        return [dict(zip(names, row)) for row in zip(*values)]
+
+
+class FlightRow:
+    """
+    Lightweight view of one flight of a FlightTable, exposing its
+    fields as attributes.
+    """
+    __slots__ = ("table", "row")
+
+    def __init__(self, table: FlightTable, row: int):
+        self.table = table
+        self.row = row
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            value = self.table.columns[name][self.row]
+        except KeyError:
+            raise AttributeError(name) from None
+        return value.item() if isinstance(value, np.generic) else value
+
+    def __repr__(self) -> str:
+        return f"<FlightRow {self.id} ({self.latitude}, {self.longitude})>"
+
+    def to_dict(self) -> Dict:
+        """
+        Flight dictionary of the row.
+        """
+        return {name: getattr(self, name) for name in self.table.columns}
@@ -0,0 +1,366 @@
+"""
+Synthetic FlightRadar24 traffic.
+
+A SyntheticClient simulates any number of aircraft (up to 100k and
+beyond) flying back and forth between real airports along great-circle
+routes, at realistic speeds and altitudes. It exposes the interface of
+FlightRadar24API used by the apps, so that the rendering pipeline can be
+tested at traffic levels much larger than a real fleet.
+"""
+from typing import Any, Dict, List, NamedTuple, Optional
+import threading
+import time
+import numpy as np
+from FlightRadar24 import Flight, FlightRadar24API, FlightTrackerConfig
+from utils import bearings_from_positions
+
+
+EARTH_RADIUS_KM = 6371.0
+KNOT_KMH = 1.852
+# Positions only change every UPDATE_PERIOD seconds, as in the real feed
+UPDATE_PERIOD = 1.0
+# Distance over which aircraft climb after departure and descend before
+# arrival (in km)
+CLIMB_DISTANCE_KM = 200.0
+MIN_ROUTE_KM = 300.0
+LONG_HAUL_KM = 4000.0
+
+# Top-level zones, with the bounds of FlightRadar24
+ZONES = {
+    "europe": {"tl_y": 72.57, "tl_x": -16.96, "br_y": 33.57, "br_x": 53.05},
+    "northamerica": {"tl_y": 75.0, "tl_x": -180.0, "br_y": 3.0, "br_x": -52.0},
+    "southamerica": {"tl_y": 16.0, "tl_x": -96.0, "br_y": -57.0, "br_x": -31.0},
+    "oceania": {"tl_y": 19.62, "tl_x": 88.4, "br_y": -55.08, "br_x": 180.0},
+    "asia": {"tl_y": 79.98, "tl_x": 40.91, "br_y": 12.48, "br_x": 179.77},
+    "africa": {"tl_y": 39.0, "tl_x": -29.0, "br_y": -39.0, "br_x": 55.0},
+    "atlantic": {"tl_y": 52.62, "tl_x": -50.9, "br_y": 15.62, "br_x": -4.75},
+    "maldives": {"tl_y": 10.72, "tl_x": 63.1, "br_y": -6.08, "br_x": 86.53},
+    "northatlantic": {"tl_y": 82.62, "tl_x": -84.53, "br_y": 59.02, "br_x": 4.45},
+}
+
+# IATA code, latitude, longitude
+AIRPORTS = (
+    ("CDG", 49.0097, 2.5479), ("ORY", 48.7262, 2.3652), ("NCE", 43.6584, 7.2159),
+    ("LYS", 45.7256, 5.0811), ("MRS", 43.4393, 5.2214), ("TLS", 43.6291, 1.3638),
+    ("BOD", 44.8283, -0.7156), ("NTE", 47.1532, -1.6107), ("SXB", 48.5383, 7.6282),
+    ("LHR", 51.4700, -0.4543), ("LGW", 51.1537, -0.1821), ("MAN", 53.3537, -2.2750),
+    ("DUB", 53.4264, -6.2499), ("AMS", 52.3105, 4.7683), ("BRU", 50.9014, 4.4844),
+    ("FRA", 50.0379, 8.5622), ("MUC", 48.3537, 11.7750), ("BER", 52.3667, 13.5033),
+    ("ZRH", 47.4582, 8.5555), ("GVA", 46.2381, 6.1090), ("VIE", 48.1103, 16.5697),
+    ("CPH", 55.6180, 12.6508), ("ARN", 59.6498, 17.9238), ("OSL", 60.1976, 11.1004),
+    ("HEL", 60.3172, 24.9633), ("WAW", 52.1657, 20.9671), ("PRG", 50.1008, 14.2600),
+    ("BUD", 47.4298, 19.2611), ("MAD", 40.4983, -3.5676), ("BCN", 41.2974, 2.0833),
+    ("LIS", 38.7756, -9.1354), ("FCO", 41.8003, 12.2389), ("MXP", 45.6306, 8.7281),
+    ("ATH", 37.9364, 23.9445), ("IST", 41.2753, 28.7519), ("SVO", 55.9726, 37.4146),
+    ("JFK", 40.6413, -73.7781), ("EWR", 40.6895, -74.1745), ("BOS", 42.3656, -71.0096),
+    ("ORD", 41.9742, -87.9073), ("ATL", 33.6407, -84.4277), ("DFW", 32.8998, -97.0403),
+    ("DEN", 39.8561, -104.6737), ("LAX", 33.9416, -118.4085), ("SFO", 37.6213, -122.3790),
+    ("SEA", 47.4502, -122.3088), ("MIA", 25.7959, -80.2870), ("YYZ", 43.6777, -79.6248),
+    ("YUL", 45.4706, -73.7408), ("MEX", 19.4361, -99.0719), ("GRU", -23.4356, -46.4731),
+    ("GIG", -22.8100, -43.2506), ("EZE", -34.8222, -58.5358), ("BOG", 4.7016, -74.1469),
+    ("SCL", -33.3930, -70.7858), ("DXB", 25.2532, 55.3657), ("DOH", 25.2731, 51.6081),
+    ("DEL", 28.5562, 77.1000), ("BOM", 19.0896, 72.8656), ("SIN", 1.3644, 103.9915),
+    ("BKK", 13.6900, 100.7501), ("HKG", 22.3080, 113.9185), ("PEK", 40.0799, 116.6031),
+    ("PVG", 31.1443, 121.8083), ("ICN", 37.4602, 126.4407), ("HND", 35.5494, 139.7798),
+    ("NRT", 35.7720, 140.3929), ("SYD", -33.9399, 151.1753), ("MEL", -37.6690, 144.8410),
+    ("AKL", -37.0082, 174.7850), ("JNB", -26.1367, 28.2411), ("CPT", -33.9715, 18.6021),
+    ("CAI", 30.1219, 31.4056), ("CMN", 33.3675, -7.5898), ("ALG", 36.6910, 3.2154),
+    ("TUN", 36.8510, 10.2272), ("DKR", 14.7397, -17.4902), ("ABJ", 5.2614, -3.9263),
+    ("NBO", -1.3192, 36.9278), ("RUN", -20.8871, 55.5103), ("PTP", 16.2653, -61.5318),
+    ("FDF", 14.5910, -61.0032), ("KEF", 63.9850, -22.6056), ("MLE", 4.1918, 73.5291),
+)
+
+# Name, IATA code, ICAO code, registration prefix, hub, share of the traffic
+AIRLINES = (
+    ("Air France", "AF", "AFR", "F-G", "CDG", 8),
+    ("KLM", "KL", "KLM", "PH-", "AMS", 4),
+    ("Lufthansa", "LH", "DLH", "D-A", "FRA", 7),
+    ("British Airways", "BA", "BAW", "G-", "LHR", 6),
+    ("Iberia", "IB", "IBE", "EC-", "MAD", 3),
+    ("easyJet", "U2", "EZY", "G-E", "LGW", 7),
+    ("Ryanair", "FR", "RYR", "EI-", "DUB", 10),
+    ("Turkish Airlines", "TK", "THY", "TC-", "IST", 7),
+    ("Delta Air Lines", "DL", "DAL", "N", "ATL", 10),
+    ("American Airlines", "AA", "AAL", "N", "DFW", 10),
+    ("United Airlines", "UA", "UAL", "N", "ORD", 9),
+    ("Air Canada", "AC", "ACA", "C-", "YYZ", 3),
+    ("LATAM", "LA", "LAN", "CC-", "SCL", 3),
+    ("Emirates", "EK", "UAE", "A6-", "DXB", 4),
+    ("Qatar Airways", "QR", "QTR", "A7-", "DOH", 3),
+    ("Singapore Airlines", "SQ", "SIA", "9V-", "SIN", 2),
+    ("Cathay Pacific", "CX", "CPA", "B-", "HKG", 2),
+    ("Air China", "CA", "CCA", "B-", "PEK", 5),
+    ("ANA", "NH", "ANA", "JA", "HND", 3),
+    ("Qantas", "QF", "QFA", "VH-", "SYD", 2),
+)
+
+SHORT_HAUL_AIRCRAFT = ("A320", "A321", "A319", "A20N", "A21N", "B738", "B38M", "E190")
+LONG_HAUL_AIRCRAFT = ("B77W", "B789", "A359", "A333", "A388", "B763")
+
+
+class FleetState(NamedTuple):
+    """
+    Positions of the whole fleet at a given time.
+    """
+    timestamp: int
+    latitude: np.ndarray
+    longitude: np.ndarray
+    heading: np.ndarray
+    altitude: np.ndarray
+    vertical_speed: np.ndarray
+    returning: np.ndarray
+
+
+def _to_vectors(latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """
+    Unit vectors of points given in degrees, shape (n, 3).
+    """
+    lat = np.radians(latitudes)
+    lon = np.radians(longitudes)
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=1)
+
+
+class SyntheticClient:
+    """
+    Drop-in replacement of FlightRadar24API simulating traffic.
+
+    Every aircraft flies back and forth on a great-circle route between
+    two airports, half of them leaving from the hub of their airline.
+    Positions only depend on the clock, which follows the wall clock
+    multiplied by `speed`, or only moves through `advance` with
+    `speed=None` for deterministic runs.
+
+    As the real API, get_flights returns at most the number of flights
+    of the `limit` of the flight tracker configuration.
+    """
+
+    def __init__(self, n_flights: int = 10_000, seed: int = 0, speed: Optional[float] = 1.0):
+        """
+        Constructor.
+
+        Args:
+            n_flights (int): Number of simulated aircraft.
+            seed (int): Random seed, the same seed gives the same fleet.
+            speed (float): Simulation speed, None for a manual clock.
+        """
+        rng = np.random.default_rng(seed)
+        self.n_flights = n_flights
+        self.speed = speed
+        self.start_time = time.time()
+        self._offset = 0.0
+        self._started_at = time.monotonic()
+
+        airport_codes = np.array([airport[0] for airport in AIRPORTS])
+        airport_vectors = _to_vectors(
+            np.array([airport[1] for airport in AIRPORTS]),
+            np.array([airport[2] for airport in AIRPORTS]),
+        )
+        hubs = {code: index for index, code in enumerate(airport_codes.tolist())}
+        weights = np.array([airline[5] for airline in AIRLINES], dtype=float)
+        self.airline_index = rng.choice(len(AIRLINES), n_flights, p=weights / weights.sum())
+
+        # Routes: half of the flights leave from their hub
+        origins = rng.integers(len(AIRPORTS), size=n_flights)
+        from_hub = rng.random(n_flights) < 0.5
+        hub_index = np.array([hubs[airline[4]] for airline in AIRLINES])
+        origins[from_hub] = hub_index[self.airline_index[from_hub]]
+        destinations = rng.integers(len(AIRPORTS), size=n_flights)
+        angles = self._route_angles(airport_vectors, origins, destinations)
+        # Draw new destinations for routes too short to be flown
+        while True:
+            too_short = angles * EARTH_RADIUS_KM < MIN_ROUTE_KM
+            if not too_short.any():
+                break
+            destinations[too_short] = rng.integers(len(AIRPORTS), size=int(too_short.sum()))
+            angles = self._route_angles(airport_vectors, origins, destinations)
+        self.origins = origins
+        self.destinations = destinations
+        self.airport_codes = airport_codes
+        self._origin_vectors = airport_vectors[origins]
+        self._destination_vectors = airport_vectors[destinations]
+        self._angles = angles
+        self.route_km = angles * EARTH_RADIUS_KM
+
+        long_haul = self.route_km > LONG_HAUL_KM
+        self.ground_speed = np.where(
+            long_haul, rng.integers(470, 520, n_flights), rng.integers(400, 470, n_flights)
+        )
+        self.cruise_altitude = np.where(
+            long_haul, rng.integers(33, 42, n_flights), rng.integers(28, 39, n_flights)
+        ) * 1000
+        # Initial distance flown, so that aircraft are spread along routes
+        self._phase_km = rng.random(n_flights) * 2 * self.route_km
+
+        self.aircraft_code = np.where(
+            long_haul,
+            rng.choice(LONG_HAUL_AIRCRAFT, n_flights),
+            rng.choice(SHORT_HAUL_AIRCRAFT, n_flights),
+        )
+        self.airline_icao = np.array([airline[2] for airline in AIRLINES])[self.airline_index]
+        letters = rng.integers(ord("A"), ord("Z") + 1, size=(n_flights, 3)).astype(np.uint32)
+        suffixes = letters.view("U1").reshape(n_flights, 3)
+        prefixes = [AIRLINES[index][3] for index in self.airline_index.tolist()]
+        self.registration = np.array(
+            [prefix + "".join(suffix) for prefix, suffix in zip(prefixes, suffixes.tolist())]
+        )
+        numbers = rng.integers(1, 10_000, n_flights)
+        self.number = np.array([
+            f"{AIRLINES[index][1]}{number}"
+            for index, number in zip(self.airline_index.tolist(), numbers.tolist())
+        ])
+        self.callsign = np.array([
+            f"{AIRLINES[index][2]}{number}"
+            for index, number in zip(self.airline_index.tolist(), numbers.tolist())
+        ])
+        self.ids = np.array([f"{0x30000000 + index:x}" for index in range(n_flights)])
+        self.icao_24bit = np.array([f"{value:06X}" for value in rng.choice(0xFFFFFF, n_flights, replace=False)])
+        self.squawk = np.array([f"{value:04o}" for value in rng.integers(0, 0o7777, n_flights)])
+
+        self._flight_tracker_config = FlightTrackerConfig()
+        self._state: Optional[FleetState] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _route_angles(vectors: np.ndarray, origins: np.ndarray, destinations: np.ndarray) -> np.ndarray:
+        dots = np.einsum("ij,ij->i", vectors[origins], vectors[destinations])
+        return np.arccos(np.clip(dots, -1.0, 1.0))
+
+    def now(self) -> float:
+        """
+        Current simulation time (UNIX timestamp).
+        """
+        elapsed = self._offset
+        if self.speed is not None:
+            elapsed += (time.monotonic() - self._started_at) * self.speed
+        return self.start_time + elapsed
+
+    def advance(self, seconds: float) -> None:
+        """
+        Move the simulation clock forward.
+        """
+        self._offset += seconds
+
+    def state(self) -> FleetState:
+        """
+        Positions of all the aircraft at the current time, computed
+        at most once per UPDATE_PERIOD.
+        """
+        timestamp = int(self.now() // UPDATE_PERIOD * UPDATE_PERIOD)
+        with self._lock:
+            if self._state is not None and self._state.timestamp == timestamp:
+                return self._state
+        elapsed_hours = (timestamp - self.start_time) / 3600
+        flown_km = self._phase_km + self.ground_speed * KNOT_KMH * elapsed_hours
+        legs, leg_km = np.divmod(flown_km, self.route_km)
+        # Aircraft fly back on odd legs
+        returning = (legs % 2).astype(bool)
+        start = np.where(returning[:, None], self._destination_vectors, self._origin_vectors)
+        end = np.where(returning[:, None], self._origin_vectors, self._destination_vectors)
+
+        # Spherical interpolation between the two airports
+        fraction = leg_km / self.route_km
+        sin_angles = np.sin(self._angles)
+        position = (
+            start * (np.sin((1 - fraction) * self._angles) / sin_angles)[:, None]
+            + end * (np.sin(fraction * self._angles) / sin_angles)[:, None]
+        )
+        latitude = np.degrees(np.arcsin(np.clip(position[:, 2], -1.0, 1.0)))
+        longitude = np.degrees(np.arctan2(position[:, 1], position[:, 0]))
+        end_latitude = np.degrees(np.arcsin(end[:, 2]))
+        end_longitude = np.degrees(np.arctan2(end[:, 1], end[:, 0]))
+        heading = bearings_from_positions(end_longitude, end_latitude, longitude, latitude)
+
+        # Climb after departure, descend before arrival
+        remaining_km = self.route_km - leg_km
+        climb = np.minimum(leg_km, remaining_km) / CLIMB_DISTANCE_KM
+        altitude = self.cruise_altitude * np.minimum(climb, 1.0)
+        minutes_per_km = 60 / (self.ground_speed * KNOT_KMH)
+        slope = self.cruise_altitude / CLIMB_DISTANCE_KM / minutes_per_km
+        vertical_speed = np.where(
+            climb >= 1.0, 0, np.where(leg_km < remaining_km, slope, -slope)
+        )
+
+        state = FleetState(
+            timestamp=timestamp,
+            latitude=np.round(latitude, 4),
+            longitude=np.round(longitude, 4),
+            heading=np.round(heading).astype(np.int64) % 360,
+            altitude=(np.round(altitude / 25) * 25).astype(np.int64),
+            vertical_speed=(np.round(vertical_speed / 64) * 64).astype(np.int64),
+            returning=returning,
+        )
+        with self._lock:
+            self._state = state
+        return state
+
+    def get_zones(self) -> Dict[str, Dict]:
+        return {name: dict(zone) for name, zone in ZONES.items()}
+
+    def get_airlines(self) -> List[Dict]:
+        return [{"Name": airline[0], "Code": airline[1], "ICAO": airline[2]} for airline in AIRLINES]
+
+    def get_bounds(self, zone: Dict[str, float]) -> str:
+        return FlightRadar24API.get_bounds(self, zone)
+
+    def get_flight_tracker_config(self) -> FlightTrackerConfig:
+        return FlightTrackerConfig(**vars(self._flight_tracker_config))
+
+    def set_flight_tracker_config(self, flight_tracker_config=None, **config) -> None:
+        if flight_tracker_config is not None:
+            self._flight_tracker_config = flight_tracker_config
+        for key, value in config.items():
+            setattr(self._flight_tracker_config, key, str(value))
+
+    def get_flights(
+        self,
+        airline: Optional[str] = None,
+        bounds: Optional[str] = None,
+        registration: Optional[str] = None,
+        aircraft_type: Optional[str] = None,
+        *,
+        details: bool = False
+    ) -> List[Flight]:
+        state = self.state()
+        mask = np.ones(self.n_flights, dtype=bool)
+        if bounds is not None:
+            north, south, west, east = (float(value) for value in bounds.split(","))
+            mask &= (state.latitude >= south) & (state.latitude <= north)
+            mask &= (state.longitude >= west) & (state.longitude <= east)
+        if airline:
+            mask &= self.airline_icao == airline
+        if aircraft_type:
+            mask &= self.aircraft_code == aircraft_type
+        if registration:
+            mask &= self.registration == registration
+        rows = np.flatnonzero(mask)[:int(self._flight_tracker_config.limit)]
+        returning = state.returning[rows]
+        origins = self.airport_codes[np.where(returning, self.destinations[rows], self.origins[rows])]
+        destinations = self.airport_codes[np.where(returning, self.origins[rows], self.destinations[rows])]
+
+        columns = zip(
+            self.ids[rows].tolist(), self.icao_24bit[rows].tolist(),
+            state.latitude[rows].tolist(), state.longitude[rows].tolist(),
+            state.heading[rows].tolist(), state.altitude[rows].tolist(),
+            self.ground_speed[rows].tolist(), self.squawk[rows].tolist(),
+            self.aircraft_code[rows].tolist(), self.registration[rows].tolist(),
+            origins.tolist(), destinations.tolist(), self.number[rows].tolist(),
+            state.vertical_speed[rows].tolist(), self.callsign[rows].tolist(),
+            self.airline_icao[rows].tolist(),
+        )
+        flights = []
+        for (flight_id, icao_24bit, latitude, longitude, heading, altitude, ground_speed,
+             squawk, aircraft_code, registration, origin, destination, number,
+             vertical_speed, callsign, airline_icao) in columns:
+            info: List[Any] = [
+                icao_24bit, latitude, longitude, heading, altitude, ground_speed, squawk,
+                None, aircraft_code, registration, state.timestamp, origin, destination,
+                number, 0, vertical_speed, callsign, None, airline_icao,
+            ]
+            flight = Flight(flight_id, info)
+            if details:
+                flight.set_flight_details(self.get_flight_details(flight))
+            flights.append(flight)
+        return flights
+
+    def get_flight_details(self, flight: Flight) -> Dict[Any, Any]:
+        return {}
@@ -0,0 +1,186 @@
+"""
+Adaptive tiling of flight requests.
+
+FlightRadar24 returns at most a limited number of flights per request,
+so a dense area fetched at once silently misses flights. A TiledFetcher
+splits every tile whose response reaches that limit into four quadrants
+and fetches them again, and remembers the resulting tiles so that the
+next polls directly request them.
+"""
+from typing import Hashable, List, NamedTuple, Optional, Sequence, Tuple
+from collections import OrderedDict
+from concurrent.futures import Executor
+import threading
+import time
+from FlightRadar24 import FlightRadar24API
+from snapshot import FlightTable
+from utils import FETCH_EXECUTOR, fetch_bounds_flight_table
+
+
+# Used when the client does not expose its configuration
+DEFAULT_LIMIT = 1500
+
+
+class Tile(NamedTuple):
+    """
+    Rectangular area, in degrees.
+    """
+    north: float
+    south: float
+    west: float
+    east: float
+    depth: int = 0
+
+    @classmethod
+    def from_bounds(cls, bounds: str) -> "Tile":
+        """
+        Tile of bounds "y1,y2,x1,x2" (north, south, west, east).
+        """
+        north, south, west, east = (float(value) for value in bounds.split(","))
+        return cls(north, south, west, east)
+
+    @property
+    def bounds(self) -> str:
+        """
+        Bounds "y1,y2,x1,x2" of the tile.
+        """
+        return f"{self.north},{self.south},{self.west},{self.east}"
+
+    def split(self) -> Tuple["Tile", ...]:
+        """
+        Four quadrants of the tile.
+        """
+        latitude = (self.north + self.south) / 2
+        longitude = (self.west + self.east) / 2
+        depth = self.depth + 1
+        return (
+            Tile(self.north, latitude, self.west, longitude, depth),
+            Tile(self.north, latitude, longitude, self.east, depth),
+            Tile(latitude, self.south, self.west, longitude, depth),
+            Tile(latitude, self.south, longitude, self.east, depth),
+        )
+
+
+class TiledFetcher:
+    """
+    Fetch areas as sets of tiles small enough to stay under the
+    per-request flight limit.
+    """
+
+    def __init__(
+        self,
+        client: FlightRadar24API,
+        limit: Optional[int] = None,
+        max_depth: int = 6,
+        layout_ttl: float = 3600.0,
+        max_layouts: int = 1024,
+        executor: Executor = FETCH_EXECUTOR,
+    ):
+        """
+        Constructor.
+
+        Args:
+            client (FlightRadar24API): FlightRadar24API client.
+            limit (int): Maximum number of flights per response, read
+                from the client configuration if missing.
+            max_depth (int): Maximum number of successive splits.
+            layout_ttl (float): Lifetime of a tile layout (in seconds),
+                after which it is discovered again, so that tiles can
+                get coarser when traffic decreases.
+            max_layouts (int): Number of layouts kept, the least
+                recently fetched areas are forgotten first.
+            executor (Executor): Pool running the requests.
+        """
+        self.client = client
+        if limit is None:
+            try:
+                limit = int(client.get_flight_tracker_config().limit)
+            except AttributeError:
+                limit = DEFAULT_LIMIT
+        self.limit = limit
+        self.max_depth = max_depth
+        self.layout_ttl = layout_ttl
+        self.max_layouts = max_layouts
+        self.executor = executor
+        # (bounds, airline, aircraft type) -> (discovery time, tiles),
+        # least recently fetched first. Viewport bounds make keys
+        # numerous: expired and least recently fetched layouts are
+        # dropped after every fetch.
+        self._layouts: "OrderedDict[Hashable, Tuple[float, List[Tile]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def layout(
+        self,
+        bounds: str,
+        airline_icao: Optional[str] = None,
+        aircraft_type: Optional[str] = None,
+    ) -> List[Tile]:
+        """
+        Current tiles of an area.
+        """
+        key = (bounds, airline_icao, aircraft_type)
+        with self._lock:
+            discovered_at, tiles = self._layouts.get(key, (0.0, None))
+        if tiles is None or time.monotonic() - discovered_at > self.layout_ttl:
+            return [Tile.from_bounds(bounds)]
+        return tiles
+
+    def fetch(
+        self,
+        bounds_list: Sequence[str],
+        airline_icao: Optional[str] = None,
+        aircraft_type: Optional[str] = None,
+    ) -> FlightTable:
+        """
+        Fetch areas, splitting the tiles that reach the flight limit.
+
+        All the tiles of a level are requested concurrently. Flights
+        found in several tiles or areas are only kept once.
+
+        Args:
+            bounds_list (Sequence[str]): Bounds "y1,y2,x1,x2" of the areas.
+            airline_icao (str): ICAO code of the airline.
+            aircraft_type (str): Type of aircraft.
+
+        Returns:
+            FlightTable: Flights.
+        """
+        # (area index, tile) still to fetch
+        pending = [
+            (area, tile)
+            for area, bounds in enumerate(bounds_list)
+            for tile in self.layout(bounds, airline_icao, aircraft_type)
+        ]
+        layouts: List[List[Tile]] = [[] for _ in bounds_list]
+        tables = []
+        while pending:
+            futures = [
+                (area, tile, self.executor.submit(
+                    fetch_bounds_flight_table,
+                    self.client, tile.bounds, airline_icao, aircraft_type,
+                )) for area, tile in pending
+            ]
+            pending = []
+            for area, tile, future in futures:
+                table = future.result()
+                if len(table) >= self.limit and tile.depth < self.max_depth:
+                    pending.extend((area, quadrant) for quadrant in tile.split())
+                else:
+                    layouts[area].append(tile)
+                    tables.append(table)
+
+        now = time.monotonic()
+        with self._lock:
+            for bounds, tiles in zip(bounds_list, layouts):
+                key = (bounds, airline_icao, aircraft_type)
+                discovered_at, _ = self._layouts.get(key, (now, None))
+                if now - discovered_at > self.layout_ttl:
+                    discovered_at = now
+                self._layouts[key] = (discovered_at, tiles)
+                self._layouts.move_to_end(key)
+            for key, (discovered_at, _) in list(self._layouts.items()):
+                if now - discovered_at > self.layout_ttl:
+                    del self._layouts[key]
+            while len(self._layouts) > self.max_layouts:
+                self._layouts.popitem(last=False)
+        return FlightTable.concat(tables)
@@ -0,0 +1,351 @@
+"""
+Flight trails.
+
+The last positions of every tracked flight are kept in a TrailBuffer: a
+ring buffer per flight, all of them stored in one preallocated NumPy
+array, so that memory does not grow with the traffic. Trails are
+simplified with the Douglas-Peucker algorithm, with a tolerance
+depending on the zoom level, before being drawn as polylines behind
+the markers by the browser (see wire.py).
+"""
+from typing import Dict, Hashable, List, NamedTuple, Optional, Sequence, Tuple
+from collections import OrderedDict
+import threading
+import numpy as np
+from snapshot import FlightTable
+from clustering import TILE_SIZE
+
+
+# Tolerance of the simplification (in pixels)
+TOLERANCE_PIXELS = 1.0
+TRAIL_STYLE = dict(color="#1f4e9c", weight=2, opacity=0.6)
+# Number of (query, timestamp) snapshots remembered as already applied
+MAX_APPLIED = 256
+
+
+def simplify_many(points: np.ndarray, counts: np.ndarray, epsilon: float) -> np.ndarray:
+    """
+    Douglas-Peucker simplification of many polylines at once.
+
+    Instead of recursing on each polyline, every iteration splits all
+    the segments of all the polylines at their farthest point, which
+    gives the same result with a handful of vectorized steps.
+
+    Args:
+        points (np.ndarray): Points of the polylines, shape (n, length, 2),
+            the first `counts[i]` points of polyline i being used.
+        counts (np.ndarray): Number of points of each polyline.
+        epsilon (float): Maximum distance between a polyline and its
+            simplification, in the unit of the points.
+
+    Returns:
+        np.ndarray: Mask of the kept points, shape (n, length).
+    """
+    n_lines, length, _ = points.shape
+    index = np.arange(length)
+    latitudes = points[..., 0]
+    longitudes = points[..., 1]
+    valid = index < counts[:, None]
+    keep = np.zeros((n_lines, length), dtype=bool)
+    keep[:, 0] = counts > 0
+    keep[np.arange(n_lines), np.maximum(counts - 1, 0)] = counts > 0
+    # Polylines that may still have points to keep
+    active = np.flatnonzero(counts > 2)
+    while len(active):
+        kept = keep[active]
+        # Kept points before and after every point: ends of its segment
+        start = np.maximum.accumulate(np.where(kept, index, 0), axis=1)
+        end = np.minimum.accumulate(np.where(kept, index, length - 1)[:, ::-1], axis=1)[:, ::-1]
+        y, x = latitudes[active], longitudes[active]
+        y0 = np.take_along_axis(y, start, axis=1)
+        x0 = np.take_along_axis(x, start, axis=1)
+        dy = np.take_along_axis(y, end, axis=1) - y0
+        dx = np.take_along_axis(x, end, axis=1) - x0
+        norm = np.hypot(dy, dx)
+        cross = np.abs(dy * (x - x0) - dx * (y - y0))
+        distances = np.where(
+            norm > 0, cross / np.where(norm > 0, norm, 1), np.hypot(y - y0, x - x0)
+        )
+        candidates = valid[active] & ~kept & (distances > epsilon)
+        # Keep the farthest point of each segment (the first one on ties).
+        # Candidates come in row-major order, so those of a segment are
+        # contiguous.
+        line, point = np.nonzero(candidates)
+        if not len(line):
+            break
+        segment = line * length + start[line, point]
+        candidate_distances = distances[line, point]
+        new_segment = np.ones(len(segment), dtype=bool)
+        new_segment[1:] = segment[1:] != segment[:-1]
+        group = np.cumsum(new_segment) - 1
+        maxima = np.maximum.reduceat(candidate_distances, np.flatnonzero(new_segment))
+        farthest = np.flatnonzero(candidate_distances == maxima[group])
+        first = np.ones(len(farthest), dtype=bool)
+        first[1:] = group[farthest[1:]] != group[farthest[:-1]]
+        farthest = farthest[first]
+        keep[active[line[farthest]], point[farthest]] = True
+        active = active[np.unique(line)]
+    return keep
+
+
+def simplify(points: np.ndarray, epsilon: float) -> np.ndarray:
+    """
+    Douglas-Peucker simplification of a polyline.
+
+    Args:
+        points (np.ndarray): Points, shape (n, 2).
+        epsilon (float): Maximum distance between the polyline and its
+            simplification, in the unit of the points.
+
+    Returns:
+        np.ndarray: Kept points.
+    """
+    keep = simplify_many(points[None], np.array([len(points)]), epsilon)
+    return points[keep[0]]
+
+
+def get_tolerance(zoom: float) -> float:
+    """
+    Simplification tolerance at a zoom level (in degrees).
+    """
+    return TOLERANCE_PIXELS * 360 / (TILE_SIZE * 2 ** zoom)
+
+
+class TrailBuffer:
+    """
+    Thread-safe ring buffers of the last positions of flights.
+
+    Memory is allocated once: `max_flights` slots of `length` positions.
+    When all slots are in use, the flights seen least recently lose
+    their trail to make room for new ones.
+    """
+
+    def __init__(self, length: int = 32, max_flights: int = 20_000):
+        """
+        Constructor.
+
+        Args:
+            length (int): Number of positions kept per flight.
+            max_flights (int): Number of flights with a trail.
+        """
+        self.length = length
+        self.max_flights = max_flights
+        # Latitude and longitude of each position, float32 is precise
+        # to about a meter
+        self.positions = np.zeros((max_flights, length, 2), dtype=np.float32)
+        # Slot of the next position
+        self.heads = np.zeros(max_flights, dtype=np.int32)
+        self.counts = np.zeros(max_flights, dtype=np.int32)
+        # Number of positions ever appended, identifies the trail content
+        self.versions = np.zeros(max_flights, dtype=np.int64)
+        self.last_seen = np.full(max_flights, -np.inf)
+        # Time of the newest snapshot applied to each trail
+        self.updated_at = np.full(max_flights, -np.inf)
+        self.slot_ids: List[Optional[str]] = [None] * max_flights
+        self.slots: Dict[str, int] = {}
+        self._free = list(range(max_flights - 1, -1, -1))
+        self._applied: "OrderedDict[Hashable, None]" = OrderedDict()
+        # Simplified trails: slot -> (version, zoom, positions)
+        self._simplified: Dict[int, Tuple[int, int, List[List[float]]]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory used by the arrays (in bytes).
+        """
+        return sum(array.nbytes for array in (
+            self.positions, self.heads, self.counts, self.versions, self.last_seen, self.updated_at
+        ))
+
+    def update(self, table: FlightTable, timestamp: float, key: Optional[Hashable] = None) -> None:
+        """
+        Append the positions of a snapshot to the trails of its flights.
+        Positions equal to the last one of a trail are skipped, as well as
+        positions not newer than the last snapshot applied to a trail:
+        snapshots of overlapping queries may be read out of time order.
+
+        Args:
+            table (FlightTable): Flights.
+            timestamp (float): Time of the snapshot.
+            key (Hashable): Identifier of the snapshot, a snapshot
+                already applied is ignored.
+        """
+        with self._lock:
+            if key is not None:
+                if key in self._applied:
+                    return
+                self._applied[key] = None
+                if len(self._applied) > MAX_APPLIED:
+                    self._applied.popitem(last=False)
+            ids = table.id.tolist()
+            slots = np.fromiter((self.slots.get(flight_id, -1) for flight_id in ids), dtype=np.int64, count=len(ids))
+            known = slots[slots >= 0]
+            self.last_seen[known] = np.maximum(self.last_seen[known], timestamp)
+            new = np.flatnonzero(slots < 0)
+            if len(new):
+                slots[new] = self._allocate([ids[row] for row in new.tolist()], timestamp)
+            points = np.stack([table.latitude, table.longitude], axis=1).astype(np.float32)
+            points = points[slots >= 0]
+            slots = slots[slots >= 0]
+            self.last_seen[slots] = np.maximum(self.last_seen[slots], timestamp)
+            newer = self.updated_at[slots] < timestamp
+            slots, points = slots[newer], points[newer]
+            self.updated_at[slots] = timestamp
+            # Compare with the last position of each trail
+            last = self.positions[slots, (self.heads[slots] - 1) % self.length]
+            changed = (self.counts[slots] == 0) | np.any(last != points, axis=1)
+            slots, points = slots[changed], points[changed]
+            self.positions[slots, self.heads[slots]] = points
+            self.heads[slots] = (self.heads[slots] + 1) % self.length
+            self.counts[slots] = np.minimum(self.counts[slots] + 1, self.length)
+            self.versions[slots] += 1
+
+    def _allocate(self, ids: List[str], timestamp: float) -> np.ndarray:
+        """
+        Slots for new flights, evicting the least recently seen ones if
+        there are not enough free slots.
+        """
+        missing = len(ids) - len(self._free)
+        if missing > 0:
+            # Flights of the current snapshot are never evicted
+            candidates = np.flatnonzero((self.last_seen < timestamp) & np.isfinite(self.last_seen))
+            oldest = candidates[np.argsort(self.last_seen[candidates], kind="stable")[:missing]]
+            for slot in oldest.tolist():
+                del self.slots[self.slot_ids[slot]]
+                self._release(slot)
+        slots = np.full(len(ids), -1, dtype=np.int64)
+        # Beyond max_flights flights in one snapshot, the last ones get no trail
+        for row, flight_id in enumerate(ids[:len(self._free)]):
+            slot = self._free.pop()
+            self.slots[flight_id] = slot
+            self.slot_ids[slot] = flight_id
+            slots[row] = slot
+        return slots
+
+    def _release(self, slot: int) -> None:
+        self.slot_ids[slot] = None
+        self.heads[slot] = 0
+        self.counts[slot] = 0
+        self.last_seen[slot] = -np.inf
+        self.updated_at[slot] = -np.inf
+        self._simplified.pop(slot, None)
+        self._free.append(slot)
+
+    def trail(self, flight_id: str) -> np.ndarray:
+        """
+        Positions of a flight, oldest first, shape (n, 2).
+        """
+        with self._lock:
+            slot = self.slots.get(flight_id)
+            if slot is None:
+                return np.zeros((0, 2), dtype=np.float32)
+            return self._trail(slot)
+
+    def _trail(self, slot: int) -> np.ndarray:
+        count = self.counts[slot]
+        rows = (self.heads[slot] - count + np.arange(count)) % self.length
+        return self.positions[slot, rows]
+
+    def _simplify(self, slots: np.ndarray, zoom_level: int) -> None:
+        """
+        Simplify the trails of some slots and cache the result.
+        """
+        counts = self.counts[slots]
+        # Positions of each trail, oldest first
+        rows = (self.heads[slots, None] - counts[:, None] + np.arange(self.length)) % self.length
+        points = self.positions[slots[:, None], rows].astype(np.float64)
+        keep = simplify_many(points, counts, get_tolerance(zoom_level))
+        points = np.round(points, 5)
+        for slot, version, trail, kept in zip(
+            slots.tolist(), self.versions[slots].tolist(), points, keep
+        ):
+            self._simplified[slot] = (version, zoom_level, trail[kept].tolist())
+
+    def get_trails(self, flight_ids: Sequence[str], zoom: float) -> Dict[str, Tuple[Hashable, List]]:
+        """
+        Simplified trails of flights, for display.
+
+        Args:
+            flight_ids (Sequence[str]): Flights.
+            zoom (float): Zoom level of the map.
+
+        Returns:
+            Dict[str, Tuple[Hashable, List]]: For each flight with at
+                least two positions, a key identifying the content of
+                the trail and its simplified positions.
+        """
+        zoom_level = int(zoom)
+        trails = {}
+        with self._lock:
+            slots = np.array([self.slots.get(flight_id, -1) for flight_id in flight_ids], dtype=np.int64)
+            shown = slots >= 0
+            shown[shown] = self.counts[slots[shown]] >= 2
+            ids = [flight_id for flight_id, is_shown in zip(flight_ids, shown.tolist()) if is_shown]
+            slots = slots[shown]
+            versions = self.versions[slots]
+            stale = [
+                row for row, (slot, version) in enumerate(zip(slots.tolist(), versions.tolist()))
+                if self._simplified.get(slot, (None, None))[:2] != (version, zoom_level)
+            ]
+            if stale:
+                self._simplify(slots[stale], zoom_level)
+            for flight_id, slot, version in zip(ids, slots.tolist(), versions.tolist()):
+                trails[flight_id] = ((version, zoom_level), self._simplified[slot][2])
+        return trails
+
+
+class TrailDiff(NamedTuple):
+    """
+    Differences between the trails displayed and new trails.
+
+    Attributes:
+        removed (List[int]): Positions of the trails that disappeared.
+        changed (List[Tuple[int, List]]): Positions and new points of
+            the trails that changed.
+        added (List[List]): Points of the new trails.
+        displayed (List[Tuple[str, Hashable]]): Flight ids and keys of
+            the trails once the diff is applied, in order.
+    """
+    removed: List[int]
+    changed: List[Tuple[int, List]]
+    added: List[List]
+    displayed: List[Tuple[str, Hashable]]
+
+
+def diff_trails(
+    previous: Sequence[Tuple[str, Hashable]],
+    trails: Dict[str, Tuple[Hashable, List]],
+) -> TrailDiff:
+    """
+    Compare the trails displayed with new trails, in the manner of
+    `markers.diff_snapshots`.
+
+    Args:
+        previous (Sequence[Tuple[str, Hashable]]): Flight id and trail
+            key of the trails displayed, in order.
+        trails (Dict[str, Tuple[Hashable, List]]): New trails, as
+            returned by TrailBuffer.get_trails.
+
+    Returns:
+        TrailDiff: Differences.
+    """
+    remaining = dict(trails)
+    removed = []
+    changed = []
+    displayed = []
+    for position, (flight_id, key) in enumerate(previous):
+        trail = remaining.pop(flight_id, None)
+        if trail is None:
+            removed.append(position)
+            continue
+        displayed.append((flight_id, trail[0]))
+        if trail[0] != key:
+            changed.append((position, trail[1]))
+    displayed.extend((flight_id, key) for flight_id, (key, _) in remaining.items())
+    return TrailDiff(
+        removed=removed,
+        changed=changed,
+        added=[positions for _, positions in remaining.values()],
+        displayed=displayed,
+    )
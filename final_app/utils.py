@@ -1,12 +1,93 @@
 """
 Utils.
 """
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Sequence, TYPE_CHECKING
+from concurrent.futures import Executor, ThreadPoolExecutor
+import functools
+import json
 import math
+import os
+import time
 import numpy as np
 from FlightRadar24 import FlightRadar24API
+from metrics import COUNT_BUCKETS, Counter, Histogram
+from snapshot import FlightTable
+if TYPE_CHECKING:
+    from tiling import TiledFetcher
 
 
+def get_sprite_url() -> str:
+    """
+    Get the URL of the plane icons sprite sheet, whose content-hashed
+    name is written to the assets manifest by build_icons.py.
+
+    Returns:
+        str: Asset URL.
+    """
+    manifest = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "planes.json")
+    try:
+        with open(manifest) as f:
+            return "/assets/" + json.load(f)["sprite"]
+    except FileNotFoundError:
+        raise RuntimeError(
+            f"{manifest} not found, build the plane icons with: python final_app/build_icons.py"
+        ) from None
+
+
+# Icons are built once and shared by all markers. They are all frames
+# of the sprite sheet generated by build_icons.py in the assets folder.
+ANGLE_STEP = 15
+ROUND_ANGLES = tuple(range(0, 360, ANGLE_STEP))
+SPRITE_URL = get_sprite_url()
+# Pseudo zone covering all the top-level zones
+WORLD_ZONE = "world"
+# Bounded pool shared by all concurrent upstream requests
+FETCH_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="flight-fetch")
+PLANE_ICONS = tuple(
+    dict(
+        iconUrl=SPRITE_URL,
+        iconSize=[38, 38],
+        className=f"plane-icon plane-icon-{round_angle}",
+    ) for round_angle in ROUND_ANGLES
+)
+
+
+# Upstream fetch metrics, labelled by fetch function
+FETCH_DURATION = Histogram(
+    "flight_fetch_duration_seconds", "Duration of the FlightRadar24 fetches.",
+    labelnames=("function",),
+)
+FETCH_FLIGHTS = Histogram(
+    "flight_fetch_flights", "Number of flights returned by a fetch.",
+    buckets=COUNT_BUCKETS, labelnames=("function",),
+)
+FETCH_ERRORS = Counter(
+    "flight_fetch_errors_total", "Number of failed fetches.", labelnames=("function",),
+)
+
+
+def instrumented(function):
+    """
+    Decorator recording the duration, result size and errors of a fetch
+    function.
+    """
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            FETCH_ERRORS.inc(1, name)
+            raise
+        FETCH_DURATION.observe(time.perf_counter() - start, name)
+        FETCH_FLIGHTS.observe(len(result), name)
+        return result
+    return wrapper
+
+
+@instrumented
 def fetch_flight_data(
     client: FlightRadar24API,
     airline_icao: Optional[str] = None,
@@ -49,36 +130,234 @@ def fetch_flight_data(
     ]
 
 
-def update_rotation_angles(data: Dict, previous_data: Dict) -> None:
+@instrumented
+def fetch_flight_table(
+    client: FlightRadar24API,
+    airline_icao: Optional[str] = None,
+    aircraft_type: Optional[str] = None,
+    zone_str: Optional[str] = None,
+    bounds: Optional[str] = None,
+    tiler: Optional["TiledFetcher"] = None,
+) -> FlightTable:
+    """
+    Columnar version of `fetch_flight_data`.
+
+    Args:
+        client (FlightRadar24API): FlightRadar24API client.
+        airline_icao (str): ICAO code of the airline.
+        aircraft_type (str): Type of aircraft.
+        zone_str (str): Zone string, ignored if bounds are given. It can
+            be several comma-separated zones, or WORLD_ZONE for all the
+            top-level zones, which are then fetched concurrently.
+        bounds (str): Bounds "y1,y2,x1,x2" (north, south, west, east).
+        tiler (TiledFetcher): If given, areas are split into tiles to
+            work around the per-request flight limit.
+
+    Returns:
+        FlightTable: Flights.
+    """
+    if bounds is not None:
+        if tiler is not None:
+            return tiler.fetch([bounds], airline_icao, aircraft_type)
+        return fetch_bounds_flight_table(client, bounds, airline_icao, aircraft_type)
+
+    zones = client.get_zones()
+    if zone_str == WORLD_ZONE:
+        zone_strs = list(zones)
+    else:
+        zone_strs = zone_str.split(",")
+    return fetch_zones_flight_table(
+        client, zone_strs, airline_icao, aircraft_type, zones=zones, tiler=tiler
+    )
+
+
+def fetch_bounds_flight_table(
+    client: FlightRadar24API,
+    bounds: str,
+    airline_icao: Optional[str] = None,
+    aircraft_type: Optional[str] = None,
+) -> FlightTable:
+    """
+    Fetch the flights of an area with a single upstream request.
+
+    Args:
+        client (FlightRadar24API): FlightRadar24API client.
+        bounds (str): Bounds "y1,y2,x1,x2" (north, south, west, east).
+        airline_icao (str): ICAO code of the airline.
+        aircraft_type (str): Type of aircraft.
+
+    Returns:
+        FlightTable: Flights.
+    """
+    flights = client.get_flights(
+        aircraft_type=aircraft_type,
+        airline=airline_icao,
+        bounds=bounds
+    )
+    return FlightTable.from_flights(flights)
+
+
+def fetch_zones_flight_table(
+    client: FlightRadar24API,
+    zone_strs: Sequence[str],
+    airline_icao: Optional[str] = None,
+    aircraft_type: Optional[str] = None,
+    zones: Optional[Dict[str, Dict]] = None,
+    executor: Executor = FETCH_EXECUTOR,
+    tiler: Optional["TiledFetcher"] = None,
+) -> FlightTable:
+    """
+    Fetch several zones concurrently and merge the results. Flights
+    found in overlapping zones are only kept once.
+
+    Args:
+        client (FlightRadar24API): FlightRadar24API client.
+        zone_strs (Sequence[str]): Zone strings.
+        airline_icao (str): ICAO code of the airline.
+        aircraft_type (str): Type of aircraft.
+        zones (Dict): Result of `client.get_zones()`, fetched if missing.
+        executor (Executor): Pool running the requests.
+        tiler (TiledFetcher): If given, zones are split into tiles to
+            work around the per-request flight limit.
+
+    Returns:
+        FlightTable: Flights.
+    """
+    if zones is None:
+        zones = client.get_zones()
+    bounds_list = [client.get_bounds(zones[zone_str]) for zone_str in zone_strs]
+    if tiler is not None:
+        return tiler.fetch(bounds_list, airline_icao, aircraft_type)
+    futures = [
+        executor.submit(
+            fetch_bounds_flight_table, client, bounds, airline_icao, aircraft_type
+        ) for bounds in bounds_list
+    ]
+    return FlightTable.concat([future.result() for future in futures])
+
+
+def get_viewport_bounds(
+    map_bounds: Optional[List[List[float]]],
+    zoom: Optional[float],
+    margin: float = 0.25,
+) -> Optional[str]:
+    """
+    Get the bounds to fetch for a map viewport.
+
+    The viewport is enlarged by a margin and snapped outwards to a grid
+    whose step is the width of a map tile at the given zoom, so that
+    nearby viewports give the same bounds and share their fetches.
+
+    Args:
+        map_bounds (List[List[float]]): Bounds of the dl.Map,
+            [[south, west], [north, east]].
+        zoom (float): Zoom of the map.
+        margin (float): Margin, as a fraction of the viewport size.
+
+    Returns:
+        str: Bounds "y1,y2,x1,x2" (north, south, west, east),
+            None if the viewport is unknown.
+    """
+    if not map_bounds or zoom is None:
+        return None
+    (south, west), (north, east) = map_bounds
+    lat_margin = (north - south) * margin
+    lon_margin = (east - west) * margin
+    step = 360 / 2 ** max(int(zoom), 0)
+    north = min(math.ceil((north + lat_margin) / step) * step, 90)
+    south = max(math.floor((south - lat_margin) / step) * step, -90)
+    west = max(math.floor((west - lon_margin) / step) * step, -180)
+    east = min(math.ceil((east + lon_margin) / step) * step, 180)
+    return f"{north},{south},{west},{east}"
+
+
+def update_rotation_angles(data: List[Dict], previous_data: List[Dict]) -> None:
     """
     Update rotation angles for flight data.
+
+    Flights are joined with their previous position by id, and all
+    bearings are then computed in a single vectorized pass.
     """
-    for idx, flight_data in enumerate(data):
-        identifier = flight_data["id"]
-        if identifier not in [data["id"] for data in previous_data]:
-            bearing = 0
+    previous_by_id = {flight["id"]: flight for flight in previous_data}
+    matched = []
+    matched_previous = []
+    for flight_data in data:
+        previous_flight_data = previous_by_id.get(flight_data["id"])
+        if previous_flight_data is None:
+            flight_data.update(rotation_angle=0)
         else:
-            previous_flight_data = next(item for item in previous_data if item["id"] == identifier)
-            longitude = flight_data["longitude"]
-            latitude = flight_data["latitude"]
-            previous_longitude = previous_flight_data["longitude"]
-            previous_latitude = previous_flight_data["latitude"]
-
-            # If no change keep previous bearing
-            if (longitude == previous_longitude) & (latitude == previous_latitude):
-                bearing = previous_flight_data["rotation_angle"]
-            else:
-                bearing = bearing_from_positions(
-                    longitude,
-                    latitude,
-                    previous_longitude,
-                    previous_latitude,
-                )
+            matched.append(flight_data)
+            matched_previous.append(previous_flight_data)
+    if not matched:
+        return
+
+    longitudes = np.array([flight["longitude"] for flight in matched], dtype=float)
+    latitudes = np.array([flight["latitude"] for flight in matched], dtype=float)
+    previous_longitudes = np.array(
+        [flight["longitude"] for flight in matched_previous], dtype=float
+    )
+    previous_latitudes = np.array(
+        [flight["latitude"] for flight in matched_previous], dtype=float
+    )
+    previous_angles = np.array(
+        [flight.get("rotation_angle", 0) for flight in matched_previous], dtype=float
+    )
+
+    bearings = bearings_from_positions(
+        longitudes,
+        latitudes,
+        previous_longitudes,
+        previous_latitudes,
+    )
+    # If no change keep previous bearing
+    unchanged = (longitudes == previous_longitudes) & (latitudes == previous_latitudes)
+    bearings = np.where(unchanged, previous_angles, bearings)
 
+    for flight_data, bearing in zip(matched, bearings.tolist()):
         flight_data.update(rotation_angle=bearing)
     return
 
 
+def get_rotation_angles(
+    table: FlightTable,
+    previous_table: FlightTable,
+    previous_angles: np.ndarray,
+) -> np.ndarray:
+    """
+    Columnar version of `update_rotation_angles`.
+
+    Args:
+        table (FlightTable): Flights.
+        previous_table (FlightTable): Flights of the previous snapshot.
+        previous_angles (np.ndarray): Rotation angles of the previous
+            flights.
+
+    Returns:
+        np.ndarray: Rotation angle of each flight, 0 for new flights.
+    """
+    angles = np.zeros(len(table))
+    previous_rows = previous_table.rows(table.id.tolist())
+    matched = np.flatnonzero(previous_rows >= 0)
+    if not len(matched):
+        return angles
+    previous_rows = previous_rows[matched]
+
+    longitudes = table.longitude[matched]
+    latitudes = table.latitude[matched]
+    previous_longitudes = previous_table.longitude[previous_rows]
+    previous_latitudes = previous_table.latitude[previous_rows]
+    bearings = bearings_from_positions(
+        longitudes,
+        latitudes,
+        previous_longitudes,
+        previous_latitudes,
+    )
+    # If no change keep previous bearing
+    unchanged = (longitudes == previous_longitudes) & (latitudes == previous_latitudes)
+    angles[matched] = np.where(unchanged, previous_angles[previous_rows], bearings)
+    return angles
+
+
 def bearing_from_positions(
     longitude: float,
     latitude: float,
@@ -116,6 +395,37 @@ def bearing_from_positions(
     return bearing_deg
 
 
+def bearings_from_positions(
+    longitudes: np.ndarray,
+    latitudes: np.ndarray,
+    previous_longitudes: np.ndarray,
+    previous_latitudes: np.ndarray,
+) -> np.ndarray:
+    """
+    Vectorized version of `bearing_from_positions`, computing
+    the bearings of many flights at once.
+
+    Args:
+        longitudes (np.ndarray): Longitudes (in degrees).
+        latitudes (np.ndarray): Latitudes (in degrees).
+        previous_longitudes (np.ndarray): Previous longitudes (in degrees).
+        previous_latitudes (np.ndarray): Previous latitudes (in degrees).
+
+    Returns:
+        np.ndarray: Bearings in degrees.
+    """
+    lat1 = np.radians(previous_latitudes)
+    lon1 = np.radians(previous_longitudes)
+    lat2 = np.radians(latitudes)
+    lon2 = np.radians(longitudes)
+    dlon = lon2 - lon1
+    cos_lat2 = np.cos(lat2)
+    y = np.sin(dlon) * cos_lat2
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * cos_lat2 * np.cos(dlon)
+    bearing_deg = np.degrees(np.arctan2(y, x))
+    return (bearing_deg + 360) % 360
+
+
 def get_closest_round_angle(angle: float) -> int:
     """
     Get closest round angle (multiple of 15 degrees)
@@ -130,22 +440,24 @@ def get_closest_round_angle(angle: float) -> int:
             165, 180, 195, 210, 225, 240, 255, 270,
             285, 300, 315, 330, 345.
     """
-    round_angles = [
-        0, 15, 30, 45, 60, 75, 90,
-        105, 120, 135, 150, 165, 180,
-        195, 210, 225, 240, 255, 270,
-        285, 300, 315, 330, 345, 360,
-    ]
-    differences = np.array([
-        angle - round_angle for round_angle in round_angles
-    ])
-    abs_differences = np.abs(differences)
-    closest_angle_idx = abs_differences.argmin()
-    closest_angle = round_angles[closest_angle_idx]
-    if closest_angle == 360:
-        return 0
-    else:
-        return closest_angle
+    # Ties are resolved towards the smallest angle
+    return ROUND_ANGLES[math.ceil(angle / ANGLE_STEP - 0.5) % len(ROUND_ANGLES)]
+
+
+def get_angle_buckets(angles: np.ndarray) -> np.ndarray:
+    """
+    Vectorized version of `get_closest_round_angle`, returning
+    for each angle the index of the closest round angle in
+    `ROUND_ANGLES` (and `PLANE_ICONS`).
+
+    Args:
+        angles (np.ndarray): Angles (in degrees).
+
+    Returns:
+        np.ndarray: Indices between 0 and 23.
+    """
+    buckets = np.ceil(np.asarray(angles, dtype=float) / ANGLE_STEP - 0.5)
+    return buckets.astype(np.intp) % len(ROUND_ANGLES)
 
 
 def get_custom_icon(round_angle: int) -> Dict:
@@ -157,10 +469,6 @@ def get_custom_icon(round_angle: int) -> Dict:
         round_angle (int): Round angle.
 
     Returns:
-        Dict: Icon dict.
+        Dict: Icon dict, shared between all calls: it must not be modified.
     """
-    icon_url = f'https://github.com/tomseimandi/flightradar/blob/main/img/plane_{round_angle}.png?raw=true'
-    return dict(
-        iconUrl=icon_url,
-        iconSize=[38, 38],
-    )
+    return PLANE_ICONS[round_angle // ANGLE_STEP]
@@ -0,0 +1,148 @@
+"""
+Compact wire format of the map layers.
+
+Instead of dash-leaflet components, update_graph_live sends a single
+`wire` store per tick, from which the browser builds and updates the
+markers and trails (assets/markers.js):
+    - coordinates are integers, degrees multiplied by a power of ten
+      chosen so that one unit is about a pixel at the current zoom;
+    - icons are indices into a table sent once with the layout;
+    - values are grouped by column, so that keys are not repeated for
+      every marker, and trails are delta-encoded;
+    - marker and popup ids, styles and other constant props are added
+      by the browser.
+
+A wire store looks like:
+
+    {
+        "version": "3f2a...",           # version of the markers, unique
+        "base": "9c41...",              # version the update applies to
+        "full": false,                  # rebuild instead of update
+        "scale": 1000,                  # coordinate multiplier
+        "markers": {
+            "moved": {"index": [...], "lat": [...], "lon": [...]},
+            "rotated": {"index": [...], "icon": [...]},
+            "updated": {"index": [...], "count": [...]},
+            "removed": [...],
+            "added": {"id": [...], "lat": [...], "lon": [...], "icon": [...], "count": [...]},
+        },
+        "trails": {"changed": {"index": [...], "points": [...]}, "removed": [...], "added": [...]},
+        "motion": {...},                # see motion.get_motion
+    }
+
+Updates follow the order of the former Dash patches: properties are
+changed at the previous positions, then removed elements are deleted
+and new ones appended. The browser only applies an update to the
+markers of its base version, and reports the version it displays: the
+server sends a full rebuild when that version is not the one it stored.
+"""
+from typing import Dict, List, Optional, Sequence
+import math
+import numpy as np
+from clustering import TILE_SIZE
+from markers import FLIGHT_MARKER, FLIGHT_POPUP, Markers, SnapshotDiff
+from trails import TRAIL_STYLE, TrailDiff
+from utils import PLANE_ICONS
+
+
+# Bounds of the number of decimals of the coordinates
+MIN_PRECISION = 2
+MAX_PRECISION = 6
+
+
+def get_precision(zoom: Optional[float]) -> int:
+    """
+    Number of decimals of the coordinates for which one unit is at most
+    a pixel at a zoom level.
+    """
+    if zoom is None:
+        return MAX_PRECISION
+    pixels_per_degree = TILE_SIZE * 2 ** zoom / 360
+    return min(max(math.ceil(math.log10(pixels_per_degree)), MIN_PRECISION), MAX_PRECISION)
+
+
+def get_wire_config() -> Dict:
+    """
+    Constants the browser needs to build the components: icon table,
+    pattern-matching id types and trail style. Sent once with the layout.
+    """
+    return {
+        "icons": list(PLANE_ICONS),
+        "marker": FLIGHT_MARKER,
+        "popup": FLIGHT_POPUP,
+        "trail": TRAIL_STYLE,
+    }
+
+
+def encode_coordinates(values: Sequence[float], scale: int) -> List[int]:
+    """
+    Coordinates as integers, multiplied by `scale`.
+    """
+    return np.round(np.asarray(values, dtype=np.float64) * scale).astype(np.int64).tolist()
+
+
+def encode_items(markers: Markers, scale: int) -> Dict[str, List]:
+    """
+    Columns of new markers (count is 0 for flights).
+    """
+    return {
+        "id": markers.id.tolist(),
+        "lat": encode_coordinates(markers.latitude, scale),
+        "lon": encode_coordinates(markers.longitude, scale),
+        "icon": markers.icon.tolist(),
+        "count": markers.cluster_size.tolist(),
+    }
+
+
+def encode_markers(markers: Markers, scale: int) -> Dict:
+    """
+    Markers of a full rebuild.
+    """
+    return {"added": encode_items(markers, scale)}
+
+
+def encode_marker_diff(diff: SnapshotDiff, scale: int) -> Dict:
+    """
+    Update of the markers from a snapshot diff.
+    """
+    data = diff.data
+    return {
+        "moved": {
+            "index": diff.positions[diff.moved].tolist(),
+            "lat": encode_coordinates(data.latitude[diff.moved], scale),
+            "lon": encode_coordinates(data.longitude[diff.moved], scale),
+        },
+        "rotated": {
+            "index": diff.positions[diff.rotated].tolist(),
+            "icon": data.icon[diff.rotated].tolist(),
+        },
+        "updated": {
+            "index": diff.positions[diff.updated].tolist(),
+            "count": data.cluster_size[diff.updated].tolist(),
+        },
+        "removed": diff.removed.tolist(),
+        "added": encode_items(diff.added, scale),
+    }
+
+
+def encode_trail(positions: List, scale: int) -> List[int]:
+    """
+    Positions of a trail as a flat list of integers: the first latitude
+    and longitude, then the differences with the previous point.
+    """
+    points = np.round(np.asarray(positions, dtype=np.float64).reshape(-1, 2) * scale).astype(np.int64)
+    return np.diff(points, axis=0, prepend=0).ravel().tolist()
+
+
+def encode_trail_diff(diff: TrailDiff, scale: int) -> Dict:
+    """
+    Update of the trails from a trail diff.
+    """
+    return {
+        "changed": {
+            "index": [position for position, _ in diff.changed],
+            "points": [encode_trail(positions, scale) for _, positions in diff.changed],
+        },
+        "removed": diff.removed,
+        "added": [encode_trail(positions, scale) for positions in diff.added],
+    }
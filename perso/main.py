@@ -1,9 +1,11 @@
+import re
 import dash
-from dash import dcc
+import flask
+from dash import Patch, dcc
 from dash import html
 import dash_bootstrap_components as dbc
 import dash_leaflet as dl
-from dash.dependencies import Output, Input, State
+from dash.dependencies import Output, Input, State, MATCH
 from FlightRadar24 import FlightRadar24API
 from utils import (
     update_rotation_angles,
@@ -11,113 +13,181 @@ from utils import (
     get_custom_icon,
     fetch_flight_data
 )
+from reference import ReferenceStore
 
 # App initialization
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP, '/assets/custom.css'])
+# Hashed assets never change: let browsers cache them for a year
+HASHED_ASSET = re.compile(r"^/assets/.+\.[0-9a-f]{10}\.\w+$")
+
+
+@app.server.after_request
+def cache_hashed_assets(response):
+    if response.status_code == 200 and HASHED_ASSET.match(flask.request.path):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    return response
+
 
 # App initialization
 #app = dash.Dash(__name__)
 # FlightRadar24API client
 fr_api = FlightRadar24API()
+# Airlines and zones, read from a cache file and refreshed in the
+# background: starting does not wait for FlightRadar24
+reference = ReferenceStore(fr_api)
 
 
 default_map_children = [
-    dl.TileLayer()
+    dl.TileLayer(),
+    # marqueurs des vols, mis à jour sans recréer leur popup
+    dl.LayerGroup(id='markers'),
 ]
 
 
-# airlines list
-zones = fr_api.get_airlines()
-icao_list = [''] + [item['ICAO'] for item in zones] 
-company_name = [item['Name'] for item in zones]
+def get_marker(flight):
+    return dl.Marker(
+        id={'type': 'flight-marker', 'index': flight['id']},
+        position=[flight['latitude'], flight['longitude']],
+        # popup rempli au clic
+        children=[dl.Popup(id={'type': 'flight-popup', 'index': flight['id']})],
+        icon=get_custom_icon(
+            get_closest_round_angle(flight['rotation_angle'])
+        ),
+    )
 
-# Mapping ICAO codes to company names
-#icao_to_name = {item['ICAO']: item['Name'] for item in zones}
-icao_to_name = {'': 'toutes les compagnies'} | {item['ICAO']: item['Name'] for item in zones} 
 
-app.layout = html.Div([
-    dcc.Store(id="memory"),
-    html.Div([
-        html.Div([
-            dcc.Dropdown(
-                id='zone-dropdown',
-                options=[{'label': zone, 'value': zone} for zone in fr_api.get_zones().keys()],
-                value='europe'
-            ),
-        ], className='dropdown-container right-align'),
+def patch_markers(data, before_d):
+    """
+    Partial update of the markers: positions and icons of the flights
+    still displayed are changed in place, so that an open popup keeps
+    its content, disappeared flights are removed and new ones appended.
+
+    Returns the patch and the flights in the order of the markers.
+    """
+    flights_by_id = {flight['id']: flight for flight in data}
+    patch = Patch()
+    ordered_data = []
+    removed = []
+    for position, previous_flight in enumerate(before_d):
+        flight = flights_by_id.pop(previous_flight['id'], None)
+        if flight is None:
+            removed.append(position)
+            continue
+        ordered_data.append(flight)
+        if (flight['latitude'], flight['longitude']) != (previous_flight['latitude'], previous_flight['longitude']):
+            patch[position]['props']['position'] = [flight['latitude'], flight['longitude']]
+        angle = get_closest_round_angle(flight['rotation_angle'])
+        if angle != get_closest_round_angle(previous_flight['rotation_angle']):
+            patch[position]['props']['icon'] = get_custom_icon(angle)
+    for position in reversed(removed):
+        del patch[position]
+    added = list(flights_by_id.values())
+    if added:
+        patch.extend([get_marker(flight) for flight in added])
+    return patch, ordered_data + added
+
+
+def serve_layout():
+    # Dropdowns list the reference data known when the page is loaded
+    current = reference.get()
+    # Mapping ICAO codes to company names
+    icao_to_name = current.airline_names
+    return html.Div([
+        dcc.Store(id="memory"),
         html.Div([
-            dcc.Dropdown(
-                id='company-dropdown',
-                options=[{'label': icao_to_name[icao_choice], 'value': icao_choice} for icao_choice in icao_list],
-                value='AFR'
-            ),
-        ], className='dropdown-container right-align'),
-    ], className='Right-align'),
-    dcc.Store(id="local", storage_type="local"),
-    dcc.Store(id="session", storage_type="session"),
-    dl.Map(
-        id='map',
-        center=[56, 10],
-        zoom=6,
-        style={'width': '100%', 'height': '800px'},
-        children=default_map_children
-    ),
-    dcc.Interval(
-        id="interval-component",
-        interval=2*1000,
-        n_intervals=0
-    )
-])
+            html.Div([
+                dcc.Dropdown(
+                    id='zone-dropdown',
+                    options=[{'label': zone, 'value': zone} for zone in current.zones.keys()],
+                    value='europe'
+                ),
+            ], className='dropdown-container right-align'),
+            html.Div([
+                dcc.Dropdown(
+                    id='company-dropdown',
+                    options=[{'label': name, 'value': icao_choice} for icao_choice, name in icao_to_name.items()],
+                    value='AFR'
+                ),
+            ], className='dropdown-container right-align'),
+        ], className='Right-align'),
+        dcc.Store(id="local", storage_type="local"),
+        dcc.Store(id="session", storage_type="session"),
+        dl.Map(
+            id='map',
+            center=[56, 10],
+            zoom=6,
+            style={'width': '100%', 'height': '800px'},
+            children=default_map_children
+        ),
+        dcc.Interval(
+            id="interval-component",
+            interval=2*1000,
+            n_intervals=0
+        )
+    ])
+
+
+app.layout = serve_layout
 
 @app.callback(
-    [Output('map', 'children'), Output('memory', 'data')],
+    [Output('markers', 'children'), Output('memory', 'data')],
     [Input('interval-component', 'n_intervals'), Input('zone-dropdown', 'value'), Input('company-dropdown', 'value')],
     [State('memory', 'data')]
 )
 
 # mise à jour
 def update_graph_live(n, zone, airline_company, before_d):
-    data = fetch_flight_data(client=fr_api, airline_icao= airline_company, zone_str=zone)
+    bounds = reference.get().bounds.get(zone)
+    data = fetch_flight_data(client=fr_api, airline_icao= airline_company, zone_str=zone, bounds=bounds)
     if before_d is None:
         for flight_data in data:
             flight_data.update(rotation_angle=0)
     else:
         update_rotation_angles(data, before_d)
 
-    # Update map children by adding markers to the default tiles layer
-    children = default_map_children + [
-        dl.Marker(
-            id=flight['id'],
-            position=[flight['latitude'], flight['longitude']],
-            children=[
-                dl.Popup(html.Div([
-                    dcc.Markdown(f'''
-                        **Compagnie aérienne**: {icao_to_name[airline_company]}.
+    # Nouvelle zone ou compagnie : tous les marqueurs sont recréés
+    if before_d is None or dash.ctx.triggered_id != 'interval-component':
+        return [[get_marker(flight) for flight in data], data]
+    # Sinon seuls les marqueurs qui ont changé sont modifiés : le contenu
+    # d'une popup ouverte n'est pas effacé
+    return list(patch_markers(data, before_d))
+
 
-                         **numéro du vol**: {flight['number']}.
+# détails d'un vol, calculés uniquement au clic sur son marqueur
+@app.callback(
+    Output({'type': 'flight-popup', 'index': MATCH}, 'children'),
+    [Input({'type': 'flight-marker', 'index': MATCH}, 'n_clicks')],
+    [State('memory', 'data'), State('company-dropdown', 'value')],
+    prevent_initial_call=True
+)
+def show_flight_details(n_clicks, data, airline_company):
+    flight_id = dash.ctx.triggered_id['index']
+    flight = next((flight for flight in data or [] if flight['id'] == flight_id), None)
+    if flight is None:
+        return dash.no_update
+    return html.Div([
+        dcc.Markdown(f'''
+            **Compagnie aérienne**: {reference.get().airline_names.get(airline_company, airline_company)}.
 
-                        **Aérport d'origine**: {flight['origin_airport_iata']}.
+             **numéro du vol**: {flight['number']}.
 
-                        **Aéroport de destination**: {flight['destination_airport_iata']}.
+            **Aérport d'origine**: {flight['origin_airport_iata']}.
 
-                        **Vitesse au sol**: {round(flight['ground_speed'] *1.852)} Km/h.
+            **Aéroport de destination**: {flight['destination_airport_iata']}.
 
-                        **Vitesse verticale**: {round(flight['vertical_speed'] * 0.3048, 2)} m/s.
+            **Vitesse au sol**: {round(flight['ground_speed'] *1.852)} Km/h.
 
-                        **altitude**: {round(flight['altitude'] * 0.3048)} m.
+            **Vitesse verticale**: {round(flight['vertical_speed'] * 0.3048, 2)} m/s.
 
-                        **Position**: {'en vol' if flight['on_ground'] == 0 else 'au sol'}.
+            **altitude**: {round(flight['altitude'] * 0.3048)} m.
 
-                    ''')
-                ]))
-            ],
-            icon=get_custom_icon(
-                get_closest_round_angle(flight['rotation_angle'])
-            ),
-        ) for flight in data
-    ]
+            **Position**: {'en vol' if flight['on_ground'] == 0 else 'au sol'}.
 
-    return [children, data]
+        ''')
+    ])
 
 
 if __name__ == '__main__':
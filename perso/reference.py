@@ -0,0 +1,203 @@
+"""
+Reference data: airlines, zones, zone bounds and airports.
+
+They change rarely, so they are kept in a versioned cache file instead
+of being fetched when the app starts. The file is read on first use; if
+it is missing or stale, a background thread fetches the data from
+FlightRadar24 and rewrites it, and the app serves the cached (or
+default) data meanwhile. A new instance is thus ready without waiting
+for the upstream, even when it is unreachable.
+"""
+from typing import Any, Dict, List, NamedTuple, Optional
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from FlightRadar24 import FlightRadar24API
+
+
+logger = logging.getLogger(__name__)
+
+# Version of the cache file format, files of other versions are ignored
+CACHE_VERSION = 1
+CACHE_DIR = os.environ.get(
+    "FLIGHT_REFERENCE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+)
+# Age after which the data is fetched again (in seconds)
+MAX_AGE = 24 * 3600
+# Delay before fetching again after a failure (in seconds)
+RETRY_DELAY = 60
+# Served until the cache is filled
+DEFAULT_AIRLINES = [{"Name": "Air France", "Code": "AF", "ICAO": "AFR"}]
+DEFAULT_ZONES = {"europe": {"tl_y": 72.57, "tl_x": -16.96, "br_y": 33.57, "br_x": 53.05}}
+
+
+class ReferenceData(NamedTuple):
+    """
+    Reference data at a given time.
+
+    Attributes:
+        airlines (List[Dict]): Airlines, with `Name`, `Code` and `ICAO` keys.
+        zones (Dict[str, Dict]): Zones, by name.
+        bounds (Dict[str, str]): Bounds of the zones, in the format of
+            `FlightRadar24API.get_bounds`.
+        airports (List[Dict]): Airports, with `name`, `icao`, `iata`,
+            `country`, `latitude`, `longitude` and `altitude` keys.
+        timestamp (float): Time of the fetch, 0 for the default data.
+    """
+    airlines: List[Dict]
+    zones: Dict[str, Dict]
+    bounds: Dict[str, str]
+    airports: List[Dict]
+    timestamp: float = 0.0
+
+    @property
+    def airline_names(self) -> Dict[str, str]:
+        """
+        Names of the airlines by ICAO code, '' standing for all of them.
+        """
+        return {'': 'toutes les compagnies'} | {item['ICAO']: item['Name'] for item in self.airlines}
+
+
+def get_bounds(zone: Dict[str, float]) -> str:
+    """
+    Bounds of a zone, see `FlightRadar24API.get_bounds`.
+    """
+    return "{},{},{},{}".format(zone["tl_y"], zone["br_y"], zone["tl_x"], zone["br_x"])
+
+
+DEFAULT_REFERENCE = ReferenceData(
+    airlines=DEFAULT_AIRLINES,
+    zones=DEFAULT_ZONES,
+    bounds={name: get_bounds(zone) for name, zone in DEFAULT_ZONES.items()},
+    airports=[],
+)
+
+
+def fetch_reference(client: FlightRadar24API) -> ReferenceData:
+    """
+    Fetch reference data from FlightRadar24.
+
+    Args:
+        client (FlightRadar24API): FlightRadar24API client.
+
+    Returns:
+        ReferenceData: Reference data.
+    """
+    zones = client.get_zones()
+    return ReferenceData(
+        airlines=client.get_airlines(),
+        zones=zones,
+        bounds={name: client.get_bounds(zone) for name, zone in zones.items()},
+        airports=[
+            {
+                "name": airport.name,
+                "icao": airport.icao,
+                "iata": airport.iata,
+                "country": airport.country,
+                "latitude": airport.latitude,
+                "longitude": airport.longitude,
+                "altitude": airport.altitude,
+            } for airport in client.get_airports()
+        ],
+        timestamp=time.time(),
+    )
+
+
+def read_reference(path: str) -> Optional[ReferenceData]:
+    """
+    Read a cache file, None if it is missing, unreadable or of another
+    version.
+    """
+    try:
+        with open(path) as f:
+            content = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        logger.warning("Ignoring unreadable reference cache %s", path, exc_info=True)
+        return None
+    if content.get("version") != CACHE_VERSION:
+        return None
+    return ReferenceData(**content["data"])
+
+
+def write_reference(path: str, reference: ReferenceData) -> None:
+    """
+    Write a cache file atomically, so that concurrent readers never see
+    a partial file.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    content: Dict[str, Any] = {"version": CACHE_VERSION, "data": reference._asdict()}
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(content, f)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+class ReferenceStore:
+    """
+    Reference data loaded lazily from the cache file and refreshed in
+    the background.
+    """
+
+    def __init__(
+        self,
+        client: FlightRadar24API,
+        directory: str = CACHE_DIR,
+        max_age: float = MAX_AGE,
+    ):
+        """
+        Constructor.
+
+        Args:
+            client (FlightRadar24API): FlightRadar24API client.
+            directory (str): Directory of the cache file.
+            max_age (float): Age after which the data is fetched again
+                (in seconds).
+        """
+        self.client = client
+        self.path = os.path.join(directory, f"reference-v{CACHE_VERSION}.json")
+        self.max_age = max_age
+        self._reference: Optional[ReferenceData] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> ReferenceData:
+        """
+        Current reference data: cached, or default until the first fetch
+        succeeds. Never waits for the upstream.
+        """
+        reference = self._reference
+        if reference is not None:
+            return reference
+        with self._lock:
+            if self._reference is None:
+                self._reference = read_reference(self.path) or DEFAULT_REFERENCE
+                self._thread = threading.Thread(target=self._run, name="reference-refresh", daemon=True)
+                self._thread.start()
+            return self._reference
+
+    def _run(self) -> None:
+        while True:
+            delay = self._reference.timestamp + self.max_age - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                reference = fetch_reference(self.client)
+            except Exception as error:
+                logger.warning("Failed to fetch reference data, retrying in %ss: %s", RETRY_DELAY, error)
+                time.sleep(RETRY_DELAY)
+                continue
+            self._reference = reference
+            try:
+                write_reference(self.path, reference)
+            except OSError:
+                logger.warning("Failed to write the reference cache %s", self.path, exc_info=True)
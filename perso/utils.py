@@ -2,16 +2,42 @@
 Utils.
 """
 from typing import Dict, Optional, List
+import json
 import math
+import os
 import numpy as np
 from FlightRadar24 import FlightRadar24API
 
 
+def get_sprite_url() -> str:
+    """
+    Get the URL of the plane icons sprite sheet, whose content-hashed
+    name is written to the assets manifest by build_icons.py.
+
+    Returns:
+        str: Asset URL.
+    """
+    manifest = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "planes.json")
+    try:
+        with open(manifest) as f:
+            return "/assets/" + json.load(f)["sprite"]
+    except FileNotFoundError:
+        raise RuntimeError(
+            f"{manifest} not found, build the plane icons with: python final_app/build_icons.py"
+        ) from None
+
+
+# Plane icons are frames of the sprite sheet generated by build_icons.py
+# in the assets folder
+SPRITE_URL = get_sprite_url()
+
+
 def fetch_flight_data(
     client: FlightRadar24API,
     airline_icao: Optional[str] = None,
     aircraft_type: Optional[str] = None,
-    zone_str: Optional[str] = None
+    zone_str: Optional[str] = None,
+    bounds: Optional[str] = None
 ) -> List[Dict]:
     """
     Fetch flight data from FlightRadar24 API for
@@ -22,14 +48,17 @@ def fetch_flight_data(
         airline_icao (str): ICAO code of the airline.
         aircraft_type (str): Type of aircraft.
         zone_str (str): Zone string.
+        bounds (str): Bounds of the zone, if already known, to avoid
+            fetching the zones.
 
     Returns:
         List[Dict]: List of flights. A flight should be represented
             as a dictionary with latitude, longitude, id and additional
             keys.
     """
-    zone = client.get_zones()[zone_str]
-    bounds = client.get_bounds(zone)
+    if bounds is None:
+        zone = client.get_zones()[zone_str]
+        bounds = client.get_bounds(zone)
 
     flights = client.get_flights(
         aircraft_type=aircraft_type,
@@ -162,8 +191,8 @@ def get_custom_icon(round_angle: int) -> Dict:
     Returns:
         Dict: Icon dict.
     """
-    icon_url = f'https://github.com/tomseimandi/flightradar/blob/main/img/plane_{round_angle}.png?raw=true'
     return dict(
-        iconUrl=icon_url,
+        iconUrl=SPRITE_URL,
         iconSize=[38, 38],
+        className=f"plane-icon plane-icon-{round_angle}",
     )